@@ -0,0 +1,84 @@
+"""
+Benchmark of the DATA_ARRAY encoding used by readImage/readLastImage/readImageSeq.
+
+Compares the legacy encoding (struct.pack header + tobytes() + concatenation)
+with DataArrayHelper.DataArrayEncoder (header packed in place into a reused
+buffer, one copy of the frame). The bytes allocated per frame are measured
+with tracemalloc (peak over one encoding after the warm-up).
+
+    python benchmarks/bench_data_array.py [--width 4096] [--height 4096] [--loops 20]
+"""
+
+import argparse
+import struct
+import time
+import tracemalloc
+import numpy
+
+from lima.server import DataArrayHelper
+from lima.server.DataArrayHelper import DataArrayCategory
+
+
+def legacy_encode(d, category, data_type, pixel_size, image_number, acq_tag):
+    dims, steps = DataArrayHelper.data_array_dims(d.shape, pixel_size, category)
+    nb_dim = len(dims)
+    padding = [0] * (DataArrayHelper.DATA_ARRAY_MAX_NB_DIM - nb_dim)
+    dataheader = struct.pack(
+        DataArrayHelper.DATA_ARRAY_PACK_STR,
+        DataArrayHelper.DATA_ARRAY_MAGIC,
+        DataArrayHelper.DATA_ARRAY_VERSION,
+        DataArrayHelper.DATA_ARRAY_HEADER_LEN,
+        category,
+        data_type,
+        0,
+        nb_dim,
+        *(dims + padding),
+        *(steps + padding),
+        image_number,
+        acq_tag,
+        0,
+        0,
+    )
+    flatData = d.ravel()
+    flatData.dtype = numpy.uint8
+    return dataheader + flatData.tobytes()
+
+
+def measure_allocated(encode, data):
+    tracemalloc.start()
+    try:
+        encode(data, DataArrayCategory.Image, 2, data.itemsize, 0, 0)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run(name, encode, data, loops):
+    encode(data, DataArrayCategory.Image, 2, data.itemsize, 0, 0)  # warm-up
+    allocated = measure_allocated(encode, data)
+    t0 = time.perf_counter()
+    for i in range(loops):
+        encode(data, DataArrayCategory.Image, 2, data.itemsize, i, 0)
+    dt = (time.perf_counter() - t0) / loops
+    print(
+        "%-8s %8.2f ms/frame %8.2f GB/s %12d bytes allocated/frame"
+        % (name, dt * 1e3, data.nbytes / dt / 1e9, allocated)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=4096)
+    parser.add_argument("--height", type=int, default=4096)
+    parser.add_argument("--loops", type=int, default=20)
+    args = parser.parse_args()
+
+    data = numpy.random.randint(0, 1 << 16, (args.height, args.width), numpy.uint32)
+    print("frame: %dx%d uint32, %d bytes" % (args.width, args.height, data.nbytes))
+    run("legacy", legacy_encode, data, args.loops)
+    run("encoder", DataArrayHelper.DataArrayEncoder().encode, data, args.loops)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark of the compressed DATA_ARRAY transport (image_data_codec).
+
+Compresses a sparse photon-counting like frame with every available codec
+and compares the throughput and the reply size with the raw DATA_ARRAY.
+
+    python benchmarks/bench_data_array_codec.py [--width 2048] [--height 2048]
+        [--occupancy 0.01] [--loops 10] [--block-size 4194304]
+"""
+
+import argparse
+import time
+import numpy
+
+from lima.server import DataArrayHelper
+from lima.server.DataArrayHelper import DataArrayCategory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--height", type=int, default=2048)
+    parser.add_argument("--occupancy", type=float, default=0.01)
+    parser.add_argument("--loops", type=int, default=10)
+    parser.add_argument(
+        "--block-size", type=int, default=DataArrayHelper.DATA_ARRAY_CODEC_BLOCK_SIZE
+    )
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(0)
+    data = numpy.zeros((args.height, args.width), numpy.uint32)
+    hits = rng.random(data.shape) < args.occupancy
+    data[hits] = rng.poisson(2, hits.sum()) + 1
+
+    encoder = DataArrayHelper.DataArrayEncoder()
+    raw = encoder.encode(data, DataArrayCategory.Image, 2, data.itemsize, 0, 0)
+    print(
+        "frame: %dx%d uint32, %d bytes, occupancy %g"
+        % (args.width, args.height, data.nbytes, args.occupancy)
+    )
+    print("%-6s %10s %8s %10s %10s" % ("codec", "bytes", "ratio", "ms/frame", "GB/s"))
+    for name, codec in sorted(
+        DataArrayHelper.DATA_ARRAY_CODECS.items(), key=lambda x: x[1]
+    ):
+        compressor = DataArrayHelper.DataArrayCompressor(codec, args.block_size)
+        buffer = compressor.compress(raw)  # warm-up
+        t0 = time.perf_counter()
+        for i in range(args.loops):
+            compressor.compress(raw)
+        dt = (time.perf_counter() - t0) / args.loops
+        _, decoded = DataArrayHelper.decode_data_array(buffer)
+        assert numpy.array_equal(decoded, data)
+        print(
+            "%-6s %10d %8.1f %10.2f %10.2f"
+            % (
+                name,
+                len(buffer),
+                len(raw) / len(buffer),
+                dt * 1e3,
+                data.nbytes / dt / 1e9,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
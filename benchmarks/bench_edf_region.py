@@ -0,0 +1,126 @@
+"""
+Benchmark of the EDF region reads, EdfFile.GetData(Index, Pos=..., Size=...).
+
+Compares the legacy row by row reads (one seek, read and copy per row) with
+the reads of the file mode (one read of the span from the first to the last
+pixel of the region, then copied out) and with the mmap mode, for typical
+ROI shapes of a large frame. The nb of file calls (seek/read) of one file
+mode read is also given. The regions returned as views (mmap) are copied to a contiguous
+array, so that all the data is actually read.
+
+    python benchmarks/bench_edf_region.py [--width 4096] [--height 4096]
+        [--loops 20] [--dir /tmp]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy
+
+from lima.server import EdfFile
+
+ROIS = [
+    # name, (x, y), (width, height)
+    ("512x512 center", (1792, 1792), (512, 512)),
+    ("16x16 corner", (4000, 4000), (16, 16)),
+    ("full width x64", (0, 2000), (0, 64)),
+    ("64 x full height", (2000, 0), (64, 0)),
+]
+
+
+def legacy_region(edf, pos, size):
+    """The row by row reads of EdfFile before the region reads"""
+    image = edf.Images[0]
+    size_pixel = 2
+    sizex, sizey = image.Dim1, image.Dim2
+    size = list(size)
+    if size[0] == 0:
+        size[0] = sizex - pos[0]
+    if size[1] == 0:
+        size[1] = sizey - pos[1]
+    data = numpy.zeros((size[1], size[0]), numpy.uint16)
+    with open(edf.FileName, "rb") as f:
+        for i, y in enumerate(range(pos[1], pos[1] + size[1])):
+            f.seek(((y * sizex) + pos[0]) * size_pixel + image.DataPosition, 0)
+            data[i, :] = numpy.frombuffer(f.read(size[0] * size_pixel), numpy.uint16)
+    return data
+
+
+def contiguous(edf, pos, size):
+    """The region as a contiguous array, the views are copied (mmap pages read)"""
+    return numpy.ascontiguousarray(edf.GetData(0, Pos=pos, Size=size))
+
+
+class CountingFile:
+    """A file opened for reading that counts its seek/read calls"""
+
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        self.calls = 0
+
+    def __getattr__(self, name):
+        if name in ("seek", "read", "readinto"):
+            self.calls += 1
+        return getattr(self.file, name)
+
+
+def file_calls(filename, pos, size):
+    """The nb of file calls of one file mode region read"""
+    edf = EdfFile.EdfFile(filename, "r")
+    edf.File = CountingFile(filename)
+    edf.GetData(0, Pos=pos, Size=size)
+    return edf.File.calls
+
+
+def bench(read, loops):
+    read()  # warm-up
+    t0 = time.perf_counter()
+    for i in range(loops):
+        read()
+    return (time.perf_counter() - t0) / loops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=4096)
+    parser.add_argument("--height", type=int, default=4096)
+    parser.add_argument("--loops", type=int, default=20)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    frame = numpy.random.default_rng(0).integers(
+        0, 1 << 16, (args.height, args.width), numpy.uint16
+    )
+    fd, filename = tempfile.mkstemp(suffix=".edf", dir=args.dir)
+    os.close(fd)
+    os.remove(filename)
+    try:
+        EdfFile.EdfFile(filename).WriteImage({}, frame)
+        edf = EdfFile.EdfFile(filename, "r")
+        mapped = EdfFile.EdfFile(filename, "r", mmap=True)
+        print("frame: %dx%d uint16" % (args.width, args.height))
+        print(
+            "%-18s %12s %12s %12s %12s"
+            % ("roi", "legacy ms", "file ms", "mmap ms", "file calls")
+        )
+        for name, pos, size in ROIS:
+            expected = legacy_region(edf, pos, size)
+            assert numpy.array_equal(edf.GetData(0, Pos=pos, Size=size), expected)
+            assert numpy.array_equal(mapped.GetData(0, Pos=pos, Size=size), expected)
+            times = [
+                bench(lambda: legacy_region(edf, pos, size), args.loops),
+                bench(lambda: contiguous(edf, pos, size), args.loops),
+                bench(lambda: contiguous(mapped, pos, size), args.loops),
+            ]
+            calls = file_calls(filename, pos, size)
+            print(
+                "%-18s %12.3f %12.3f %12.3f %12d"
+                % ((name,) + tuple(t * 1e3 for t in times) + (calls,))
+            )
+    finally:
+        os.remove(filename)
+
+
+if __name__ == "__main__":
+    main()
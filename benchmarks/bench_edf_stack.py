@@ -0,0 +1,74 @@
+"""
+Benchmark of the EDF frame stack reads, EdfFile.GetDataStack.
+
+Compares the per-frame reads (one EdfFile.GetData call per frame) with the
+single read of EdfFile.GetDataStack in file mode and in mmap mode, for a dark
+stack of small frames. The stacks are copied to a contiguous array, so that
+all the data is actually read.
+
+    python benchmarks/bench_edf_stack.py [--frames 500] [--width 512]
+        [--height 512] [--loops 5] [--dir /tmp]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy
+
+from lima.server import EdfFile
+
+
+def per_frame(edf):
+    """The frames read one at a time, as getDatasFromFile used to do"""
+    return numpy.stack([edf.GetData(i) for i in range(edf.GetNumImages())])
+
+
+def stack(edf):
+    return numpy.ascontiguousarray(edf.GetDataStack())
+
+
+def bench(read, loops):
+    read()  # warm-up
+    t0 = time.perf_counter()
+    for i in range(loops):
+        read()
+    return (time.perf_counter() - t0) / loops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--loops", type=int, default=5)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    frames = numpy.random.default_rng(0).integers(
+        0, 1 << 16, (args.frames, args.height, args.width), numpy.uint16
+    )
+    fd, filename = tempfile.mkstemp(suffix=".edf", dir=args.dir)
+    os.close(fd)
+    os.remove(filename)
+    try:
+        with EdfFile.EdfFile(filename).StreamWriter() as writer:
+            for frame in frames:
+                writer.write({}, frame)
+        edf = EdfFile.EdfFile(filename, "r")
+        mapped = EdfFile.EdfFile(filename, "r", mmap=True)
+        assert numpy.array_equal(edf.GetDataStack(), frames)
+        assert numpy.array_equal(mapped.GetDataStack(), frames)
+        print("%d frames: %dx%d uint16" % (args.frames, args.width, args.height))
+        for name, read in [
+            ("per frame", lambda: per_frame(edf)),
+            ("stack", lambda: stack(edf)),
+            ("stack mmap", lambda: stack(mapped)),
+        ]:
+            print("%-12s %10.3f ms" % (name, bench(read, args.loops) * 1e3))
+    finally:
+        os.remove(filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark of the EDF writing, EdfFile.WriteImage vs EdfStreamWriter.
+
+Writes the same frames one WriteImage call per frame (open, seek, header
+and data writes, close), then with the streaming writer (file kept open,
+static header formatted once, batched os.writev), and prints the frame rate.
+
+    python benchmarks/bench_edf_write.py [--width 2048] [--height 2048]
+        [--frames 1000] [--batch-size 16] [--dir /tmp]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy
+
+from lima.server import EdfFile
+
+
+def write_image(filename, frames, args):
+    edf = EdfFile.EdfFile(filename)
+    for i, frame in enumerate(frames):
+        edf.WriteImage({"acq_frame_nb": i}, frame)
+
+
+def stream_writer(filename, frames, args):
+    edf = EdfFile.EdfFile(filename)
+    with edf.StreamWriter(args.batch_size) as writer:
+        for i, frame in enumerate(frames):
+            writer.write({"acq_frame_nb": i}, frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--height", type=int, default=2048)
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    data = numpy.random.default_rng(0).integers(
+        0, 1 << 16, (args.height, args.width), numpy.uint16
+    )
+    # the same frame over and over, only the writing is measured
+    frames = [data] * args.frames
+    print(
+        "%d frames %dx%d uint16, %.1f GB"
+        % (args.frames, args.width, args.height, data.nbytes * args.frames / 1e9)
+    )
+    print("%-14s %10s %10s" % ("writer", "FPS", "GB/s"))
+    for name, write in (("WriteImage", write_image), ("StreamWriter", stream_writer)):
+        fd, filename = tempfile.mkstemp(suffix=".edf", dir=args.dir)
+        os.close(fd)
+        os.remove(filename)
+        try:
+            t0 = time.perf_counter()
+            write(filename, frames, args)
+            dt = time.perf_counter() - t0
+            assert EdfFile.EdfFile(filename, "r").GetNumImages() == args.frames
+        finally:
+            os.remove(filename)
+        print(
+            "%-14s %10.1f %10.2f"
+            % (name, args.frames / dt, data.nbytes * args.frames / dt / 1e9)
+        )
+
+
+if __name__ == "__main__":
+    main()
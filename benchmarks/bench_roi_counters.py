@@ -0,0 +1,86 @@
+"""
+Benchmark of the RoiCounter readCounters result packing.
+
+Compares the legacy loop (one 7 values slice assignment per roi and frame)
+with RoiCounterHelper.pack_counters, on fake RoiCounterResult objects.
+
+    python benchmarks/bench_roi_counters.py [--rois 200] [--frames 256]
+        [--loops 20]
+"""
+
+import argparse
+import time
+import numpy
+
+from lima.server import RoiCounterHelper
+
+
+class Result(object):
+    """Stands for core.Processlib.Tasks.RoiCounterResult"""
+
+    __slots__ = RoiCounterHelper.RESULT_FIELDS
+
+    def __init__(self, frameNumber, value):
+        self.frameNumber = frameNumber
+        self.sum = value * 100
+        self.average = value
+        self.std = value / 10
+        self.minValue = value - 1
+        self.maxValue = value + 1
+
+
+def legacy_pack(roi_results, roi_ids):
+    """The RoiCounter.readCounters loop before pack_counters"""
+    minListSize = min(len(results) for name, results in roi_results)
+    returnArray = numpy.zeros(minListSize * len(roi_results) * 7)
+    indexArray = 0
+    for roiName, resultList in roi_results:
+        roi_id = roi_ids.get(roiName)
+        for result in resultList[:minListSize]:
+            returnArray[indexArray : indexArray + 7] = (
+                float(roi_id),
+                float(result.frameNumber),
+                result.sum,
+                result.average,
+                result.std,
+                result.minValue,
+                result.maxValue,
+            )
+            indexArray += 7
+    return returnArray
+
+
+def bench(pack, loops):
+    pack()  # warm-up
+    t0 = time.perf_counter()
+    for i in range(loops):
+        pack()
+    return (time.perf_counter() - t0) / loops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rois", type=int, default=200)
+    parser.add_argument("--frames", type=int, default=256)
+    parser.add_argument("--loops", type=int, default=20)
+    args = parser.parse_args()
+
+    roi_results = [
+        ("roi%d" % i, [Result(f, i + f / 2.0) for f in range(args.frames)])
+        for i in range(args.rois)
+    ]
+    roi_ids = {name: i for i, (name, results) in enumerate(roi_results)}
+    assert numpy.array_equal(
+        legacy_pack(roi_results, roi_ids),
+        RoiCounterHelper.pack_counters(roi_results, roi_ids),
+    )
+    print("%d rois x %d frames" % (args.rois, args.frames))
+    for name, pack in [
+        ("legacy", lambda: legacy_pack(roi_results, roi_ids)),
+        ("pack_counters", lambda: RoiCounterHelper.pack_counters(roi_results, roi_ids)),
+    ]:
+        print("%-14s %10.3f ms" % (name, bench(pack, args.loops) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
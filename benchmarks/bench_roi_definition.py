@@ -0,0 +1,86 @@
+"""
+Benchmark of the RoiCounter roi definition parsing.
+
+Compares the legacy addNames + setRois parsing (names registered one by one,
+grouper over the flat vector and an id lookup per roi) with the setNamedRois
+parsing (RoiCounterHelper.parse_rois and a single list comprehension).
+The core.Roi construction and the updateRois call, common to both, are left
+out: a tuple stands for core.Roi.
+
+    python benchmarks/bench_roi_definition.py [--rois 2000] [--loops 20]
+"""
+
+import argparse
+import itertools
+import time
+import numpy
+
+from lima.server import RoiCounterHelper
+
+
+def grouper(n, iterable, padvalue=None):
+    return zip(*[itertools.chain(iterable, itertools.repeat(padvalue, n - 1))] * n)
+
+
+def add_names(names, name2id, id2name):
+    roi_id = []
+    for roi_name in names:
+        if not roi_name in name2id:
+            name2id[roi_name] = len(name2id)
+            id2name[name2id[roi_name]] = roi_name
+        roi_id.append(name2id[roi_name])
+    return roi_id
+
+
+def legacy(names, geometry):
+    name2id, id2name = {}, {}
+    ids = add_names(names, name2id, id2name)
+    argin = numpy.column_stack((ids, geometry.reshape(-1, 4))).ravel()
+    roi_list = []
+    for roi_id, x, y, width, height in grouper(5, argin):
+        roi_name = id2name.get(roi_id, None)
+        if roi_name is None:
+            raise RuntimeError("should call add method before setRoi")
+        roi_list.append((roi_name.encode(), (x, y, width, height)))
+    return roi_list
+
+
+def named(names, geometry):
+    name2id, id2name = {}, {}
+    geometry = RoiCounterHelper.parse_rois(names, geometry)
+    add_names(names, name2id, id2name)
+    return [
+        (name.encode(), (x, y, width, height))
+        for name, (x, y, width, height) in zip(names, geometry.tolist())
+    ]
+
+
+def bench(parse, loops):
+    parse()  # warm-up
+    t0 = time.perf_counter()
+    for i in range(loops):
+        parse()
+    return (time.perf_counter() - t0) / loops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rois", type=int, default=2000)
+    parser.add_argument("--loops", type=int, default=20)
+    args = parser.parse_args()
+
+    names = ["roi%d" % i for i in range(args.rois)]
+    geometry = numpy.arange(1, 4 * args.rois + 1, dtype=numpy.int32)
+    assert [r for n, r in legacy(names, geometry)] == [
+        r for n, r in named(names, geometry)
+    ]
+    print("%d rois" % args.rois)
+    for name, parse in [
+        ("legacy", lambda: legacy(names, geometry)),
+        ("setNamedRois", lambda: named(names, geometry)),
+    ]:
+        print("%-14s %10.3f ms" % (name, bench(parse, args.loops) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark of the RoiCounter roi sharding.
+
+Measures the frames/s of the roi evaluation versus the number of rois and of
+threads. The rois are spread over one shard per thread by
+RoiCounterHelper.ShardedRoiCounterMgr and the shards of each frame are
+evaluated in parallel by a thread pool, as the processing threads run the
+roi counter tasks of a run level. Numpy statistics on rectangles stand for
+the RoiCounterTask evaluation, numpy releasing the GIL in the reductions.
+
+    python benchmarks/bench_roi_shards.py [--rois 10,100,500] [--threads 1,2,4]
+"""
+
+import argparse
+import concurrent.futures
+import time
+import numpy
+
+from lima.server import RoiCounterHelper
+
+
+class Shard(object):
+    """Stands for a RoiCounterTaskMgr"""
+
+    def __init__(self):
+        self.rois = {}
+
+    def updateRois(self, rois):
+        for name, roi in rois:
+            self.rois[name] = roi
+
+    def process(self, frame):
+        for x, y, width, height in self.rois.values():
+            data = frame[y : y + height, x : x + width]
+            data.sum(dtype=numpy.double), data.mean(), data.std()
+            data.min(), data.max()
+
+
+def frame_rate(frames, nb_rois, nb_threads):
+    shards = [Shard() for i in range(nb_threads)]
+    mgr = RoiCounterHelper.ShardedRoiCounterMgr(shards)
+    random = numpy.random.RandomState(0)
+    mgr.updateRois(
+        [
+            (b"roi%d" % i, (x, y, 128, 128))
+            for i, (x, y) in enumerate(random.randint(0, 1900, (nb_rois, 2)))
+        ]
+    )
+    with concurrent.futures.ThreadPoolExecutor(nb_threads) as pool:
+        t0 = time.perf_counter()
+        for frame in frames:
+            list(pool.map(lambda shard: shard.process(frame), shards))
+        return len(frames) / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rois", default="10,100,500")
+    parser.add_argument("--threads", default="1,2,4")
+    parser.add_argument("--frames", type=int, default=20)
+    args = parser.parse_args()
+
+    threads = [int(n) for n in args.threads.split(",")]
+    random = numpy.random.RandomState(0)
+    frames = [
+        random.randint(0, 65535, (2048, 2048)).astype(numpy.uint16)
+        for i in range(min(args.frames, 4))
+    ]
+    frames = (frames * args.frames)[: args.frames]
+    print("%-9s" % "frames/s" + "".join("%10d thr" % n for n in threads))
+    for nb_rois in [int(n) for n in args.rois.split(",")]:
+        rates = [frame_rate(frames, nb_rois, n) for n in threads]
+        print("%4d rois" % nb_rois + "".join("%14.1f" % rate for rate in rates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark of the sparse (pixel list) rois evaluation.
+
+Compares the evaluation of many small irregular rois one by one (a numpy
+statistics call per roi, as done by one roi task per roi) with
+RoiCounterHelper.SparseRois, which evaluates all the rois of a frame at once
+as sparse matrix - vector products.
+
+    python benchmarks/bench_sparse_rois.py [--rois 5000] [--pixels 30] [--loops 10]
+"""
+
+import argparse
+import time
+import numpy
+
+from lima.server import RoiCounterHelper
+
+
+def per_roi(frame, rois):
+    flat = frame.ravel()
+    result = numpy.zeros((len(rois), 5))
+    for i, (pixels, weights) in enumerate(rois):
+        values = flat[pixels].astype(numpy.double)
+        weighted = weights * values
+        total = weighted.sum()
+        average = total / weights.sum()
+        variance = (weighted * values).sum() / weights.sum() - average**2
+        result[i, :3] = total, average, numpy.sqrt(max(variance, 0))
+        result[i, 3:] = values.min(), values.max()
+    return result
+
+
+def bench(evaluate, loops):
+    evaluate()  # warm-up
+    t0 = time.perf_counter()
+    for i in range(loops):
+        evaluate()
+    return (time.perf_counter() - t0) / loops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rois", type=int, default=5000)
+    parser.add_argument("--pixels", type=int, default=30)
+    parser.add_argument("--loops", type=int, default=10)
+    args = parser.parse_args()
+
+    random = numpy.random.RandomState(0)
+    frame = random.randint(0, 65535, (2048, 2048)).astype(numpy.uint16)
+    rois = []
+    for i in range(args.rois):
+        center = random.randint(frame.size - 100 * 2048)
+        pixels = center + random.randint(0, 10, args.pixels) * 2048
+        pixels += random.randint(0, 10, args.pixels)
+        rois.append((pixels, random.uniform(0.5, 1, args.pixels)))
+    indptr = numpy.cumsum([0] + [len(pixels) for pixels, weights in rois])
+    sparse = RoiCounterHelper.SparseRois(
+        indptr,
+        numpy.concatenate([pixels for pixels, weights in rois]),
+        numpy.concatenate([weights for pixels, weights in rois]),
+    )
+    numpy.testing.assert_allclose(per_roi(frame, rois), sparse.evaluate(frame))
+    print("%d rois of %d pixels" % (args.rois, args.pixels))
+    for name, evaluate in [
+        ("per roi", lambda: per_roi(frame, rois)),
+        ("SparseRois", lambda: sparse.evaluate(frame)),
+    ]:
+        print("%-12s %10.3f ms" % (name, bench(evaluate, args.loops) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark of the VIDEO_IMAGE encoding used by the video_last_image attribute/event.
+
+Compares the legacy encoding (struct.pack header + concatenation) with
+VideoHelper.VideoImageEncoder (cached header, frame number patched in place
+into a reused buffer, one copy of the frame).
+
+    python benchmarks/bench_video_image.py [--width 2448] [--height 2048]
+        [--bpp 1] [--loops 200]
+"""
+
+import argparse
+import struct
+import time
+
+from lima.server import VideoHelper
+
+
+def legacy_encode(mode, frame_number, width, height, data):
+    header = struct.pack(
+        VideoHelper.VIDEO_HEADER_FORMAT,
+        VideoHelper.VIDEO_MAGIC,
+        VideoHelper.VIDEO_HEADER_VERSION,
+        mode,
+        frame_number,
+        width,
+        height,
+        ord(struct.pack("=H", 1).decode()[-1]),
+        struct.calcsize(VideoHelper.VIDEO_HEADER_FORMAT),
+        0,
+        0,
+    )
+    return header + (data or b"")
+
+
+def bench(encode, args, data):
+    encode(0, 0, args.width, args.height, data)  # warm-up
+    t0 = time.perf_counter()
+    for i in range(args.loops):
+        encode(0, i, args.width, args.height, data)
+    return (time.perf_counter() - t0) / args.loops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=2448)
+    parser.add_argument("--height", type=int, default=2048)
+    parser.add_argument("--bpp", type=int, default=1)
+    parser.add_argument("--loops", type=int, default=200)
+    args = parser.parse_args()
+
+    data = bytes(args.width * args.height * args.bpp)
+    encoder = VideoHelper.VideoImageEncoder()
+    assert bytes(encoder.encode(0, 1, args.width, args.height, data)) == (
+        legacy_encode(0, 1, args.width, args.height, data)
+    )
+    print(
+        "frame: %dx%d, %d bytes/pixel, %d bytes"
+        % (args.width, args.height, args.bpp, len(data))
+    )
+    print("%-8s %10s %10s %10s" % ("encoder", "ms/frame", "FPS", "GB/s"))
+    for name, encode in (("legacy", legacy_encode), ("reused", encoder.encode)):
+        dt = bench(encode, args, data)
+        print(
+            "%-8s %10.3f %10.1f %10.2f"
+            % (name, dt * 1e3, 1 / dt, len(data) / dt / 1e9)
+        )
+
+
+if __name__ == "__main__":
+    main()
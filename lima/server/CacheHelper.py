@@ -0,0 +1,105 @@
+############################################################################
+# This file is part of LImA, a Library for Image Acquisition
+#
+# Copyright (C) : 2009-2026
+# European Synchrotron Radiation Facility
+# CS40220 38043 Grenoble Cedex 9
+# FRANCE
+# Contact: lima@esrf.fr
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# ============================================================================
+#                              HELPERS
+# ============================================================================
+#
+# Cache of the objects loaded from files, used by the plugins to share the
+# reference images (mask, flat-field, background...).
+# This module does not depend on the LIMA core so it can be used (and tested)
+# on its own.
+
+import collections
+import os
+import threading
+
+
+class FileCache(object):
+    """Process-wide cache of the objects loaded from files.
+
+    The entries are keyed by the file real path, its modification time and
+    size, so a modified file is loaded again, and by a user key (e.g. the
+    kind of object or the frame index). The least recently used entries are
+    evicted when the total size is above max_bytes. The cached objects are
+    shared by all the callers and must not be modified.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        # (path, key) -> entry key, to drop the out of date entries
+        self._current = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, path, key, load, nbytes):
+        """Returns the object loaded from path by load(path)
+
+        nbytes(obj) gives the size of the object in bytes. Exceptions raised
+        by os.stat or load are propagated and nothing is cached.
+        """
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        entry_key = (path, key, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None:
+                self._entries.move_to_end(entry_key)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+        # load outside the lock, a concurrent miss may load the file twice
+        obj = load(path)
+        size = nbytes(obj)
+        with self._lock:
+            old_key = self._current.pop((path, key), None)
+            if old_key is not None:
+                self._remove(old_key)
+            if size <= self.max_bytes:
+                self._entries[entry_key] = (obj, size)
+                self._current[(path, key)] = entry_key
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    oldest = next(iter(self._entries))
+                    del self._current[oldest[:2]]
+                    self._remove(oldest)
+        return obj
+
+    def _remove(self, entry_key):
+        obj, size = self._entries.pop(entry_key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._current.clear()
+            self._bytes = 0
+
+    @property
+    def stats(self):
+        """[hits, misses, number of entries, size in bytes]"""
+        with self._lock:
+            return [self._hits, self._misses, len(self._entries), self._bytes]
@@ -0,0 +1,440 @@
+############################################################################
+# This file is part of LImA, a Library for Image Acquisition
+#
+# Copyright (C) : 2009-2026
+# European Synchrotron Radiation Facility
+# CS40220 38043 Grenoble Cedex 9
+# FRANCE
+# Contact: lima@esrf.fr
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# ============================================================================
+#                              HELPERS
+# ============================================================================
+#
+# DATA_ARRAY DevEncoded encoding, used by the LimaCCDs readImage, readLastImage
+# and readImageSeq commands and by the last_image attribute/event.
+# This module only depends on numpy so it can be used (and tested) without
+# the LIMA core.
+
+import math
+import struct
+import zlib
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import lz4.block
+
+    LZ4 = True
+except ImportError:
+    LZ4 = False
+try:
+    import bitshuffle
+
+    BITSHUFFLE = True
+except ImportError:
+    BITSHUFFLE = False
+
+# The DATA_ARRAY definition v4
+# struct {
+# unsigned int Magic= 0x44544159;
+# unsigned short Version;
+# unsigned  short HeaderLength;
+# DataArrayCategory Category;
+# DataArrayType DataType;
+# unsigned short DataEndianness;
+# unsigned short NbDim;
+# unsigned short Dim[6]
+# unsigned int DimStepBytes[6]
+# unsigned long ImageNumber;
+# unsigned long AcqTag;
+# unsigned int pading[2];
+# } DataArrayHeaderStruct;
+
+DATA_ARRAY_VERSION = 4
+DATA_ARRAY_PACK_STR = "<IHHIIHHHHHHHHIIIIIIQQII"
+DATA_ARRAY_MAGIC = struct.unpack(">I", b"DTAY")[0]  # 0x44544159
+DATA_ARRAY_MIN_HEADER_LEN = 64  # v1/2/3 backward compat.
+DATA_ARRAY_MAX_NB_DIM = 6
+DATA_ARRAY_HEADER_LEN = struct.calcsize(DATA_ARRAY_PACK_STR)
+
+
+class DataArrayCategory:
+    ScalarStack, Spectrum, Image, SpectrumStack, ImageStack = range(5)
+
+
+# enum DataArrayType{
+# DARRAY_UINT8 = 0;
+# DARRAY_UINT16;
+# DARRAY_UINT32;
+# DARRAY_UINT64;
+# DARRAY_INT8;
+# DARRAY_INT16;
+# DARRAY_INT32;
+# DARRAY_INT64;
+# DARRAY_FLOAT32;
+# DARRAY_FLOAT64;
+# };
+DataArrayType2Dtype = [
+    numpy.uint8,
+    numpy.uint16,
+    numpy.uint32,
+    numpy.uint64,
+    numpy.int8,
+    numpy.int16,
+    numpy.int32,
+    numpy.int64,
+    numpy.float32,
+    numpy.float64,
+]
+
+
+def data_array_dtype(header):
+    """Returns the numpy dtype of a decoded DATA_ARRAY header"""
+    data_type = header["data_type"]
+    if not 0 <= data_type < len(DataArrayType2Dtype):
+        raise ValueError("Unsupported DATA_ARRAY data type %d" % data_type)
+    dtype = numpy.dtype(DataArrayType2Dtype[data_type])
+    if header["endianness"]:
+        dtype = dtype.newbyteorder(">")
+    return dtype
+
+
+# Compressed DATA_ARRAY
+#
+# The codec is given by the first padding word of the header and the
+# uncompressed block size in bytes by the second one (both 0 for raw data).
+# The payload is then split in blocks compressed independently:
+#   unsigned long long CompressedSize[NbBlocks];
+#   char CompressedBlocks[];
+# with NbBlocks = ceil(uncompressed payload size / block size)
+# Each block is, without any extra header or size prefix:
+#   ZLIB: a zlib stream (RFC 1950)
+#   LZ4: a raw lz4 block, its uncompressed size is the block size
+#   BSLZ4: the output of the bitshuffle bshuf_compress_lz4() function with
+#       the default block size (0): a sequence of big-endian unsigned int
+#       compressed size + lz4 block of bitshuffled data
+DATA_ARRAY_CODEC_NONE = 0
+DATA_ARRAY_CODEC_ZLIB = 1
+DATA_ARRAY_CODEC_LZ4 = 2
+DATA_ARRAY_CODEC_BSLZ4 = 3  # bitshuffle + lz4
+
+DATA_ARRAY_CODECS = {"NONE": DATA_ARRAY_CODEC_NONE, "ZLIB": DATA_ARRAY_CODEC_ZLIB}
+if LZ4:
+    DATA_ARRAY_CODECS["LZ4"] = DATA_ARRAY_CODEC_LZ4
+if BITSHUFFLE:
+    DATA_ARRAY_CODECS["BSLZ4"] = DATA_ARRAY_CODEC_BSLZ4
+
+DATA_ARRAY_CODEC_BLOCK_SIZE = 4 * 1024 * 1024
+_PADDING_OFFSET = DATA_ARRAY_HEADER_LEN - struct.calcsize("<II")
+
+
+def data_array_dims(shape, pixel_size, category):
+    """Returns the DATA_ARRAY (dims, steps) lists for a C-ordered array shape.
+
+    Dimensions are given fastest first, as in the header. An image given
+    as a 2D array is promoted to a 1 image stack for the ImageStack category.
+    """
+    dims = list(reversed(shape))
+    if category == DataArrayCategory.ImageStack and len(dims) == 2:
+        dims.append(1)
+    if len(dims) > DATA_ARRAY_MAX_NB_DIM:
+        raise ValueError("Invalid nb of dimensions: max is %d" % DATA_ARRAY_MAX_NB_DIM)
+    steps = []
+    step = pixel_size
+    for dim in dims:
+        steps.append(step)
+        step *= dim
+    return dims, steps
+
+
+def image_seq_frames(start, end, step, last_frame):
+    """Returns the range of frame numbers of a start:end:step sequence.
+
+    A negative end counts back from last_frame, the last available frame:
+    -1 includes it, -2 stops just before it. It is resolved before the
+    step is applied.
+    """
+    if end < 0:
+        end += last_frame + 2
+    return range(start, end, step)
+
+
+class DataArrayEncoder(object):
+    """Build DATA_ARRAY payloads in a reusable buffer.
+
+    The header is packed in place with struct.pack_into and the frame is
+    copied once, straight from the source array into the payload area,
+    through a numpy view on the buffer. The buffer (a bytearray) is kept
+    and reused as long as the payload size does not change.
+
+    As the returned buffer is overwritten by the next encode() call, each
+    thread (or call site) must use its own encoder.
+    """
+
+    def __init__(self):
+        self.__slab = None
+
+    def release(self):
+        """Drop the cached buffer"""
+        self.__slab = None
+
+    def get_buffer(self, size):
+        """Returns a bytearray of exactly `size` bytes, reusing the previous one if possible"""
+        slab = self.__slab
+        if slab is None or len(slab) != size:
+            slab = bytearray(size)
+            self.__slab = slab
+        return slab
+
+    def pack_header(
+        self, buffer, category, data_type, dtype, dims, steps, image_number, acq_tag
+    ):
+        """Pack a DATA_ARRAY header at the beginning of buffer"""
+        if not 0 <= data_type < len(DataArrayType2Dtype):
+            raise ValueError("Unsupported DATA_ARRAY data type %d" % data_type)
+        if DATA_ARRAY_HEADER_LEN < DATA_ARRAY_MIN_HEADER_LEN:
+            raise RuntimeError(
+                "Invalid header len: %d (min. expected %d)"
+                % (DATA_ARRAY_HEADER_LEN, DATA_ARRAY_MIN_HEADER_LEN)
+            )
+        nb_dim = len(dims)
+        padding = [0] * (DATA_ARRAY_MAX_NB_DIM - nb_dim)
+        big_endian = numpy.dtype(dtype.byteorder + "i4") == numpy.dtype(">i4")
+        struct.pack_into(
+            DATA_ARRAY_PACK_STR,
+            buffer,
+            0,
+            DATA_ARRAY_MAGIC,  # 4 bytes I - magic number
+            DATA_ARRAY_VERSION,  # 2 bytes H - version
+            DATA_ARRAY_HEADER_LEN,  # 2 bytes H - this header length
+            category,  # 4 bytes I - category (enum)
+            data_type,  # 4 bytes I - data type (enum)
+            big_endian,  # 2 bytes H - endianness
+            nb_dim,  # 2 bytes H - nb of dims
+            *(list(dims) + padding),  # 12 bytes H x 6 - dims
+            *(list(steps) + padding),  # 24 bytes I x 6 - stepsbytes
+            image_number,  # 8 bytes Q x 1 - imageNumber
+            acq_tag,  # 8 bytes Q x 1 - acqTag
+            0,
+            0,  # 8 bytes I x 2 - pading
+        )
+
+    def encode(self, data, category, data_type, pixel_size, image_number, acq_tag):
+        """Encode a numpy array into a DATA_ARRAY
+
+        Arguments:
+            data: numpy array (image or image stack)
+            category: DataArrayCategory
+            data_type: DataArrayType enum value
+            pixel_size: nb of bytes per pixel
+            image_number: frame number of the (first) image
+            acq_tag: acquisition tag
+
+        Returns:
+            A bytearray with the header followed by the raw data
+        """
+        dims, steps = data_array_dims(data.shape, pixel_size, category)
+        slab = self.get_buffer(DATA_ARRAY_HEADER_LEN + data.nbytes)
+        self.pack_header(
+            slab, category, data_type, data.dtype, dims, steps, image_number, acq_tag
+        )
+        payload = numpy.frombuffer(
+            slab, dtype=data.dtype, count=data.size, offset=DATA_ARRAY_HEADER_LEN
+        )
+        numpy.copyto(payload.reshape(data.shape), data)
+        return slab
+
+    def encode_stack(
+        self, frames, nb_frames, category, data_type, pixel_size, image_number, acq_tag
+    ):
+        """Encode a sequence of frames into a single DATA_ARRAY stack
+
+        The frames are gathered one at a time straight into the payload,
+        so the source of each frame can be released as soon as the next
+        one is requested.
+
+        Arguments:
+            frames: iterable of numpy arrays, all with the same shape and dtype
+            nb_frames: number of frames yielded by frames
+            category: DataArrayCategory
+            data_type: DataArrayType enum value
+            pixel_size: nb of bytes per pixel
+            image_number: frame number of the first frame
+            acq_tag: acquisition tag
+
+        Returns:
+            A bytearray with the header followed by the raw data
+        """
+        frames = iter(frames)
+        first = next(frames)
+        shape = (nb_frames,) + first.shape
+        dims, steps = data_array_dims(shape, pixel_size, category)
+        slab = self.get_buffer(DATA_ARRAY_HEADER_LEN + nb_frames * first.nbytes)
+        self.pack_header(
+            slab, category, data_type, first.dtype, dims, steps, image_number, acq_tag
+        )
+        stack = numpy.frombuffer(
+            slab,
+            dtype=first.dtype,
+            count=nb_frames * first.size,
+            offset=DATA_ARRAY_HEADER_LEN,
+        ).reshape(shape)
+        stack[0] = first
+        nb = 1
+        for frame in frames:
+            if nb == nb_frames:
+                raise ValueError("Too many frames: expected %d" % nb_frames)
+            if frame.shape != first.shape or frame.dtype != first.dtype:
+                raise ValueError("Frame #%d does not match the first frame format" % nb)
+            stack[nb] = frame
+            nb += 1
+        if nb != nb_frames:
+            raise ValueError("Missing frames: got %d, expected %d" % (nb, nb_frames))
+        return slab
+
+
+_compression_pool = None
+
+
+def get_compression_pool():
+    """Returns the thread pool shared by all the DataArrayCompressor"""
+    global _compression_pool
+    if _compression_pool is None:
+        _compression_pool = ThreadPoolExecutor(thread_name_prefix="DataArrayCodec")
+    return _compression_pool
+
+
+def _compress_block(codec, block, dtype):
+    if codec == DATA_ARRAY_CODEC_ZLIB:
+        return zlib.compress(block, 1)
+    elif codec == DATA_ARRAY_CODEC_LZ4:
+        return lz4.block.compress(block, store_size=False)
+    elif codec == DATA_ARRAY_CODEC_BSLZ4:
+        return bitshuffle.compress_lz4(numpy.frombuffer(block, dtype)).tobytes()
+    raise ValueError("Unknown DATA_ARRAY codec %d" % codec)
+
+
+def _decompress_block(codec, block, size, dtype):
+    if codec == DATA_ARRAY_CODEC_ZLIB:
+        return zlib.decompress(block)
+    elif codec == DATA_ARRAY_CODEC_LZ4:
+        if not LZ4:
+            raise RuntimeError("lz4 module is not available")
+        return lz4.block.decompress(block, uncompressed_size=size)
+    elif codec == DATA_ARRAY_CODEC_BSLZ4:
+        if not BITSHUFFLE:
+            raise RuntimeError("bitshuffle module is not available")
+        dtype = numpy.dtype(dtype)
+        data = numpy.frombuffer(block, numpy.uint8)
+        return bitshuffle.decompress_lz4(data, (size // dtype.itemsize,), dtype)
+    raise ValueError("Unknown DATA_ARRAY codec %d" % codec)
+
+
+class DataArrayCompressor(object):
+    """Compress raw DATA_ARRAY payloads.
+
+    The payload is split in blocks which are compressed in parallel by a
+    thread pool (zlib, lz4 and bitshuffle release the GIL).
+    """
+
+    def __init__(self, codec, block_size=DATA_ARRAY_CODEC_BLOCK_SIZE):
+        if codec not in DATA_ARRAY_CODECS.values():
+            raise ValueError("DATA_ARRAY codec %d is not available" % codec)
+        if block_size <= 0:
+            raise ValueError("Invalid DATA_ARRAY block size %d" % block_size)
+        self.codec = codec
+        self.block_size = block_size
+
+    def compress(self, data_array):
+        """Returns the compressed version of a raw DATA_ARRAY"""
+        if self.codec == DATA_ARRAY_CODEC_NONE:
+            return data_array
+        header = decode_data_array_header(data_array)
+        dtype = data_array_dtype(header)
+        # bitshuffle works on whole elements, at least one per block
+        itemsize = dtype.itemsize
+        block_size = max(self.block_size - self.block_size % itemsize, itemsize)
+        header_len = header["header_len"]
+        payload = memoryview(data_array)[header_len:]
+        blocks = [
+            payload[offset : offset + block_size]
+            for offset in range(0, len(payload), block_size)
+        ]
+        pool = get_compression_pool()
+        compressed = list(
+            pool.map(lambda block: _compress_block(self.codec, block, dtype), blocks)
+        )
+        sizes = numpy.array([len(c) for c in compressed], dtype="<u8")
+        head = bytearray(data_array[:header_len])
+        struct.pack_into("<II", head, _PADDING_OFFSET, self.codec, block_size)
+        return b"".join([head, sizes.tobytes()] + compressed)
+
+
+def decode_data_array_header(data_array):
+    """Returns the DATA_ARRAY header as a dict"""
+    values = struct.unpack_from(DATA_ARRAY_PACK_STR, data_array)
+    if values[0] != DATA_ARRAY_MAGIC:
+        raise ValueError("Not a DATA_ARRAY: bad magic 0x%08x" % values[0])
+    nb_dim = values[6]
+    return {
+        "version": values[1],
+        "header_len": values[2],
+        "category": values[3],
+        "data_type": values[4],
+        "endianness": values[5],
+        "dims": list(values[7 : 7 + nb_dim]),
+        "steps": list(values[13 : 13 + nb_dim]),
+        "image_number": values[19],
+        "acq_tag": values[20],
+        "codec": values[21],
+        "block_size": values[22],
+    }
+
+
+def decode_data_array(data_array):
+    """Decode a (possibly compressed) DATA_ARRAY
+
+    Returns:
+        A tuple (header dict, numpy array), the array has the C-ordered
+        shape of the data, i.e. the reversed header dims
+    """
+    header = decode_data_array_header(data_array)
+    dtype = data_array_dtype(header)
+    dims = header["dims"]
+    shape = tuple(reversed(dims))
+    size = dims[-1] * header["steps"][-1] if dims else 0
+    payload = memoryview(data_array)[header["header_len"] :]
+    codec = header["codec"]
+    if codec == DATA_ARRAY_CODEC_NONE:
+        data = numpy.frombuffer(payload, dtype, count=size // dtype.itemsize)
+        return header, data.reshape(shape)
+
+    block_size = header["block_size"]
+    nb_blocks = int(math.ceil(size / block_size))
+    sizes = numpy.frombuffer(payload, "<u8", count=nb_blocks)
+    data = numpy.empty(size, numpy.uint8)
+    offset = sizes.nbytes
+    for i, compressed_size in enumerate(sizes):
+        begin = i * block_size
+        end = min(begin + block_size, size)
+        block = payload[offset : offset + int(compressed_size)]
+        data[begin:end] = numpy.frombuffer(
+            _decompress_block(codec, block, end - begin, dtype), numpy.uint8
+        )
+        offset += int(compressed_size)
+    return header, data.view(dtype).reshape(shape)
@@ -35,13 +35,23 @@ __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
     Interface:
     ===========================
     class EdfFile:
-        __init__(self,FileName)
+        __init__(self,FileName,access=None,fastedf=None,mmap=None,index_cache=None)
         GetNumImages(self)
         def GetData(self,Index, DataType="",Pos=None,Size=None):
+        GetDataStack(self,FromIndex=0,ToIndex=None,DataType="")
         GetPixel(self,Index,Position)
         GetHeader(self,Index)
         GetStaticHeader(self,Index)
         WriteImage (self,Header,Data,Append=1,DataType="",WriteAsUnsigened=0,ByteOrder="")
+        StreamWriter(self,BatchSize=16)
+
+    IterImages(FileName,DataType="",Threads=None)
+
+    class EdfStreamWriter:
+        __init__(self,Edf,BatchSize=16)
+        write(self,Header,Data,DataType="",ByteOrder="")
+        flush(self)
+        close(self)
 
 
     Edf format assumptions:
@@ -92,9 +102,16 @@ __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 """
 DEBUG = 0
 ################################################################################
+import re
 import sys
+import json
+import mmap
+import zlib
+import queue
+import collections
 import numpy
 import os.path
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import gzip
@@ -158,6 +175,20 @@ UPPER_CASE = 1
 KEYS = 1
 VALUES = 2
 
+# header start and end lines, used to index memory-mapped files
+HEADER_START = re.compile(b"{\r?\n")
+HEADER_END = re.compile(b"}\r?\n")
+
+# compressed files are decompressed by chunks of this size
+DECOMPRESSION_CHUNK_SIZE = 1 << 20
+
+# max. number of buffers in a single os.writev call (POSIX IOV_MAX >= 1024)
+IOV_MAX = 1024
+
+# sidecar header index, see the EdfFile index_cache parameter
+INDEX_CACHE_SUFFIX = ".idx"
+INDEX_CACHE_VERSION = 1
+
 
 class Image(object):
     """ """
@@ -179,7 +210,7 @@ class Image(object):
 class EdfFile(object):
     """ """
 
-    def __init__(self, FileName, access=None, fastedf=None):
+    def __init__(self, FileName, access=None, fastedf=None, mmap=None, index_cache=None):
         """Constructor
 
         :param FileName: Name of the file (either existing or to be created)
@@ -189,6 +220,17 @@ class EdfFile(object):
         :type access: string
         :type fastedf: True to use the fastedf module
         :param fastedf: bool
+        :param mmap: True to memory-map an existing uncompressed EDF file,
+                     GetData then returns read-only views into the mapping
+                     (native byte order only, otherwise a swapped copy)
+        :type mmap: bool
+        :param index_cache: True to keep the header index of an uncompressed
+                            EDF file in a FileName.idx sidecar file, or the
+                            sidecar file path. The index is used when the file
+                            size and modification time did not change,
+                            otherwise the headers are parsed and the index
+                            written again
+        :type index_cache: bool or string
         """
         self.Images = []
         self.NumImages = 0
@@ -197,6 +239,9 @@ class EdfFile(object):
         if fastedf is None:
             fastedf = 0
         self.fastedf = fastedf
+        self.__mmap = None
+        self.__staticHeaderKey = None
+        self.__staticHeader = ""
         self.ADSC = False
         self.MARCCD = False
         self.TIFF = False
@@ -318,6 +363,34 @@ class EdfFile(object):
             self.File.close()
             return
 
+        indexCachePath = None
+        if index_cache and self.__ownedOpen:
+            if index_cache is True:
+                indexCachePath = self.FileName + INDEX_CACHE_SUFFIX
+            else:
+                indexCachePath = index_cache
+            indexCacheKey = self._indexCacheKey()
+            if self._loadIndexCache(indexCachePath, indexCacheKey):
+                if mmap:
+                    self.__mmap = self._mapFile()
+                self.__makeSureFileIsClosed()
+                return
+
+        if mmap and self.__ownedOpen:
+            self.__mmap = self._mapFile()
+            if self.__mmap is not None:
+                self._indexMapped()
+                if not self.ADSC:
+                    if indexCachePath is not None:
+                        self._saveIndexCache(indexCachePath, indexCacheKey)
+                    # the mapping stays valid once the file is closed
+                    self.__makeSureFileIsClosed()
+                    return
+                self.__mmap = None
+                self.Images = []
+                self.NumImages = 0
+                self.File.seek(0, 0)
+
         Index = 0
         line = self.File.readline()
         selectedLines = [""]
@@ -370,38 +443,10 @@ class EdfFile(object):
                 #         raise "Bad File Format"
                 self.Images[Index].DataPosition = self.File.tell()
                 # self.File.seek(int(self.Images[Index].StaticHeader["Size"]), 1)
-                StaticPar = SetDictCase(
-                    self.Images[Index].StaticHeader, UPPER_CASE, KEYS
-                )
-                if "SIZE" in StaticPar.keys():
-                    self.Images[Index].Size = int(StaticPar["SIZE"])
-                    if self.Images[Index].Size <= 0:
-                        self.NumImages = Index
-                        line = self.File.readline()
-                        continue
-                else:
-                    raise TypeError("EdfFile: Image doesn't have size information")
-                if "DIM_1" in StaticPar.keys():
-                    self.Images[Index].Dim1 = int(StaticPar["DIM_1"])
-                    self.Images[Index].Offset1 = int(StaticPar.get("Offset_1", "0"))
-                else:
-                    raise TypeError("EdfFile: Image doesn't have dimension information")
-                if "DIM_2" in StaticPar.keys():
-                    self.Images[Index].NumDim = 2
-                    self.Images[Index].Dim2 = int(StaticPar["DIM_2"])
-                    self.Images[Index].Offset2 = int(StaticPar.get("Offset_2", "0"))
-                if "DIM_3" in StaticPar.keys():
-                    self.Images[Index].NumDim = 3
-                    self.Images[Index].Dim3 = int(StaticPar["DIM_3"])
-                    self.Images[Index].Offset3 = int(StaticPar.get("Offset_3", "0"))
-                if "DATATYPE" in StaticPar.keys():
-                    self.Images[Index].DataType = StaticPar["DATATYPE"]
-                else:
-                    raise TypeError("EdfFile: Image doesn't have datatype information")
-                if "BYTEORDER" in StaticPar.keys():
-                    self.Images[Index].ByteOrder = StaticPar["BYTEORDER"]
-                else:
-                    raise TypeError("EdfFile: Image doesn't have byteorder information")
+                if not self._setStaticInfo(self.Images[Index]):
+                    self.NumImages = Index
+                    line = self.File.readline()
+                    continue
 
                 self.File.seek(self.Images[Index].Size, 1)
 
@@ -466,9 +511,155 @@ class EdfFile(object):
             self.Images[Index].StaticHeader["Offset_1"] = 0
             self.Images[Index].StaticHeader["Offset_2"] = 0
             self.Images[Index].StaticHeader["DataType"] = self.Images[Index].DataType
+        elif indexCachePath is not None:
+            self._saveIndexCache(indexCachePath, indexCacheKey)
 
         self.__makeSureFileIsClosed()
 
+    @staticmethod
+    def _setStaticInfo(image):
+        """Internal method: sets the image size, dimensions and data type
+        from its static header, returns False if the image is empty"""
+        StaticPar = SetDictCase(image.StaticHeader, UPPER_CASE, KEYS)
+        if "SIZE" in StaticPar.keys():
+            image.Size = int(StaticPar["SIZE"])
+            if image.Size <= 0:
+                return False
+        else:
+            raise TypeError("EdfFile: Image doesn't have size information")
+        if "DIM_1" in StaticPar.keys():
+            image.Dim1 = int(StaticPar["DIM_1"])
+            image.Offset1 = int(StaticPar.get("Offset_1", "0"))
+        else:
+            raise TypeError("EdfFile: Image doesn't have dimension information")
+        if "DIM_2" in StaticPar.keys():
+            image.NumDim = 2
+            image.Dim2 = int(StaticPar["DIM_2"])
+            image.Offset2 = int(StaticPar.get("Offset_2", "0"))
+        if "DIM_3" in StaticPar.keys():
+            image.NumDim = 3
+            image.Dim3 = int(StaticPar["DIM_3"])
+            image.Offset3 = int(StaticPar.get("Offset_3", "0"))
+        if "DATATYPE" in StaticPar.keys():
+            image.DataType = StaticPar["DATATYPE"]
+        else:
+            raise TypeError("EdfFile: Image doesn't have datatype information")
+        if "BYTEORDER" in StaticPar.keys():
+            image.ByteOrder = StaticPar["BYTEORDER"]
+        else:
+            raise TypeError("EdfFile: Image doesn't have byteorder information")
+        return True
+
+    def _indexCacheKey(self):
+        """Internal method: the file state the header index is valid for"""
+        stat = os.fstat(self.File.fileno())
+        return [INDEX_CACHE_VERSION, stat.st_size, stat.st_mtime_ns]
+
+    def _loadIndexCache(self, path, key):
+        """Internal method: loads the image list from the sidecar header
+        index, returns False if it is missing or out of date"""
+        try:
+            with open(path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(index, dict) or index.get("key") != key:
+            return False
+        Images = []
+        for fields in index["images"]:
+            image = Image()
+            image.__dict__.update(fields)
+            Images.append(image)
+        self.Images = Images
+        self.NumImages = index["num_images"]
+        return True
+
+    def _saveIndexCache(self, path, key):
+        """Internal method: writes the sidecar header index, the file is
+        replaced atomically and write errors are ignored (e.g. read-only
+        directory)"""
+        index = {
+            "key": key,
+            "num_images": self.NumImages,
+            "images": [image.__dict__ for image in self.Images],
+        }
+        tmpPath = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(tmpPath, "w") as f:
+                json.dump(index, f)
+            os.replace(tmpPath, path)
+        except (OSError, TypeError, ValueError):
+            if DEBUG:
+                print("Cannot write the EDF index %s" % path)
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+
+    def _mapFile(self):
+        """Internal method: returns a read-only mapping of the whole file,
+        None if the file cannot be mapped (e.g. empty)"""
+        try:
+            return mmap.mmap(self.File.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError, AttributeError):
+            return None
+
+    def _indexMapped(self):
+        """Internal method: builds the image list from the mapped headers,
+        jumping from one header to the next without reading the data"""
+        mapped = self.__mmap
+        end = len(mapped)
+        pos = 0
+        while pos < end:
+            start = HEADER_START.search(mapped, pos)
+            if start is None:
+                break
+            stop = HEADER_END.search(mapped, start.end())
+            if stop is None:
+                break
+            Index = self.NumImages
+            self.NumImages = self.NumImages + 1
+            image = Image()
+            self.Images.append(image)
+            _ParseHeader(image, mapped[start.end() : stop.start()])
+            if (Index == 0) and ("HEADER_BYTES" in image.Header):
+                self.ADSC = True
+                return
+            image.HeaderPosition = start.start()
+            image.DataPosition = stop.end()
+            if not self._setStaticInfo(image):
+                self.NumImages = Index
+                pos = image.DataPosition
+                continue
+            pos = image.DataPosition + image.Size
+
+    def _GetMappedData(self, Index, DataType="", Pos=None, Size=None):
+        """Internal method: GetData from the mapped file, returns a view
+        into the mapping unless a byte swap or a type conversion is needed"""
+        image = self.Images[Index]
+        datatype = self.__GetDefaultNumpyType__(image.DataType, index=Index)
+        NumDim = image.NumDim
+        shape = (image.Dim3, image.Dim2, image.Dim1)[3 - NumDim :]
+        count = 1
+        for dim in shape:
+            count *= dim
+        Data = numpy.frombuffer(self.__mmap, datatype, count, image.DataPosition)
+        Data = Data.reshape(shape)
+        if Pos is not None or Size is not None:
+            Pos = list(Pos or (0,) * NumDim)
+            Size = list(Size or (0,) * NumDim)
+            region = []
+            # Pos and Size are (x, y, z), the array is [z, y, x]
+            for i in reversed(range(NumDim)):
+                size = Size[i] or shape[NumDim - 1 - i] - Pos[i]
+                region.append(slice(Pos[i], Pos[i] + size))
+            Data = Data[tuple(region)]
+        if self.SysByteOrder.upper() != image.ByteOrder.upper():
+            Data = Data.byteswap()
+        if DataType != "":
+            Data = self.__SetDataType__(Data, DataType)
+        return Data
+
     def _wrapTIFF(self):
         self._wrappedInstance = TiffIO.TiffIO(
             self.File, cache_length=0, mono_output=True
@@ -547,6 +738,8 @@ class EdfFile(object):
         return self.NumImages
 
     def GetData(self, *var, **kw):
+        if self.__mmap is not None:
+            return self._GetData(*var, **kw)
         try:
             self.__makeSureFileIsOpen()
             return self._GetData(*var, **kw)
@@ -588,6 +781,8 @@ class EdfFile(object):
             raise ValueError("EdfFile: Index out of limit")
         if fastedf is None:
             fastedf = 0
+        if self.__mmap is not None:
+            return self._GetMappedData(Index, DataType, Pos, Size)
         if Pos is None and Size is None:
             if self.ADSC or self.MARCCD or self.PILATUS_CBF or self.SPE:
                 return self.__data
@@ -647,77 +842,41 @@ class EdfFile(object):
                 self.Images[Index].DataType, index=Index
             )
             size_pixel = self.__GetSizeNumpyType__(type_)
-            Data = numpy.array([], type_)
-            if self.Images[Index].NumDim == 1:
-                if Pos is None:
-                    Pos = (0,)
-                if Size is None:
-                    Size = (0,)
-                sizex = self.Images[Index].Dim1
-                Size = list(Size)
-                if Size[0] == 0:
-                    Size[0] = sizex - Pos[0]
-                self.File.seek(
-                    (Pos[0] * size_pixel) + self.Images[Index].DataPosition, 0
-                )
-                Data = numpy.frombuffer(self.File.read(Size[0] * size_pixel), type_)
-            elif self.Images[Index].NumDim == 2:
-                if Pos is None:
-                    Pos = (0, 0)
-                if Size is None:
-                    Size = (0, 0)
-                Size = list(Size)
-                sizex, sizey = self.Images[Index].Dim1, self.Images[Index].Dim2
-                if Size[0] == 0:
-                    Size[0] = sizex - Pos[0]
-                if Size[1] == 0:
-                    Size[1] = sizey - Pos[1]
-                # print len(range(Pos[1],Pos[1]+Size[1])), "LECTURES OF ", Size[0], "POINTS"
-                # print "sizex = ", sizex, "sizey = ", sizey
-                Data = numpy.zeros((Size[1], Size[0]), type_)
-                dataindex = 0
-                for y in range(Pos[1], Pos[1] + Size[1]):
-                    self.File.seek(
-                        (((y * sizex) + Pos[0]) * size_pixel)
-                        + self.Images[Index].DataPosition,
-                        0,
+            image = self.Images[Index]
+            NumDim = image.NumDim
+            dims = (image.Dim1, image.Dim2, image.Dim3)[:NumDim]
+            Pos = list(Pos) if Pos is not None else [0] * NumDim
+            Size = list(Size) if Size is not None else [0] * NumDim
+            for i in range(NumDim):
+                if Size[i] == 0:
+                    Size[i] = dims[i] - Pos[i]
+            # pixel strides of x, y and z in the file
+            strides = [1]
+            for i in range(1, NumDim):
+                strides.append(strides[-1] * dims[i - 1])
+            shape = tuple(max(sz, 0) for sz in reversed(Size))
+            if min(Size) <= 0:
+                Data = numpy.zeros(shape, type_)
+            else:
+                # the span of the file from the first to the last pixel of the
+                # region is read at once, the region is then copied out of it
+                first = sum(p * st for p, st in zip(Pos, strides))
+                last = sum((p + sz - 1) * st for p, sz, st in zip(Pos, Size, strides))
+                span = numpy.empty(last - first + 1, type_)
+                self.File.seek(image.DataPosition + first * size_pixel, 0)
+                if self.File.readinto(memoryview(span).cast("B")) != span.nbytes:
+                    raise IOError("EdfFile: Image data is truncated")
+                if span.size == numpy.prod(shape):
+                    # rows (planes) of the region are full: the span is the region
+                    Data = span.reshape(shape)
+                else:
+                    region = numpy.lib.stride_tricks.as_strided(
+                        span,
+                        shape,
+                        tuple(st * size_pixel for st in reversed(strides)),
+                        writeable=False,
                     )
-                    line = numpy.frombuffer(self.File.read(Size[0] * size_pixel), type_)
-                    Data[dataindex, :] = line[:]
-                    # Data=numpy.concatenate((Data,line))
-                    dataindex += 1
-                # print "DataSize = ",Data.shape
-                # print "Requested reshape = ",Size[1],'x',Size[0]
-                # Data = numpy.reshape(Data, (Size[1],Size[0]))
-            elif self.Images[Index].NumDim == 3:
-                if Pos is None:
-                    Pos = (0, 0, 0)
-                if Size is None:
-                    Size = (0, 0, 0)
-                Size = list(Size)
-                sizex, sizey, sizez = (
-                    self.Images[Index].Dim1,
-                    self.Images[Index].Dim2,
-                    self.Images[Index].Dim3,
-                )
-                if Size[0] == 0:
-                    Size[0] = sizex - Pos[0]
-                if Size[1] == 0:
-                    Size[1] = sizey - Pos[1]
-                if Size[2] == 0:
-                    Size[2] = sizez - Pos[2]
-                for z in range(Pos[2], Pos[2] + Size[2]):
-                    for y in range(Pos[1], Pos[1] + Size[1]):
-                        self.File.seek(
-                            ((((z * sizey + y) * sizex) + Pos[0]) * size_pixel)
-                            + self.Images[Index].DataPosition,
-                            0,
-                        )
-                        line = numpy.frombuffer(
-                            self.File.read(Size[0] * size_pixel), type_
-                        )
-                        Data = numpy.concatenate((Data, line))
-                Data = numpy.reshape(Data, (Size[2], Size[1], Size[0]))
+                    Data = numpy.ascontiguousarray(region)
 
         if self.SysByteOrder.upper() != self.Images[Index].ByteOrder.upper():
             Data = Data.byteswap()
@@ -725,6 +884,92 @@ class EdfFile(object):
             Data = self.__SetDataType__(Data, DataType)
         return Data
 
+    def GetDataStack(self, *var, **kw):
+        if self.__mmap is not None:
+            return self._GetDataStack(*var, **kw)
+        try:
+            self.__makeSureFileIsOpen()
+            return self._GetDataStack(*var, **kw)
+        finally:
+            self.__makeSureFileIsClosed()
+
+    def _GetDataStack(self, FromIndex=0, ToIndex=None, DataType=""):
+        """Returns numpy array with the data of several images, the first
+        axis being the image index
+        FromIndex:      The zero-based index of the first image
+        ToIndex:        The index after the last image, if ommited the
+                        number of images in the file
+        DataType:       The edf type of the array to be returned (see GetData)
+
+        The images must have the same dimensions, data type and byte order.
+        Their data is read at once (or mapped), the headers in between are
+        skipped by the array strides if they all have the same size.
+        """
+        if ToIndex is None:
+            ToIndex = self.NumImages
+        if FromIndex < 0 or ToIndex > self.NumImages or FromIndex >= ToIndex:
+            raise ValueError("EdfFile: Index out of limit")
+        if self.ADSC or self.MARCCD or self.PILATUS_CBF or self.SPE or self.TIFF:
+            return numpy.stack(
+                [self._GetData(i, DataType) for i in range(FromIndex, ToIndex)]
+            )
+        images = self.Images[FromIndex:ToIndex]
+        first = images[0]
+
+        def layout(image):
+            return (
+                image.NumDim,
+                image.Dim1,
+                image.Dim2,
+                image.Dim3,
+                image.Size,
+                image.DataType.upper(),
+                image.ByteOrder.upper(),
+            )
+
+        for image in images[1:]:
+            if layout(image) != layout(first):
+                raise ValueError("EdfFile: Images have different shapes or types")
+        datatype = numpy.dtype(self.__GetDefaultNumpyType__(first.DataType, FromIndex))
+        shape = (first.Dim3, first.Dim2, first.Dim1)[3 - first.NumDim :]
+        imageSize = datatype.itemsize
+        for dim in shape:
+            imageSize *= dim
+        start = first.DataPosition
+        stop = images[-1].DataPosition + imageSize
+        if self.__mmap is not None:
+            if stop > len(self.__mmap):
+                raise IOError("EdfFile: Image data is truncated")
+            buffer, offset = self.__mmap, start
+        else:
+            self.File.seek(start, 0)
+            buffer, offset = numpy.empty(stop - start, numpy.uint8), 0
+            if self.File.readinto(buffer) != stop - start:
+                raise IOError("EdfFile: Image data is truncated")
+            buffer.flags.writeable = False
+        offsets = [offset + image.DataPosition - start for image in images]
+        step = offsets[1] - offsets[0] if len(offsets) > 1 else imageSize
+        strides = [datatype.itemsize]
+        for dim in reversed(shape[1:]):
+            strides.insert(0, strides[0] * dim)
+        if all(o == offset + i * step for i, o in enumerate(offsets)):
+            Data = numpy.ndarray(
+                (len(images),) + shape,
+                datatype,
+                buffer,
+                offset,
+                (step,) + tuple(strides),
+            )
+        else:
+            Data = numpy.stack(
+                [numpy.ndarray(shape, datatype, buffer, o) for o in offsets]
+            )
+        if self.SysByteOrder.upper() != first.ByteOrder.upper():
+            Data = Data.byteswap()
+        if DataType != "":
+            Data = self.__SetDataType__(Data, DataType)
+        return Data
+
     def GetPixel(self, Index, Position):
         """Returns double value of the pixel, regardless the format of the array
         Index:      The zero-based index of the image in the file
@@ -824,72 +1069,94 @@ class EdfFile(object):
                             LowByteFirst
                         Default: system's byte order
         """
+        self._dropMapping()
         if Append == 0:
             self.File.truncate(0)
             self.Images = []
             self.NumImages = 0
+        image, StrHeader, Data = self._NewImage(Header, Data, DataType, ByteOrder)
+        self.File.seek(0, 2)
+        image.HeaderPosition = self.File.tell()
+        self.File.write(StrHeader)
+        image.DataPosition = self.File.tell()
+        self.File.write(Data)
+
+    def _NewImage(self, Header, Data, DataType="", ByteOrder=""):
+        """Internal method: appends a new image to the image list
+
+        Returns the image, its header as bytes and its data in file
+        byte order, as a contiguous array
+        """
         Index = self.NumImages
         self.NumImages = self.NumImages + 1
-        self.Images.append(Image())
+        image = Image()
+        self.Images.append(image)
 
-        # self.Images[Index].StaticHeader["Dim_1"] = "%d" % Data.shape[1]
-        # self.Images[Index].StaticHeader["Dim_2"] = "%d" % Data.shape[0]
         scalarSize = self.__GetSizeNumpyType__(Data.dtype)
         if len(Data.shape) == 1:
-            self.Images[Index].Dim1 = Data.shape[0]
-            self.Images[Index].StaticHeader["Dim_1"] = "%d" % self.Images[Index].Dim1
-            self.Images[Index].Size = Data.shape[0] * scalarSize
+            image.Dim1 = Data.shape[0]
+            image.StaticHeader["Dim_1"] = "%d" % image.Dim1
+            image.Size = Data.shape[0] * scalarSize
         elif len(Data.shape) == 2:
-            self.Images[Index].Dim1 = Data.shape[1]
-            self.Images[Index].Dim2 = Data.shape[0]
-            self.Images[Index].StaticHeader["Dim_1"] = "%d" % self.Images[Index].Dim1
-            self.Images[Index].StaticHeader["Dim_2"] = "%d" % self.Images[Index].Dim2
-            self.Images[Index].Size = Data.shape[0] * Data.shape[1] * scalarSize
-            self.Images[Index].NumDim = 2
+            image.Dim1 = Data.shape[1]
+            image.Dim2 = Data.shape[0]
+            image.StaticHeader["Dim_1"] = "%d" % image.Dim1
+            image.StaticHeader["Dim_2"] = "%d" % image.Dim2
+            image.Size = Data.shape[0] * Data.shape[1] * scalarSize
+            image.NumDim = 2
         elif len(Data.shape) == 3:
-            self.Images[Index].Dim1 = Data.shape[2]
-            self.Images[Index].Dim2 = Data.shape[1]
-            self.Images[Index].Dim3 = Data.shape[0]
-            self.Images[Index].StaticHeader["Dim_1"] = "%d" % self.Images[Index].Dim1
-            self.Images[Index].StaticHeader["Dim_2"] = "%d" % self.Images[Index].Dim2
-            self.Images[Index].StaticHeader["Dim_3"] = "%d" % self.Images[Index].Dim3
-            self.Images[Index].Size = (
-                Data.shape[0] * Data.shape[1] * Data.shape[2] * scalarSize
-            )
-            self.Images[Index].NumDim = 3
+            image.Dim1 = Data.shape[2]
+            image.Dim2 = Data.shape[1]
+            image.Dim3 = Data.shape[0]
+            image.StaticHeader["Dim_1"] = "%d" % image.Dim1
+            image.StaticHeader["Dim_2"] = "%d" % image.Dim2
+            image.StaticHeader["Dim_3"] = "%d" % image.Dim3
+            image.Size = Data.shape[0] * Data.shape[1] * Data.shape[2] * scalarSize
+            image.NumDim = 3
         elif len(Data.shape) > 3:
             raise TypeError("EdfFile: Data dimension not suported")
 
         if DataType == "":
-            self.Images[Index].DataType = self.__GetDefaultEdfType__(Data.dtype)
+            image.DataType = self.__GetDefaultEdfType__(Data.dtype)
         else:
-            self.Images[Index].DataType = DataType
+            image.DataType = DataType
             Data = self.__SetDataType__(Data, DataType)
 
         if ByteOrder == "":
-            self.Images[Index].ByteOrder = self.SysByteOrder
+            image.ByteOrder = self.SysByteOrder
         else:
-            self.Images[Index].ByteOrder = ByteOrder
+            image.ByteOrder = ByteOrder
 
-        self.Images[Index].StaticHeader["Size"] = "%d" % self.Images[Index].Size
-        self.Images[Index].StaticHeader["Image"] = Index + 1
-        self.Images[Index].StaticHeader["HeaderID"] = (
-            "EH:%06d:000000:000000" % self.Images[Index].StaticHeader["Image"]
+        image.StaticHeader["Size"] = "%d" % image.Size
+        image.StaticHeader["Image"] = Index + 1
+        image.StaticHeader["HeaderID"] = (
+            "EH:%06d:000000:000000" % image.StaticHeader["Image"]
+        )
+        image.StaticHeader["ByteOrder"] = image.ByteOrder
+        image.StaticHeader["DataType"] = image.DataType
+        image.Header = dict(Header)
+
+        # only HeaderID and Image change from one image to the next,
+        # the rest of the static header is formatted once per image format
+        formatKey = tuple(
+            (key, image.StaticHeader.get(key)) for key in STATIC_HEADER_ELEMENTS[2:]
+        )
+        if formatKey != self.__staticHeaderKey:
+            self.__staticHeaderKey = formatKey
+            self.__staticHeader = "".join(
+                "%s = %s ;\n" % (key, value)
+                for key, value in formatKey
+                if value is not None
+            )
+        StrHeader = "".join(
+            [
+                "{\n",
+                "HeaderID = %s ;\n" % image.StaticHeader["HeaderID"],
+                "Image = %s ;\n" % image.StaticHeader["Image"],
+                self.__staticHeader,
+            ]
+            + ["%s = %s ;\n" % (key, value) for key, value in Header.items()]
         )
-        self.Images[Index].StaticHeader["ByteOrder"] = self.Images[Index].ByteOrder
-        self.Images[Index].StaticHeader["DataType"] = self.Images[Index].DataType
-
-        self.Images[Index].Header = {}
-        self.File.seek(0, 2)
-        StrHeader = "{\n"
-        for i in STATIC_HEADER_ELEMENTS:
-            if i in self.Images[Index].StaticHeader.keys():
-                StrHeader = StrHeader + (
-                    "%s = %s ;\n" % (i, self.Images[Index].StaticHeader[i])
-                )
-        for i in Header.keys():
-            StrHeader = StrHeader + ("%s = %s ;\n" % (i, Header[i]))
-            self.Images[Index].Header[i] = Header[i]
         newsize = (
             ((len(StrHeader) + 1) // HEADER_BLOCK_SIZE) + 1
         ) * HEADER_BLOCK_SIZE - 2
@@ -897,15 +1164,25 @@ class EdfFile(object):
         StrHeader = StrHeader.ljust(newsize)
         StrHeader = StrHeader + "}\n"
 
-        self.Images[Index].HeaderPosition = self.File.tell()
-        self.File.write(StrHeader.encode())
-        self.Images[Index].DataPosition = self.File.tell()
+        # if image.StaticHeader["ByteOrder"] != self.SysByteOrder:
+        if image.ByteOrder.upper() != self.SysByteOrder.upper():
+            Data = Data.byteswap()
+        Data = numpy.ascontiguousarray(Data)
+        return image, StrHeader.encode(), Data
+
+    def StreamWriter(self, BatchSize=16):
+        """Returns an EdfStreamWriter appending images to this file"""
+        return EdfStreamWriter(self, BatchSize)
 
-        # if self.Images[Index].StaticHeader["ByteOrder"] != self.SysByteOrder:
-        if self.Images[Index].ByteOrder.upper() != self.SysByteOrder.upper():
-            self.File.write((Data.byteswap()).tostring())
-        else:
-            self.File.write(Data.tostring())
+    def _makeSureFileIsOpen(self):
+        self.__makeSureFileIsOpen()
+
+    def _makeSureFileIsClosed(self):
+        self.__makeSureFileIsClosed()
+
+    def _dropMapping(self):
+        # the mapping does not see the new images, read the file instead
+        self.__mmap = None
 
     def __makeSureFileIsOpen(self):
         if DEBUG:
@@ -1078,6 +1355,388 @@ class EdfFile(object):
         return GetDefaultNumpyType(EdfType)
 
 
+class EdfStreamWriter(object):
+    """Append many images to an EdfFile, keeping the file open.
+
+    The images are queued and written BatchSize at a time with a single
+    os.writev call (headers and data, without joining them), instead of
+    a seek and two writes per image. Use it as a context manager, the
+    pending images are written and the file closed on exit:
+
+        with edf.StreamWriter() as writer:
+            for data in frames:
+                writer.write({}, data)
+    """
+
+    def __init__(self, Edf, BatchSize=16):
+        self.Edf = Edf
+        self.BatchSize = max(1, BatchSize)
+        self.__pending = []
+        self.__position = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, Header, Data, DataType="", ByteOrder=""):
+        """Queues an image, same arguments as EdfFile.WriteImage"""
+        if self.__position is None:
+            self.Edf._dropMapping()
+            self.Edf._makeSureFileIsOpen()
+            self.__position = self.Edf.File.seek(0, 2)
+        image, StrHeader, Data = self.Edf._NewImage(Header, Data, DataType, ByteOrder)
+        image.HeaderPosition = self.__position
+        image.DataPosition = image.HeaderPosition + len(StrHeader)
+        self.__position = image.DataPosition + Data.nbytes
+        self.__pending.append(StrHeader)
+        self.__pending.append(memoryview(Data).cast("B"))
+        if len(self.__pending) >= 2 * self.BatchSize:
+            self.flush()
+
+    def flush(self):
+        """Writes the queued images"""
+        buffers = self.__pending
+        self.__pending = []
+        if not buffers:
+            return
+        File = self.Edf.File
+        File.flush()
+        if not hasattr(os, "writev"):
+            for buffer in buffers:
+                File.write(buffer)
+            File.flush()
+            return
+        fd = File.fileno()
+        while buffers:
+            written = os.writev(fd, buffers[:IOV_MAX])
+            # partial write: skip the written buffers and bytes
+            while buffers and written >= len(buffers[0]):
+                written -= len(buffers[0])
+                buffers.pop(0)
+            if written:
+                buffers[0] = memoryview(buffers[0])[written:]
+        # keep the file object position in sync with the descriptor
+        File.seek(0, 2)
+
+    def close(self):
+        """Writes the queued images and closes the file if EdfFile owns it"""
+        if self.__position is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.__position = None
+            self.Edf._makeSureFileIsClosed()
+
+
+def IterImages(FileName, DataType="", Threads=None):
+    """Yields the (Header, Data) of each image of an EDF file, one at a time
+
+    Uncompressed files are memory-mapped. gzip and bz2 files are decompressed
+    as a stream, so only one image at a time is kept in memory (plus a few
+    DECOMPRESSION_CHUNK_SIZE chunks per thread), instead of seeking back and
+    forth in the decompressed file.
+    The members of multi-member gzip files (and the streams of multi-stream
+    bz2 files, e.g. from pbzip2) are decompressed in parallel by Threads
+    threads (default: number of CPUs, 1 to decompress in the calling thread).
+    """
+    lowerName = FileName.lower()
+    if lowerName.endswith(".gz"):
+        codec = _GZIP_CODEC
+    elif lowerName.endswith(".bz2"):
+        if not BZ2:
+            raise IOError("No bz2 module support in this system")
+        codec = _BZ2_CODEC
+    else:
+        edf = EdfFile(FileName, "r", mmap=True)
+        for Index in range(edf.GetNumImages()):
+            yield edf.GetHeader(Index), edf.GetData(Index, DataType)
+        return
+
+    if Threads is None:
+        Threads = os.cpu_count() or 1
+    with open(FileName, "rb") as f:
+        try:
+            compressed = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+    pool = ThreadPoolExecutor(Threads) if Threads > 1 else None
+    chunks = _IterDecompressed(compressed, codec, pool, 2 * Threads)
+    try:
+        for image, data in _IterEdfImages(chunks):
+            Data = _ImageData(image, data, DataType)
+            # only the caller keeps the image
+            del data
+            yield image.Header, Data
+            del Data
+    finally:
+        # stops the pending decompressions
+        chunks.close()
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# how to find and decompress the members of compressed files
+_Codec = collections.namedtuple("_Codec", "new member errors")
+_GZIP_CODEC = _Codec(
+    lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    re.compile(b"\x1f\x8b\x08"),
+    (zlib.error,),
+)
+_BZ2_CODEC = _Codec(
+    lambda: bz2.BZ2Decompressor(),
+    re.compile(b"BZh[1-9]1AY&SY"),
+    (OSError, ValueError),
+)
+
+
+# max. number of decompressed chunks waiting to be read, per member being
+# decompressed in the pool
+DECOMPRESSION_QUEUE_SIZE = 4
+
+
+def _Decompress(decompressor, data):
+    """Yields the decompressed data in chunks of at most
+    DECOMPRESSION_CHUNK_SIZE bytes, whatever the compression ratio"""
+    while True:
+        chunk = decompressor.decompress(data, DECOMPRESSION_CHUNK_SIZE)
+        if chunk:
+            yield chunk
+        if decompressor.eof:
+            return
+        if hasattr(decompressor, "unconsumed_tail"):
+            # zlib: input left when the output was full
+            data = decompressor.unconsumed_tail
+            if not data and len(chunk) < DECOMPRESSION_CHUNK_SIZE:
+                return
+        else:
+            # bz2: output left in the decompressor
+            if decompressor.needs_input:
+                return
+            data = b""
+
+
+class _Member(object):
+    """Decompression of a member of a compressed file from a position"""
+
+    def __init__(self, codec, position):
+        self.decompressor = codec.new()
+        self.position = position
+
+    @property
+    def eof(self):
+        return self.decompressor.eof
+
+    def chunks(self, compressed, stop):
+        """Yields the decompressed chunks up to stop or the end of the
+        member, position being updated to the position reached"""
+        decompressor = self.decompressor
+        while self.position < stop and not decompressor.eof:
+            size = min(DECOMPRESSION_CHUNK_SIZE, stop - self.position)
+            data = compressed[self.position : self.position + size]
+            for chunk in _Decompress(decompressor, data):
+                yield chunk
+            self.position += size
+            if decompressor.eof:
+                self.position -= len(decompressor.unused_data)
+
+
+class _Segment(object):
+    """Speculative decompression of a possible member, run in the pool
+
+    The decompressed chunks are handed to the reader through a queue of
+    DECOMPRESSION_QUEUE_SIZE chunks, so a segment never holds more, whatever
+    the size of the member. The last item of the queue is the _Member (to
+    continue it beyond the segment) or the exception raised.
+    """
+
+    def __init__(self, compressed, start, stop, codec):
+        self.compressed = compressed
+        self.stop = stop
+        self.member = _Member(codec, start)
+        self.queue = queue.Queue(DECOMPRESSION_QUEUE_SIZE)
+        self.cancelled = False
+
+    def run(self):
+        try:
+            for chunk in self.member.chunks(self.compressed, self.stop):
+                if not self._put(chunk):
+                    return
+        except Exception as error:
+            self._put(error)
+            return
+        self._put(self.member)
+
+    def _put(self, item):
+        while not self.cancelled:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def chunks(self):
+        """Yields the decompressed chunks, returns the _Member"""
+        while True:
+            item = self.queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if isinstance(item, _Member):
+                return item
+            yield item
+
+
+def _IterDecompressed(compressed, codec, pool, window):
+    """Yields the decompressed chunks of all the members of a compressed file
+
+    The member boundaries are only known once the previous member is
+    decompressed, so every possible member start (magic bytes) is
+    decompressed speculatively in the pool, up to the next possible start.
+    The results are only used for the actual member starts: the integrity
+    checks of the formats (CRC) reject the false positives. A member going
+    beyond the next possible start is continued in the calling thread.
+    The chunks are at most DECOMPRESSION_CHUNK_SIZE bytes, and at most
+    window segments of DECOMPRESSION_QUEUE_SIZE chunks are pending.
+    """
+    end = len(compressed)
+    starts = (m.start() for m in codec.member.finditer(compressed, 1))
+    segments = {}
+    nextStart = 0
+    pos = 0
+    try:
+        while pos < end:
+            # keep the pool busy with the next possible members
+            while (
+                pool is not None and nextStart is not None and len(segments) < window
+            ):
+                start = nextStart
+                nextStart = next(starts, None)
+                if start >= pos:
+                    stop = end if nextStart is None else nextStart
+                    segment = _Segment(compressed, start, stop, codec)
+                    segments[start] = segment
+                    pool.submit(segment.run)
+            for start in [start for start in segments if start < pos]:
+                segments.pop(start).cancel()
+
+            segment = segments.pop(pos, None)
+            decompressed = False
+            try:
+                if segment is None:
+                    member = _Member(codec, pos)
+                else:
+                    chunks = segment.chunks()
+                    while True:
+                        try:
+                            chunk = next(chunks)
+                        except StopIteration as stop:
+                            member = stop.value
+                            break
+                        decompressed = True
+                        yield chunk
+                for chunk in member.chunks(compressed, end):
+                    decompressed = True
+                    yield chunk
+            except codec.errors:
+                if not decompressed:
+                    # trailing garbage (e.g. padding)
+                    break
+                raise IOError("EdfFile: corrupted compressed file")
+            if not member.eof:
+                # truncated file
+                break
+            pos = member.position
+    finally:
+        for segment in segments.values():
+            segment.cancel()
+
+
+def _ParseHeader(image, header):
+    """Fills the image (static) header from the bytes between { and }"""
+    for line in header.decode("latin-1").splitlines():
+        if "=" not in line:
+            continue
+        typeItem, valueItem = line.split("=", 1)
+        typeItem = typeItem.strip()
+        valueItem = valueItem.split(";", 1)[0].strip()
+        if typeItem.upper() in STATIC_HEADER_ELEMENTS_CAPS:
+            image.StaticHeader[typeItem] = valueItem
+        else:
+            image.Header[typeItem] = valueItem
+
+
+def _IterEdfImages(chunks):
+    """Yields the (Image, data bytearray) of the EDF images in a stream of
+    chunks
+
+    Only the current image is buffered, its data being copied once from the
+    chunks into its own buffer.
+    """
+    buffer = bytearray()
+    chunks = iter(chunks)
+    while True:
+        start = HEADER_START.search(buffer)
+        stop = start and HEADER_END.search(buffer, start.end())
+        if not stop:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            buffer += chunk
+            continue
+        image = Image()
+        _ParseHeader(image, buffer[start.end() : stop.start()])
+        if not EdfFile._setStaticInfo(image):
+            image.Size = 0
+        data = bytearray(image.Size)
+        view = memoryview(data)
+        filled = min(len(buffer) - stop.end(), image.Size)
+        view[:filled] = memoryview(buffer)[stop.end() : stop.end() + filled]
+        del buffer[: stop.end() + filled]
+        while filled < image.Size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                # a truncated last image is dropped
+                return
+            size = min(len(chunk), image.Size - filled)
+            view[filled : filled + size] = memoryview(chunk)[:size]
+            filled += size
+            buffer += memoryview(chunk)[size:]
+        del view
+        if image.Size > 0:
+            yield image, data
+        del data
+
+
+def _ImageData(image, data, DataType=""):
+    """Returns the numpy array of an image read by _IterEdfImages"""
+    shape = (image.Dim3, image.Dim2, image.Dim1)[3 - image.NumDim :]
+    count = 1
+    for dim in shape:
+        count *= dim
+    EdfType = image.DataType.upper()
+    if EdfType in ["SIGNEDLONG", "UNSIGNEDLONG"] and image.Size == 8 * count:
+        datatype = numpy.int64 if EdfType == "SIGNEDLONG" else numpy.uint64
+    else:
+        datatype = GetDefaultNumpyType(EdfType)
+    Data = numpy.frombuffer(data, datatype, count).reshape(shape)
+    if sys.byteorder == "big":
+        SysByteOrder = "HIGHBYTEFIRST"
+    else:
+        SysByteOrder = "LOWBYTEFIRST"
+    if image.ByteOrder.upper() != SysByteOrder:
+        Data = Data.byteswap()
+    if DataType != "":
+        Data = Data.astype(GetDefaultNumpyType(DataType))
+    return Data
+
+
 def GetDefaultNumpyType(EdfType):
     """Returns NumPy type according Edf type"""
     EdfType = EdfType.upper()
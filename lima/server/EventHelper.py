@@ -0,0 +1,250 @@
+############################################################################
+# This file is part of LImA, a Library for Image Acquisition
+#
+# Copyright (C) : 2009-2026
+# European Synchrotron Radiation Facility
+# CS40220 38043 Grenoble Cedex 9
+# FRANCE
+# Contact: lima@esrf.fr
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# ============================================================================
+#                              HELPERS
+# ============================================================================
+#
+# Helpers to push Tango events out of the LIMA core callback threads.
+# This module does not depend on the LIMA core so it can be used (and tested)
+# on its own.
+
+import collections
+import threading
+import time
+
+try:
+    from PyTango import EnsureOmniThread
+except ImportError:
+    # PyTango < 9.3.2 or not installed
+    EnsureOmniThread = None
+
+
+class LatestWinsWorker(object):
+    """Process the submitted items in a dedicated thread.
+
+    The queue is bounded: when it is full, submitting a new item drops the
+    oldest pending one (latest-wins), so a slow consumer (e.g. a slow Tango
+    client) never blocks the producer. The dropped items are counted.
+    """
+
+    def __init__(self, process, maxlen=1, name="LatestWinsWorker"):
+        self._process = process
+        self._queue = collections.deque(maxlen=maxlen)
+        self._lock = threading.Condition()
+        self._dropped = 0
+        self._busy = False
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def reset_dropped(self):
+        with self._lock:
+            self._dropped = 0
+
+    def submit(self, item):
+        """Queue an item, returns False if an older one has been dropped"""
+        with self._lock:
+            dropped = len(self._queue) == self._queue.maxlen
+            if dropped:
+                self._dropped += 1
+            self._queue.append(item)
+            self._lock.notify()
+        return not dropped
+
+    def wait_idle(self, timeout=None):
+        """Wait until the queue is empty and the last item processed"""
+        with self._lock:
+            return self._lock.wait_for(
+                lambda: not self._queue and not self._busy, timeout
+            )
+
+    def stop(self):
+        with self._lock:
+            self._stop = True
+            self._queue.clear()
+            self._lock.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        if EnsureOmniThread is not None:
+            with EnsureOmniThread():
+                self._loop()
+        else:
+            self._loop()
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._stop:
+                    self._lock.wait()
+                if self._stop:
+                    break
+                item = self._queue.popleft()
+                self._busy = True
+            try:
+                self._process(item)
+            except Exception:
+                import traceback
+
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._busy = False
+                    self._lock.notify_all()
+
+
+class EventRateController(object):
+    """Rate limit of the change events.
+
+    With a fixed rate, the events are pushed at most max_rate times per second.
+    In adaptive mode, the rate is lowered so that pushing the events takes
+    at most LatencyBudget of the time, based on the measured push latency
+    (exponentially weighted moving average), and raised back up to max_rate
+    when the clients are fast again.
+    """
+
+    LatencyBudget = 0.1
+    MinRate = 1.0
+
+    def __init__(self, max_rate, adaptive=False, smoothing=0.2):
+        self.max_rate = max_rate
+        self.adaptive = adaptive
+        self.smoothing = smoothing
+        self.latency = 0.0
+
+    def record_push(self, latency):
+        """Update the push latency average with a new measurement"""
+        if self.latency:
+            latency = self.smoothing * latency + (1 - self.smoothing) * self.latency
+        self.latency = latency
+
+    @property
+    def rate(self):
+        """The effective rate in Hz"""
+        if not self.adaptive or self.latency <= 0:
+            return self.max_rate
+        rate = self.LatencyBudget / self.latency
+        return max(min(rate, self.max_rate), min(self.MinRate, self.max_rate))
+
+    def next_time(self, last_time):
+        """Time before which no new event should be pushed"""
+        return last_time + 1.0 / self.rate
+
+
+class EventRateClasses(object):
+    """Rate classes of the change events pushed from the same source.
+
+    Each class (e.g. an attribute) has its own max. rate, so that slow
+    clients can subscribe to a slow class while the fast ones get all the
+    events from another. A max. rate <= 0 means no limit.
+    """
+
+    def __init__(self, max_rates):
+        self._max_rates = dict(max_rates)
+        self._last_times = dict.fromkeys(self._max_rates, None)
+
+    @property
+    def names(self):
+        return list(self._max_rates)
+
+    def due(self, ts):
+        """Returns the classes to push at time ts, and records the push time"""
+        names = []
+        for name, max_rate in self._max_rates.items():
+            last_time = self._last_times[name]
+            if max_rate <= 0 or last_time is None or ts - last_time >= 1.0 / max_rate:
+                self._last_times[name] = ts
+                names.append(name)
+        return names
+
+
+class TrailingFlush(object):
+    """Call a function once, after a delay, in a dedicated thread.
+
+    Used to push the last values which have been held back by a rate limit.
+    Scheduling while already scheduled keeps the earliest deadline.
+    """
+
+    def __init__(self, flush, name="TrailingFlush"):
+        self._flush = flush
+        self._lock = threading.Condition()
+        self._deadline = None
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def schedule(self, delay):
+        with self._lock:
+            deadline = time.monotonic() + max(delay, 0)
+            if self._deadline is None or deadline < self._deadline:
+                self._deadline = deadline
+                self._lock.notify()
+
+    def cancel(self):
+        with self._lock:
+            self._deadline = None
+            self._lock.notify()
+
+    def stop(self):
+        with self._lock:
+            self._stop = True
+            self._deadline = None
+            self._lock.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        if EnsureOmniThread is not None:
+            with EnsureOmniThread():
+                self._loop()
+        else:
+            self._loop()
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                while not self._stop:
+                    if self._deadline is None:
+                        self._lock.wait()
+                        continue
+                    timeout = self._deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._lock.wait(timeout)
+                if self._stop:
+                    break
+                self._deadline = None
+            try:
+                self._flush()
+            except Exception:
+                import traceback
+
+                traceback.print_exc()
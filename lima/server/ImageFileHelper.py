@@ -0,0 +1,209 @@
+############################################################################
+# This file is part of LImA, a Library for Image Acquisition
+#
+# Copyright (C) : 2009-2026
+# European Synchrotron Radiation Facility
+# CS40220 38043 Grenoble Cedex 9
+# FRANCE
+# Contact: lima@esrf.fr
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# ============================================================================
+#                              HELPERS
+# ============================================================================
+#
+# Readers of the reference images (mask, flat-field, background...) used by
+# the plugins: EDF (and EDF.gz/.bz2), NPY, TIFF and HDF5/NeXus files.
+# Only the requested frames are read: NPY files are memory-mapped, HDF5
+# datasets and TIFF pages are read frame by frame. The frames returned never
+# refer to the file.
+# This module does not depend on the LIMA core so it can be used (and tested)
+# on its own.
+
+import itertools
+import os
+import numpy
+
+from lima.server import EdfFile
+
+try:
+    import h5py
+
+    H5PY = True
+except ImportError:
+    H5PY = False
+
+try:
+    import PIL.Image
+
+    PILLOW = True
+except ImportError:
+    PILLOW = False
+
+# file.h5::/entry/data selects a dataset in an HDF5 file
+DATA_PATH_SEPARATOR = "::"
+
+
+def split_data_path(filepath):
+    """Returns the (file name, data path) of file.h5::/path, data path being
+    None if not given"""
+    filename, sep, data_path = filepath.partition(DATA_PATH_SEPARATOR)
+    return filename, data_path or None
+
+
+def frame_range(nb_frames, from_index, to_index, filename):
+    """Returns the (from, to) frame indexes, to_index < 0 meaning up to the
+    last frame"""
+    if to_index < 0 or to_index > nb_frames:
+        to_index = nb_frames
+    if not 0 <= from_index < to_index:
+        raise ValueError("No frame %d in %s" % (from_index, filename))
+    return from_index, to_index
+
+
+def _read_compressed_edf_stack(filename, from_index, to_index):
+    """The frames are decompressed one at a time into a preallocated stack,
+    grown in place when the number of frames is not known"""
+    images = EdfFile.IterImages(filename)
+    stop = to_index if to_index >= 0 else None
+    headers = []
+    stack = None
+    for header, data in itertools.islice(images, from_index, stop):
+        if stack is None:
+            nb_frames = to_index - from_index if to_index >= 0 else 1
+            stack = numpy.empty((nb_frames,) + data.shape, data.dtype)
+        elif data.shape != stack.shape[1:] or data.dtype != stack.dtype:
+            raise ValueError("Frames of different shapes or types in %s" % filename)
+        if len(headers) == len(stack):
+            # realloc, usually without copy for large arrays
+            stack.resize((2 * len(stack),) + stack.shape[1:], refcheck=False)
+        stack[len(headers)] = data
+        headers.append(header)
+        del data
+    if not headers:
+        raise ValueError("No frame %d in %s" % (from_index, filename))
+    if len(headers) < len(stack):
+        stack.resize((len(headers),) + stack.shape[1:], refcheck=False)
+    return headers, stack
+
+
+def read_edf_stack(filename, data_path, from_index, to_index):
+    if filename.lower().endswith((".gz", ".bz2")):
+        return _read_compressed_edf_stack(filename, from_index, to_index)
+
+    # not memory-mapped: the frames outlive the file, which may be rewritten
+    f = EdfFile.EdfFile(filename, "r")
+    from_index, to_index = frame_range(f.GetNumImages(), from_index, to_index, filename)
+    headers = [f.GetHeader(i) for i in range(from_index, to_index)]
+    return headers, f.GetDataStack(from_index, to_index)
+
+
+def read_npy_stack(filename, data_path, from_index, to_index):
+    stack = numpy.load(filename, mmap_mode="r")
+    if stack.ndim == 2:
+        stack = stack[numpy.newaxis]
+    elif stack.ndim != 3:
+        raise ValueError("%s is not an image or a stack of images" % filename)
+    from_index, to_index = frame_range(len(stack), from_index, to_index, filename)
+    # only the requested frames are read, copied out of the mapping
+    stack = numpy.array(stack[from_index:to_index], copy=True)
+    return [{} for frame in stack], stack
+
+
+def read_tiff_stack(filename, data_path, from_index, to_index):
+    if not PILLOW:
+        raise IOError("Pillow is required to read %s" % filename)
+    with PIL.Image.open(filename) as image:
+        nb_frames = getattr(image, "n_frames", 1)
+        from_index, to_index = frame_range(nb_frames, from_index, to_index, filename)
+        frames = []
+        for i in range(from_index, to_index):
+            image.seek(i)
+            frames.append(numpy.asarray(image))
+    return [{} for frame in frames], numpy.stack(frames)
+
+
+def _find_image_dataset(h5file):
+    """Returns the first 2-D or 3-D dataset of an HDF5 file"""
+    found = []
+
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset) and obj.ndim in (2, 3):
+            found.append(obj)
+            return True
+
+    h5file.visititems(visit)
+    return found[0] if found else None
+
+
+def _header_value(value):
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+def read_hdf5_stack(filename, data_path, from_index, to_index):
+    if not H5PY:
+        raise IOError("h5py is required to read %s" % filename)
+    with h5py.File(filename, "r") as h5file:
+        if data_path is None:
+            dataset = _find_image_dataset(h5file)
+            if dataset is None:
+                raise ValueError("No image dataset in %s" % filename)
+        else:
+            dataset = h5file[data_path]
+        if dataset.ndim not in (2, 3):
+            raise ValueError(
+                "%s::%s is not an image or a stack of images" % (filename, dataset.name)
+            )
+        nb_frames = dataset.shape[0] if dataset.ndim == 3 else 1
+        from_index, to_index = frame_range(nb_frames, from_index, to_index, filename)
+        if dataset.ndim == 3:
+            stack = dataset[from_index:to_index]
+        else:
+            stack = dataset[()][numpy.newaxis]
+        header = {key: _header_value(value) for key, value in dataset.attrs.items()}
+    return [dict(header) for i in range(from_index, to_index)], stack
+
+
+# reader(filename, data path, from index, to index) -> (headers, stack)
+# by file extension, the other files are read as EDF
+STACK_READERS = {
+    ".npy": read_npy_stack,
+    ".tif": read_tiff_stack,
+    ".tiff": read_tiff_stack,
+    ".h5": read_hdf5_stack,
+    ".hdf5": read_hdf5_stack,
+    ".hdf": read_hdf5_stack,
+    ".nxs": read_hdf5_stack,
+    ".nx": read_hdf5_stack,
+}
+
+
+def read_stack(filepath, from_index=0, to_index=-1):
+    """Returns the headers and the data of the frames from_index to to_index
+    (excluded, -1 up to the last frame) of a file.
+
+    The data is a single numpy array, the first axis being the frame index,
+    which may be read-only (EDF).
+    A dataset of an HDF5 file is selected with file.h5::/path/to/dataset,
+    the first image dataset is read by default.
+    Raises IOError or ValueError if the frames can't be read.
+    """
+    filename, data_path = split_data_path(filepath)
+    extension = os.path.splitext(filename)[1].lower()
+    reader = STACK_READERS.get(extension, read_edf_stack)
+    return reader(filename, data_path, from_index, to_index)
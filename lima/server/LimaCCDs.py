@@ -52,9 +52,9 @@ import weakref
 import itertools
 import functools
 import numpy
-import struct
 import time
 import re
+import threading
 
 # Before loading lima.core, must find out the version the plug-in
 # was compiled with - horrible hack ...
@@ -67,6 +67,9 @@ from .EnvHelper import get_sub_devices
 from .EnvHelper import get_lima_camera_type, get_lima_device_name
 from .EnvHelper import get_camera_module, get_plugin_module
 from .AttrHelper import get_attr_4u
+from . import DataArrayHelper
+from . import EventHelper
+from . import VideoHelper
 from lima.server.AttrHelper import getDictKey, getDictValue
 from lima import core
 
@@ -213,8 +216,7 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
     # ImageStack;
     # };
 
-    class DataArrayCategory:
-        ScalarStack, Spectrum, Image, SpectrumStack, ImageStack = range(5)
+    DataArrayCategory = DataArrayHelper.DataArrayCategory
 
     # enum DataArrayType{
     # DARRAY_UINT8 = 0;
@@ -244,27 +246,12 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
         core.ImageType.Bpp32S: 6,
     }
 
-    # The DATA_ARRAY definition v4
-    # struct {
-    # unsigned int Magic= 0x44544159;
-    # unsigned short Version;
-    # unsigned  short HeaderLength;
-    # DataArrayCategory Category;
-    # DataArrayType DataType;
-    # unsigned short DataEndianness;
-    # unsigned short NbDim;
-    # unsigned short Dim[6]
-    # unsigned int DimStepBytes[6]
-    # unsigned long ImageNumber;
-    # unsigned long AcqTag;
-    # unsigned int pading[2];
-    # } DataArrayHeaderStruct;
-
-    DataArrayVersion = 4
-    DataArrayPackStr = "<IHHIIHHHHHHHHIIIIIIQQII"
-    DataArrayMagic = struct.unpack(">I", b"DTAY")[0]  # 0x44544159
-    DataArrayMinHeaderLen = 64  # v1/2/3 backward compat.
-    DataArrayMaxNbDim = 6
+    # The DATA_ARRAY definition v4 (see DataArrayHelper)
+    DataArrayVersion = DataArrayHelper.DATA_ARRAY_VERSION
+    DataArrayPackStr = DataArrayHelper.DATA_ARRAY_PACK_STR
+    DataArrayMagic = DataArrayHelper.DATA_ARRAY_MAGIC
+    DataArrayMinHeaderLen = DataArrayHelper.DATA_ARRAY_MIN_HEADER_LEN
+    DataArrayMaxNbDim = DataArrayHelper.DATA_ARRAY_MAX_NB_DIM
 
     def DataArrayUser(klass, DataArrayCategory=DataArrayCategory):
         klass.DataArrayCategory = DataArrayCategory
@@ -274,24 +261,67 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
 
     # INIT events on video_last_image
     class VideoImageCallback(core.CtVideo.ImageCallback):
-        def __init__(self, device):
+        def __init__(self, device, video_modes, preview_encoder, rate_classes=None):
             core.CtVideo.ImageCallback.__init__(self)
             self.__device = weakref.ref(device)
+            self.__video_modes = video_modes
             self.__video_last_image_timestamp = 0
+            self.__video_encoder = VideoHelper.VideoImageEncoder()
+            # video_last_image_<N>fps attributes, see VideoFPSClasses
+            self.__rate_classes = EventHelper.EventRateClasses(rate_classes or {})
+            # video_preview is encoded and pushed by a worker thread
+            # so that the encoding doesn't stall the LIMA core callback,
+            # only the latest frame is kept under back-pressure
+            self.__video_preview_timestamp = 0
+            self.__preview_encoder = preview_encoder
+            self.__preview_worker = EventHelper.LatestWinsWorker(
+                self.__push_preview, name="VideoPreviewEvent"
+            )
+
+        def stop(self):
+            self.__preview_worker.stop()
+
+        def setPreviewEncoder(self, preview_encoder):
+            self.__preview_encoder = preview_encoder
 
         def newImage(self, image):
             ts = time.time()
             device = self.__device()
             dt = ts - self.__video_last_image_timestamp
+            attr_names = self.__rate_classes.due(ts)
             if device.MaxVideoFPS <= 0 or dt >= 1.0 / device.MaxVideoFPS:
                 self.__video_last_image_timestamp = ts
                 device.push_change_event(
                     "video_last_image_counter", image.frameNumber()
                 )
-                device.push_change_event(
-                    "video_last_image", "VIDEO_IMAGE", _video_image_2_struct(image)
+                attr_names.insert(0, "video_last_image")
+            # the frame is encoded once for all the attributes
+            if attr_names:
+                data = _video_image_2_struct(image, self.__video_encoder)
+                for attr_name in attr_names:
+                    device.push_change_event(attr_name, "VIDEO_IMAGE", data)
+            if not self.__preview_encoder.enabled:
+                return
+            dt = ts - self.__video_preview_timestamp
+            max_fps = device.MaxVideoPreviewFPS
+            if max_fps <= 0 or dt >= 1.0 / max_fps:
+                mode = getDictKey(self.__video_modes, image.mode())
+                if not VideoHelper.is_preview_supported(mode):
+                    return
+                self.__video_preview_timestamp = ts
+                # the worker must get its own copy of the frame
+                data = bytes(image.buffer() or b"")
+                self.__preview_worker.submit(
+                    (mode, image.width(), image.height(), data)
                 )
 
+        def __push_preview(self, frame):
+            device = self.__device()
+            encoder = self.__preview_encoder
+            if device is None or not encoder.enabled:
+                return
+            device.push_change_event("video_preview", *encoder.encode(*frame))
+
     @DataArrayUser
     class ImageStatusCallback(core.CtControl.ImageStatusCallback):
         DefaultMaxEventRate = 25
@@ -307,60 +337,153 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
             self.__last_image_ready = None
             self.__last_image_saved = None
             self.__image_events_push_data = False
+            self.__image_events_push_counters = False
+            self.__image_events_per_counter = True
             self.__last_event_time = 0
-            self.__image_events_max_rate = self.DefaultMaxEventRate
+            self.__rate = EventHelper.EventRateController(self.DefaultMaxEventRate)
+            self.__pending_counters = None
+            self.__lock = threading.Lock()
             self.__last_acq_status = None
+            self.__data_array_encoder = DataArrayHelper.DataArrayEncoder()
+            # last_image is read, encoded and pushed by a worker thread
+            # so that slow clients don't stall the LIMA core callback,
+            # only the latest frame is kept under back-pressure
+            self.__last_image_worker = None
+            # counters held back by the rate limit are pushed by this one
+            self.__flush = None
+            if events:
+                self.__last_image_worker = EventHelper.LatestWinsWorker(
+                    self.__push_last_image, name="LastImageEvent"
+                )
+                self.__flush = EventHelper.TrailingFlush(
+                    self.__flushCounters, name="ImageCountersFlush"
+                )
 
-        def imageStatusChanged(self, image_status):
-            tn = time.time()
-            # time before which no event will be sent.
-            # Event will be sent regardless of time if (or):
-            # - last_acquired < 0
-            # - acq_status changed to ready, so that clients
-            #   dont miss the last image
-            te = self.__last_event_time + 1.0 / self.__image_events_max_rate
-
-            status = self.__control().getStatus().AcquisitionStatus
-            stat_change = status != self.__last_acq_status
-            # if the TangoEvent property is not set, the counters/image
-            # are not pushed
-            # if the property is set, we only send if
-            # WARNING : this needs to be reworked as this means
-            # that the last events before the acquisition finishes
-            # can be lost
-            last_image_acquired = image_status.LastImageAcquired
-            if self.__events and (tn >= te or last_image_acquired < 0 or stat_change):
-                last_base_image_ready = image_status.LastBaseImageReady
-                last_image_ready = image_status.LastImageReady
-                last_counter_ready = image_status.LastCounterReady
-                last_image_ready = image_status.LastImageReady
-                last_image_saved = image_status.LastImageSaved
-
+        def stop(self):
+            if self.__flush is not None:
+                self.__flush.stop()
+                self.__flush = None
+            if self.__last_image_worker is not None:
+                self.__last_image_worker.stop()
+                self.__last_image_worker = None
+
+        def __flushCounters(self):
+            with self.__lock:
+                counters = self.__pending_counters
+                self.__pending_counters = None
+                if counters is None:
+                    return
                 device = self.__device()
-                if self.__last_base_image_ready != last_base_image_ready:
+                if device is None:
+                    return
+                t0 = time.time()
+                self.__push_counters(device, *counters)
+                self.__last_event_time = time.time()
+                self.__rate.record_push(self.__last_event_time - t0)
+
+        def __push_counters(
+            self,
+            device,
+            last_base_image_ready,
+            last_counter_ready,
+            last_image_acquired,
+            last_image_ready,
+            last_image_saved,
+        ):
+            counters = [
+                last_base_image_ready,
+                last_counter_ready,
+                last_image_acquired,
+                last_image_ready,
+                last_image_saved,
+            ]
+            counters_changed = counters != [
+                self.__last_base_image_ready,
+                self.__last_counter_ready,
+                self.__last_image_acquired,
+                self.__last_image_ready,
+                self.__last_image_saved,
+            ]
+            # the per-counter events can be replaced by the image_counters one
+            per_counter = self.__image_events_per_counter
+            if self.__last_base_image_ready != last_base_image_ready:
+                if per_counter:
                     device.push_change_event(
                         "last_base_image_ready", last_base_image_ready
                     )
-                    self.__last_base_image_ready = last_base_image_ready
-                if self.__last_counter_ready != last_counter_ready:
+                self.__last_base_image_ready = last_base_image_ready
+            if self.__last_counter_ready != last_counter_ready:
+                if per_counter:
                     device.push_change_event("last_counter_ready", last_counter_ready)
-                if self.__last_image_acquired != last_image_acquired:
-                    device.push_change_event("last_image_acquired", last_image_acquired)
-                    self.__last_image_acquired = last_image_acquired
-                if self.__last_image_ready != last_image_ready:
+                self.__last_counter_ready = last_counter_ready
+            if self.__last_image_acquired != last_image_acquired:
+                if per_counter:
+                    device.push_change_event(
+                        "last_image_acquired", last_image_acquired
+                    )
+                self.__last_image_acquired = last_image_acquired
+            if self.__last_image_ready != last_image_ready:
+                if per_counter:
                     device.push_change_event("last_image_ready", last_image_ready)
-                    self.__last_image_ready = last_image_ready
-                    if (last_image_ready >= 0) and self.__image_events_push_data:
-                        control = self.__control()
-                        image = control.ReadImage(last_image_ready)
-                        category = self.DataArrayCategory.Image
-                        data = device._image_2_data_array(image, category)
-                        device.push_change_event("last_image", "DATA_ARRAY", data)
-                if self.__last_image_saved != last_image_saved:
+                self.__last_image_ready = last_image_ready
+                if (last_image_ready >= 0) and self.__image_events_push_data:
+                    self.__last_image_worker.submit(last_image_ready)
+            if self.__last_image_saved != last_image_saved:
+                if per_counter:
                     device.push_change_event("last_image_saved", last_image_saved)
-                    self.__last_image_saved = last_image_saved
+                self.__last_image_saved = last_image_saved
+            # all the counters in a single event
+            if counters_changed and self.__image_events_push_counters:
+                device.push_change_event(
+                    "image_counters", numpy.array(counters, dtype=numpy.int64)
+                )
 
-                self.__last_event_time = time.time()
+        def __push_last_image(self, frame_number):
+            device = self.__device()
+            control = self.__control()
+            if device is None or control is None:
+                return
+            image = control.ReadImage(frame_number)
+            category = self.DataArrayCategory.Image
+            data = device._image_2_data_array(
+                image, category, self.__data_array_encoder
+            )
+            device.push_change_event("last_image", "DATA_ARRAY", data)
+
+        def imageStatusChanged(self, image_status):
+            tn = time.time()
+            status = self.__control().getStatus().AcquisitionStatus
+            stat_change = status != self.__last_acq_status
+            last_image_acquired = image_status.LastImageAcquired
+            if last_image_acquired < 0 and self.__last_image_worker is not None:
+                self.__last_image_worker.reset_dropped()
+            # if the TangoEvent property is not set, the counters/image
+            # are not pushed
+            if self.__events:
+                counters = [
+                    image_status.LastBaseImageReady,
+                    image_status.LastCounterReady,
+                    last_image_acquired,
+                    image_status.LastImageReady,
+                    image_status.LastImageSaved,
+                ]
+                with self.__lock:
+                    self.__pending_counters = counters
+                    # time before which no event will be sent.
+                    # Event will be sent regardless of time if (or):
+                    # - last_acquired < 0
+                    # - acq_status changed (e.g. back to ready)
+                    # otherwise the counters are held back and flushed
+                    # when the time is reached, so that clients
+                    # dont miss the last image
+                    te = self.__rate.next_time(self.__last_event_time)
+                    push = tn >= te or last_image_acquired < 0 or stat_change
+                    if push:
+                        self.__flush.cancel()
+                    else:
+                        self.__flush.schedule(te - tn)
+                if push:
+                    self.__flushCounters()
 
             # pushing the status if:
             # - it has changed since the last callback call
@@ -388,16 +511,49 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
         def setImageEventsPushData(self, events):
             self.__image_events_push_data = events
 
+        def getImageEventsPushCounters(self):
+            return self.__image_events_push_counters
+
+        def setImageEventsPushCounters(self, events):
+            self.__image_events_push_counters = events
+
+        def getImageEventsPerCounter(self):
+            return self.__image_events_per_counter
+
+        def setImageEventsPerCounter(self, events):
+            self.__image_events_per_counter = events
+
         def getImageEventsMaxRate(self):
-            return self.__image_events_max_rate
+            return self.__rate.max_rate
+
+        def getLastImageEventsDropped(self):
+            if self.__last_image_worker is None:
+                return 0
+            return self.__last_image_worker.dropped
 
         def setImageEventsMaxRate(self, max_rate):
-            self.__image_events_max_rate = max_rate
+            self.__rate.max_rate = max_rate
+
+        def getImageEventsAdaptiveRate(self):
+            return self.__rate.adaptive
+
+        def setImageEventsAdaptiveRate(self, adaptive):
+            self.__rate.adaptive = adaptive
+
+        def getImageEventsPushLatency(self):
+            return self.__rate.latency
+
+        def getImageEventsEffectiveRate(self):
+            return self.__rate.rate
 
     # ------------------------------------------------------------------
     #    Device constructor
     # ------------------------------------------------------------------
     def __init__(self, *args):
+        # created by init_device, released by delete_device
+        self.__image_status_cbk = None
+        self.__video_image_cbk = None
+        self.__video_rate_attrs = []
         super().__init__(*args)
         self.__className2deviceName = {}
         self.init_device()
@@ -414,6 +570,18 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
     # ------------------------------------------------------------------
     @core.DEB_MEMBER_FUNCT
     def delete_device(self):
+        if self.__image_status_cbk is not None:
+            self.__control.unregisterImageStatusCallback(self.__image_status_cbk)
+            self.__image_status_cbk.stop()
+            self.__image_status_cbk = None
+        if self.__video_image_cbk is not None:
+            self.__control.video().unregisterImageCallback(self.__video_image_cbk)
+            self.__video_image_cbk.stop()
+            self.__video_image_cbk = None
+        # the VideoFPSClasses rates may change before the next init_device
+        for attr_name in self.__video_rate_attrs:
+            self.remove_attribute(attr_name)
+        self.__video_rate_attrs = []
         try:
             m = get_camera_module(self.LimaCameraType)
         except ImportError:
@@ -437,6 +605,22 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
 
         self.__control = _get_control()
 
+        # DATA_ARRAY encoding buffers, one per reply kind
+        self.__image_encoder = DataArrayHelper.DataArrayEncoder()
+        self.__image_seq_encoder = DataArrayHelper.DataArrayEncoder()
+        self.__image_seq_page_encoder = DataArrayHelper.DataArrayEncoder()
+        self.__image_seq_max_bytes = int(self.ImageSeqMaxBytes)
+        self.__last_image_encoder = DataArrayHelper.DataArrayEncoder()
+        self.__video_image_encoder = VideoHelper.VideoImageEncoder()
+        # JPEG/WebP video preview, see video_preview_codec
+        self.__VideoPreviewCodec = {k: k for k in VideoHelper.VIDEO_PREVIEW_CODECS}
+        self.__video_preview_encoder = VideoHelper.VideoPreviewEncoder()
+        # optional DATA_ARRAY compression, see image_data_codec
+        self.__ImageDataCodec = dict(DataArrayHelper.DATA_ARRAY_CODECS)
+        self.__image_data_compressor = DataArrayHelper.DataArrayCompressor(
+            DataArrayHelper.DATA_ARRAY_CODEC_NONE
+        )
+
         # For performance settings Pool thread (default 2) and Writing tasks (default 1)
         nb_thread = int(self.NbProcessingThread)
         core.Processlib.PoolThreadMgr.get().setNumberOfThread(nb_thread)
@@ -692,15 +876,31 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
             "last_image_acquired",
             "last_image_ready",
             "last_image_saved",
+            "image_counters",
             "video_last_image",
             "video_last_image_counter",
+            "video_preview",
             "acq_status",
         ]:
             attr = attr_list.get_attr_by_name(attr_name)
             attr.set_change_event(True, False)
 
+        # video_last_image_<N>fps attributes, one per VideoFPSClasses rate
+        video_rate_classes = {}
+        for max_fps in self.VideoFPSClasses:
+            attr_name = "video_last_image_%sfps" % ("%g" % max_fps).replace(".", "p")
+            if attr_name in video_rate_classes:
+                continue
+            attr = PyTango.Attr(attr_name, PyTango.DevEncoded, PyTango.READ)
+            attr.set_change_event(True, False)
+            self.add_attribute(attr, self.read_video_last_image)
+            self.__video_rate_attrs.append(attr_name)
+            video_rate_classes[attr_name] = max_fps
+
         if self.TangoEvent:
-            self.__video_image_cbk = self.VideoImageCallback(self)
+            self.__video_image_cbk = self.VideoImageCallback(
+                self, self.__VideoMode, self.__video_preview_encoder, video_rate_classes
+            )
             self.__control.video().registerImageCallback(self.__video_image_cbk)
 
         # INIT events on last_image_ready
@@ -1407,7 +1607,9 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
         last_img_ready = status.ImageCounters.LastImageReady
         image = self.__control.ReadImage(last_img_ready)
         # workaround for PyTango #147
-        self._lidata = self._image_2_data_array(image, self.DataArrayCategory.Image)
+        self._lidata = self._image_2_data_array(
+            image, self.DataArrayCategory.Image, self.__last_image_encoder
+        )
         attr.set_value("DATA_ARRAY", self._lidata)
 
     ## @brief last image acquired
@@ -1452,6 +1654,24 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
 
         attr.set_value(value)
 
+    ## @brief Read all the image counters
+    #
+    # [last_base_image_ready, last_counter_ready, last_image_acquired,
+    #  last_image_ready, last_image_saved]
+    @core.DEB_MEMBER_FUNCT
+    def read_image_counters(self, attr):
+        status = self.__control.getStatus()
+        img_counters = status.ImageCounters
+
+        value = [
+            img_counters.LastBaseImageReady,
+            img_counters.LastCounterReady,
+            img_counters.LastImageAcquired,
+            img_counters.LastImageReady,
+            img_counters.LastImageSaved,
+        ]
+        attr.set_value(numpy.array(value, dtype=numpy.int64))
+
     ## @brief Read last image saved
     #
     @core.DEB_MEMBER_FUNCT
@@ -1479,6 +1699,34 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
         image_events = attr.get_write_value()
         self.__image_status_cbk.setImageEventsPushData(image_events)
 
+    ## @brief get if image_counters attr pushes events
+    #
+    @core.DEB_MEMBER_FUNCT
+    def read_image_events_push_counters(self, attr):
+        image_events = self.__image_status_cbk.getImageEventsPushCounters()
+        attr.set_value(image_events)
+
+    ## @brief set if image_counters attr pushes events
+    #
+    @core.DEB_MEMBER_FUNCT
+    def write_image_events_push_counters(self, attr):
+        image_events = attr.get_write_value()
+        self.__image_status_cbk.setImageEventsPushCounters(image_events)
+
+    ## @brief get if the image counter attrs push one event each
+    #
+    @core.DEB_MEMBER_FUNCT
+    def read_image_events_per_counter(self, attr):
+        image_events = self.__image_status_cbk.getImageEventsPerCounter()
+        attr.set_value(image_events)
+
+    ## @brief set if the image counter attrs push one event each
+    #
+    @core.DEB_MEMBER_FUNCT
+    def write_image_events_per_counter(self, attr):
+        image_events = attr.get_write_value()
+        self.__image_status_cbk.setImageEventsPerCounter(image_events)
+
     ## @brief get the max event generation rate
     #
     @core.DEB_MEMBER_FUNCT
@@ -1493,6 +1741,40 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
         event_rate = attr.get_write_value()
         self.__image_status_cbk.setImageEventsMaxRate(event_rate)
 
+    ## @brief get if the event rate adapts to the push latency
+    #
+    @core.DEB_MEMBER_FUNCT
+    def read_image_events_adaptive_rate(self, attr):
+        attr.set_value(self.__image_status_cbk.getImageEventsAdaptiveRate())
+
+    ## @brief set if the event rate adapts to the push latency
+    #
+    # the rate is lowered (down to 1 Hz) so that pushing the counters takes
+    # at most 10% of the time, and never exceeds image_events_max_rate
+    @core.DEB_MEMBER_FUNCT
+    def write_image_events_adaptive_rate(self, attr):
+        adaptive = attr.get_write_value()
+        self.__image_status_cbk.setImageEventsAdaptiveRate(adaptive)
+
+    ## @brief average time (s) to push the image counter events
+    #
+    @core.DEB_MEMBER_FUNCT
+    def read_image_events_push_latency(self, attr):
+        attr.set_value(self.__image_status_cbk.getImageEventsPushLatency())
+
+    ## @brief current image counter event rate (Hz)
+    #
+    @core.DEB_MEMBER_FUNCT
+    def read_image_events_effective_rate(self, attr):
+        attr.set_value(self.__image_status_cbk.getImageEventsEffectiveRate())
+
+    ## @brief nb of last_image events dropped in the current acquisition
+    #
+    # when the clients are too slow, only the latest image is pushed
+    @core.DEB_MEMBER_FUNCT
+    def read_last_image_events_dropped(self, attr):
+        attr.set_value(self.__image_status_cbk.getLastImageEventsDropped())
+
     ## @brief this flag is true just after
     #  the detector readout.
     #
@@ -1928,13 +2210,88 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
 
     def read_video_last_image(self, attr):
         video = self.__control.video()
-        self._videoStr = _video_image_2_struct(video.getLastImage())
+        self._videoStr = _video_image_2_struct(
+            video.getLastImage(), self.__video_image_encoder
+        )
         attr.set_value("VIDEO_IMAGE", self._videoStr)
 
     def read_video_last_image_counter(self, attr):
         video = self.__control.video()
         attr.set_value(video.getLastImageCounter())
 
+    ##@brief 8-bit JPEG/WebP preview of the last video image
+    #
+    # bounded to video_preview_max_size, see video_preview_codec
+    @core.DEB_MEMBER_FUNCT
+    def read_video_preview(self, attr):
+        if not self.__video_preview_encoder.enabled:
+            PyTango.Except.throw_exception(
+                "WrongData",
+                "Video preview is disabled, set video_preview_codec",
+                "LimaCCD Class",
+            )
+        image = self.__control.video().getLastImage()
+        mode = getDictKey(self.__VideoMode, image.mode())
+        attr.set_value(
+            *self.__video_preview_encoder.encode(
+                mode, image.width(), image.height(), image.buffer() or b""
+            )
+        )
+
+    def __set_video_preview_encoder(self, attr_name, **kwargs):
+        encoder = self.__video_preview_encoder
+        settings = {
+            "codec": encoder.codec,
+            "max_size": encoder.max_size,
+            "quality": encoder.quality,
+        }
+        settings.update(kwargs)
+        try:
+            encoder = VideoHelper.VideoPreviewEncoder(**settings)
+        except ValueError as e:
+            PyTango.Except.throw_exception(
+                "WrongData",
+                "Wrong value %s: %s" % (attr_name, e),
+                "LimaCCD Class",
+            )
+        self.__video_preview_encoder = encoder
+        if self.__video_image_cbk is not None:
+            self.__video_image_cbk.setPreviewEncoder(encoder)
+
+    @core.DEB_MEMBER_FUNCT
+    def read_video_preview_codec(self, attr):
+        attr.set_value(self.__video_preview_encoder.codec)
+
+    @core.DEB_MEMBER_FUNCT
+    def write_video_preview_codec(self, attr):
+        data = attr.get_write_value()
+        codec = getDictValue(self.__VideoPreviewCodec, data.upper())
+        if codec is None:
+            PyTango.Except.throw_exception(
+                "WrongData",
+                "Wrong value %s: %s" % ("video_preview_codec", data.upper()),
+                "LimaCCD Class",
+            )
+        self.__set_video_preview_encoder("video_preview_codec", codec=codec)
+
+    @core.DEB_MEMBER_FUNCT
+    def read_video_preview_max_size(self, attr):
+        attr.set_value(self.__video_preview_encoder.max_size)
+
+    @core.DEB_MEMBER_FUNCT
+    def write_video_preview_max_size(self, attr):
+        data = attr.get_write_value()
+        self.__set_video_preview_encoder("video_preview_max_size", max_size=data)
+
+    @core.DEB_MEMBER_FUNCT
+    def read_video_preview_quality(self, attr):
+        attr.set_value(self.__video_preview_encoder.quality)
+
+    @core.DEB_MEMBER_FUNCT
+    def write_video_preview_quality(self, attr):
+        data = attr.get_write_value()
+        self.__set_video_preview_encoder("video_preview_quality", quality=data)
+
     def read_plugin_type_list(self, attr):
         className2deviceName = get_sub_devices()
         attr.set_value(
@@ -2186,80 +2543,64 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
 
     ##@brief get a DATA_ARRAY from a Data object
     #
+    # The encoder buffer is reused by the next call, so each caller
+    # (command, attribute, event) must provide its own encoder
     @core.DEB_MEMBER_FUNCT
-    def _image_2_data_array(self, data, category):
-        d = data.buffer
-        s = [d.shape[i] for i in range(len(d.shape) - 1, -1, -1)]
-        if (category == self.DataArrayCategory.ImageStack) and (len(s) == 2):
-            s += [1]
-        nbDim = len(s)
-        maxNbDim = self.DataArrayMaxNbDim
-        if nbDim > maxNbDim:
-            raise ValueError("Invalid nb of dimensions: max is %d" % maxNbDim)
-
+    def _image_2_data_array(self, data, category, encoder=None):
+        if encoder is None:
+            encoder = DataArrayHelper.DataArrayEncoder()
         image = self.__control.image()
         imageType = image.getImageType()
         dataType = self.ImageType2DataArrayType.get(imageType, -1)
-        bigEndian = numpy.dtype(d.dtype.byteorder + "i4") == numpy.dtype(">i4")
-        imageNumber = data.frameNumber
-        acqTag = self.last_acq_tag
-
-        def steps_gen(s):
-            size = self.ImageType2NbBytes.get(imageType, (1, 0))[0]
-            for x in s:
-                yield size
-                size *= x
-
-        t = [i for i in steps_gen(s)]
-
-        s += [0] * (maxNbDim - nbDim)
-        t += [0] * (maxNbDim - nbDim)
-
-        # verify backward compatibility
-        headerlen = struct.calcsize(self.DataArrayPackStr)
-        if headerlen < self.DataArrayMinHeaderLen:
-            raise RuntimeError(
-                "Invalid header len: %d (min. expected %d)"
-                % (headerlen, self.DataArrayMinHeaderLen)
-            )
+        pixelSize = self.ImageType2NbBytes.get(imageType, (1, 0))[0]
 
-        # prepare the structure
-        dataheader = struct.pack(
-            self.DataArrayPackStr,
-            self.DataArrayMagic,  # 4 bytes I - magic number
-            self.DataArrayVersion,  # 2 bytes H - version
-            headerlen,  # 2 bytes H - this header length
-            category,  # 4 bytes I - category (enum)
-            dataType,  # 4 bytes I - data type (enum)
-            bigEndian,  # 2 bytes H - endianness
-            nbDim,  # 2 bytes H - nb of dims
-            s[0],
-            s[1],
-            s[2],
-            s[3],
-            s[4],
-            s[5],  # 12 bytes H x 6 - dims
-            t[0],
-            t[1],
-            t[2],
-            t[3],
-            t[4],
-            t[5],  # 24 bytes I x 6 - stepsbytes
-            imageNumber,  # 8 bytes Q x 1 - imageNumber
-            acqTag,  # 8 bytes Q x 1 - acqTag
-            0,
-            0,  # 8 bytes I x 2 - pading
-        )
-
-        flatData = d.ravel()
-        flatData.dtype = numpy.uint8
+        try:
+            data_array = encoder.encode(
+                data.buffer,
+                category,
+                dataType,
+                pixelSize,
+                data.frameNumber,
+                self.last_acq_tag,
+            )
+        finally:
+            release = getattr(data, "releaseBuffer", None)
+            if release:
+                release()
+        return self.__image_data_compressor.compress(data_array)
 
-        dataStr = dataheader + flatData.tobytes()
-        release = getattr(data, "releaseBuffer", None)
-        if release:
-            release()
+    ##@brief get a DATA_ARRAY stack from a list of frame numbers
+    #
+    # Frames are read one by one and copied straight into the encoder buffer
+    @core.DEB_MEMBER_FUNCT
+    def _frames_2_data_array(self, frame_numbers, category, encoder):
+        if not len(frame_numbers):
+            raise ValueError("Empty frame sequence")
+        image = self.__control.image()
+        imageType = image.getImageType()
+        dataType = self.ImageType2DataArrayType.get(imageType, -1)
+        pixelSize = self.ImageType2NbBytes.get(imageType, (1, 0))[0]
 
-        return dataStr
+        def frames_gen():
+            for frame_number in frame_numbers:
+                data = self.__control.ReadImage(frame_number)
+                try:
+                    yield data.buffer
+                finally:
+                    release = getattr(data, "releaseBuffer", None)
+                    if release:
+                        release()
+
+        data_array = encoder.encode_stack(
+            frames_gen(),
+            len(frame_numbers),
+            category,
+            dataType,
+            pixelSize,
+            frame_numbers[0],
+            self.last_acq_tag,
+        )
+        return self.__image_data_compressor.compress(data_array)
 
     ##@brief get image data
     #
@@ -2268,7 +2609,9 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
         deb.Param("readImage: frame_number=%d" % frame_number)
         image = self.__control.ReadImage(frame_number)
         category = self.DataArrayCategory.Image
-        self._datacache = self._image_2_data_array(image, category)
+        self._datacache = self._image_2_data_array(
+            image, category, self.__image_encoder
+        )
         return ("DATA_ARRAY", self._datacache)
 
     ##@brief get last image data (if new image since last_frame_number)
@@ -2291,15 +2634,15 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
         else:
             image = self.__control.ReadImage(-1)
             category = self.DataArrayCategory.Image
-            self._datacache = self._image_2_data_array(image, category)
+            self._datacache = self._image_2_data_array(
+                image, category, self.__image_encoder
+            )
             return ("DATA_ARRAY", self._datacache)
 
-    ##@brief get the data for an image sequence
+    ##@brief parse and check the readImageSeq arguments
     #
-    # @params start,end[,step[,acq_tag]]
-    @core.DEB_MEMBER_FUNCT
-    def readImageSeq(self, frame_seq):
-        deb.Param("frame_seq=%s" % frame_seq)
+    # @returns start,end,step,acq_tag
+    def _parse_image_seq(self, frame_seq):
         frame_seq = [int(f) for f in frame_seq]
         start, end = frame_seq[:2]
         step = 1
@@ -2307,8 +2650,12 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
         nb_args = len(frame_seq)
         if nb_args > 2:
             step = frame_seq[2]
-            if step != 1:
-                raise ValueError("Discontiguous sequences not supported yet")
+            if step < 1:
+                raise ValueError("Invalid sequence step: %d" % step)
+        if end < 0:
+            status = self.__control.getStatus()
+            last_frame = status.ImageCounters.LastImageReady
+            end = DataArrayHelper.image_seq_frames(start, end, step, last_frame).stop
         if nb_args > 3:
             acq_tag = frame_seq[3] & 0xFFFFFFFF
             if acq_tag != self.AcqTagNone:
@@ -2318,16 +2665,97 @@ class LimaCCDs(PyTango.LatestDeviceImpl):
                     raise RuntimeError(
                         "Acq. #%s (0x%08x) is not available" % (acq_tag, acq_tag)
                     )
-        nbFrames = end - start
+        return start, end, step, acq_tag
+
+    ##@brief encode frames start + i * step, 0 <= i < nbFrames
+    def _image_seq_2_data_array(self, start, step, nbFrames, encoder):
+        category = self.DataArrayCategory.ImageStack
+        if step == 1:
+            imageStack = self.__control.ReadImage(start, nbFrames)
+            return self._image_2_data_array(imageStack, category, encoder)
+        else:
+            # only read the requested frames out of the frame buffer
+            frames = range(start, start + nbFrames * step, step)
+            return self._frames_2_data_array(frames, category, encoder)
+
+    ##@brief get the data for an image sequence
+    #
+    # @params start,end[,step[,acq_tag]]
+    @core.DEB_MEMBER_FUNCT
+    def readImageSeq(self, frame_seq):
+        deb.Param("frame_seq=%s" % frame_seq)
+        start, end, step, acq_tag = self._parse_image_seq(frame_seq)
+        nbFrames = end - start if step == 1 else len(range(start, end, step))
         deb.Param(
             "readImageSeq: start,end,step = %d,%d,%d (%d frames), "
             "acq_tag = %s (0x%08x) " % (start, end, step, nbFrames, acq_tag, acq_tag)
         )
-        imageStack = self.__control.ReadImage(start, nbFrames)
-        category = self.DataArrayCategory.ImageStack
-        self._dataseqcache = self._image_2_data_array(imageStack, category)
+        self._dataseqcache = self._image_seq_2_data_array(
+            start, step, nbFrames, self.__image_seq_encoder
+        )
+        return ("DATA_ARRAY", self._dataseqcache)
+
+    ##@brief get the first page of an image sequence
+    #
+    # Same as readImageSeq but the reply is bounded to image_seq_max_bytes
+    # (at least one frame). The DATA_ARRAY header gives the first frame
+    # number and the nb of frames of the page, so the client continues
+    # with start = image_number + nb_frames * step until end is reached.
+    # @params start,end[,step[,acq_tag]]
+    @core.DEB_MEMBER_FUNCT
+    def readImageSeqPage(self, frame_seq):
+        deb.Param("frame_seq=%s" % frame_seq)
+        start, end, step, acq_tag = self._parse_image_seq(frame_seq)
+        nbFrames = len(range(start, end, step))
+        if not nbFrames:
+            raise ValueError("Empty frame sequence")
+        if self.__image_seq_max_bytes > 0:
+            image = self.__control.image()
+            frameSize = image.getImageDim().getMemSize()
+            maxFrames = max(1, self.__image_seq_max_bytes // frameSize)
+            nbFrames = min(nbFrames, maxFrames)
+        deb.Param(
+            "readImageSeqPage: start,end,step = %d,%d,%d (%d frames), "
+            "acq_tag = %s (0x%08x) " % (start, end, step, nbFrames, acq_tag, acq_tag)
+        )
+        self._dataseqcache = self._image_seq_2_data_array(
+            start, step, nbFrames, self.__image_seq_page_encoder
+        )
         return ("DATA_ARRAY", self._dataseqcache)
 
+    ##@brief max size of a readImageSeqPage reply
+    #
+    @core.DEB_MEMBER_FUNCT
+    def read_image_seq_max_bytes(self, attr):
+        attr.set_value(self.__image_seq_max_bytes)
+
+    @core.DEB_MEMBER_FUNCT
+    def write_image_seq_max_bytes(self, attr):
+        data = attr.get_write_value()
+        self.__image_seq_max_bytes = int(data)
+
+    ##@brief codec used to compress the DATA_ARRAY image replies
+    #
+    # applies to readImage, readLastImage, readImageSeq, readImageSeqPage
+    # and to the last_image attribute and event
+    @core.DEB_MEMBER_FUNCT
+    def read_image_data_codec(self, attr):
+        codec = self.__image_data_compressor.codec
+        attr.set_value(getDictKey(self.__ImageDataCodec, codec))
+
+    @core.DEB_MEMBER_FUNCT
+    def write_image_data_codec(self, attr):
+        data = attr.get_write_value()
+        codec = getDictValue(self.__ImageDataCodec, data.upper())
+        if codec is None:
+            PyTango.Except.throw_exception(
+                "WrongData",
+                "Wrong value %s: %s" % ("image_data_codec", data.upper()),
+                "LimaCCD Class",
+            )
+        else:
+            self.__image_data_compressor = DataArrayHelper.DataArrayCompressor(codec)
+
     ##@brief get base image data
     #
     # image before post processing
@@ -2507,6 +2935,16 @@ class LimaCCDsClass(PyTango.DeviceClass):
             [],
         ],
         "MaxVideoFPS": [PyTango.DevDouble, "Maximum number of FPS for video", [30.0]],
+        "VideoFPSClasses": [
+            PyTango.DevVarDoubleArray,
+            "Max. FPS of the additional video_last_image_<N>fps attributes",
+            [],
+        ],
+        "MaxVideoPreviewFPS": [
+            PyTango.DevDouble,
+            "Maximum number of FPS for the video preview",
+            [5.0],
+        ],
         "UserDetectorName": [
             PyTango.DevString,
             "A user detector identifier, e.g frelon-saxs",
@@ -2534,6 +2972,11 @@ class LimaCCDsClass(PyTango.DeviceClass):
             [0],
         ],
         "TangoEvent": [PyTango.DevBoolean, "Activate Tango event", [False]],
+        "ImageSeqMaxBytes": [
+            PyTango.DevLong64,
+            "Max. size in bytes of a readImageSeqPage reply, 0 means no limit",
+            [256 * 1024 * 1024],
+        ],
         "SavingMaxConcurrentWritingTask": [
             PyTango.DevShort,
             "Maximum concurrent writing tasks",
@@ -2606,6 +3049,13 @@ class LimaCCDsClass(PyTango.DeviceClass):
             [PyTango.DevVarLong64Array, "Image id seq: start,end[,step[,acq_tag]]"],
             [PyTango.DevEncoded, "DATA_ARRAY with requested images"],
         ],
+        "readImageSeqPage": [
+            [PyTango.DevVarLong64Array, "Image id seq: start,end[,step[,acq_tag]]"],
+            [
+                PyTango.DevEncoded,
+                "DATA_ARRAY with the first requested images, up to image_seq_max_bytes",
+            ],
+        ],
         "getPluginDeviceNameFromType": [
             [PyTango.DevString, "plugin type"],
             [PyTango.DevString, "device name"],
@@ -2741,12 +3191,35 @@ class LimaCCDsClass(PyTango.DeviceClass):
         "last_image": [[PyTango.DevEncoded, PyTango.SCALAR, PyTango.READ]],
         "last_image_saved": [[PyTango.DevLong, PyTango.SCALAR, PyTango.READ]],
         "last_counter_ready": [[PyTango.DevLong, PyTango.SCALAR, PyTango.READ]],
+        "image_counters": [[PyTango.DevLong64, PyTango.SPECTRUM, PyTango.READ, 5]],
         "image_events_push_data": [
             [PyTango.DevBoolean, PyTango.SCALAR, PyTango.READ_WRITE]
         ],
+        "image_events_push_counters": [
+            [PyTango.DevBoolean, PyTango.SCALAR, PyTango.READ_WRITE]
+        ],
+        "image_events_per_counter": [
+            [PyTango.DevBoolean, PyTango.SCALAR, PyTango.READ_WRITE]
+        ],
         "image_events_max_rate": [
             [PyTango.DevFloat, PyTango.SCALAR, PyTango.READ_WRITE]
         ],
+        "image_events_adaptive_rate": [
+            [PyTango.DevBoolean, PyTango.SCALAR, PyTango.READ_WRITE]
+        ],
+        "image_events_push_latency": [
+            [PyTango.DevDouble, PyTango.SCALAR, PyTango.READ]
+        ],
+        "image_events_effective_rate": [
+            [PyTango.DevDouble, PyTango.SCALAR, PyTango.READ]
+        ],
+        "last_image_events_dropped": [
+            [PyTango.DevLong64, PyTango.SCALAR, PyTango.READ]
+        ],
+        "image_seq_max_bytes": [
+            [PyTango.DevLong64, PyTango.SCALAR, PyTango.READ_WRITE]
+        ],
+        "image_data_codec": [[PyTango.DevString, PyTango.SCALAR, PyTango.READ_WRITE]],
         "ready_for_next_image": [[PyTango.DevBoolean, PyTango.SCALAR, PyTango.READ]],
         "ready_for_next_acq": [[PyTango.DevBoolean, PyTango.SCALAR, PyTango.READ]],
         "saving_directory": [[PyTango.DevString, PyTango.SCALAR, PyTango.READ_WRITE]],
@@ -2856,6 +3329,26 @@ class LimaCCDsClass(PyTango.DeviceClass):
             },
         ],
         "video_last_image_counter": [[PyTango.DevLong64, PyTango.SCALAR, PyTango.READ]],
+        "video_preview": [
+            [PyTango.DevEncoded, PyTango.SCALAR, PyTango.READ],
+            {
+                "label": "the video preview",
+                "unit": "",
+                "standard unit": "",
+                "display unit": "",
+                "format": "%d",
+                "description": "8-bit JPEG or WebP video preview",
+            },
+        ],
+        "video_preview_codec": [
+            [PyTango.DevString, PyTango.SCALAR, PyTango.READ_WRITE]
+        ],
+        "video_preview_max_size": [
+            [PyTango.DevLong, PyTango.SCALAR, PyTango.READ_WRITE]
+        ],
+        "video_preview_quality": [
+            [PyTango.DevLong, PyTango.SCALAR, PyTango.READ_WRITE]
+        ],
         "plugin_type_list": [[PyTango.DevString, PyTango.SPECTRUM, PyTango.READ, 256]],
         "plugin_list": [[PyTango.DevString, PyTango.SPECTRUM, PyTango.READ, 256]],
         "shared_memory_names": [
@@ -3057,25 +3550,19 @@ def _not_allowed(*args):
     return False
 
 
-def _video_image_2_struct(image):
-    VIDEO_HEADER_FORMAT = "!IHHqiiHHHH"
-    videoheader = struct.pack(
-        VIDEO_HEADER_FORMAT,
-        0x5644454F,  # Magic
-        1,  # header version
-        image.mode().value,  # image mode (Y8,Y16...)
-        image.frameNumber(),  # frame number
-        image.width(),  # width
-        image.height(),  # height
-        ord(struct.pack("=H", 1).decode()[-1]),  # endianness
-        struct.calcsize(VIDEO_HEADER_FORMAT),  # header size
-        0,  # padding
-        0,  # padding
+# The encoder buffer is reused by the next call, so each caller
+# (attribute, event) must provide its own encoder
+def _video_image_2_struct(image, encoder=None):
+    if encoder is None:
+        encoder = VideoHelper.VideoImageEncoder()
+    return encoder.encode(
+        image.mode().value,
+        image.frameNumber(),
+        image.width(),
+        image.height(),
+        image.buffer(),
     )
 
-    data = image.buffer() or b""
-    return videoheader + data
-
 
 def _acqstate2string(state):
     state2string = {
@@ -0,0 +1,146 @@
+############################################################################
+# This file is part of LImA, a Library for Image Acquisition
+#
+# Copyright (C) : 2009-2026
+# European Synchrotron Radiation Facility
+# CS40220 38043 Grenoble Cedex 9
+# FRANCE
+# Contact: lima@esrf.fr
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# ============================================================================
+#                              HELPERS
+# ============================================================================
+#
+# RESULT_TABLE DevEncoded encoding, used by the counter-style plugins
+# (RoiCounter, PeakFinder) to return their results as columns.
+# This module only depends on numpy so it can be used (and tested) without
+# the LIMA core.
+
+import itertools
+import operator
+import struct
+import numpy
+
+# The RESULT_TABLE definition v1, little-endian
+# struct {
+# unsigned int Magic= 0x5254424c;
+# unsigned short Version;
+# unsigned short HeaderLength;
+# unsigned int NbRows;
+# unsigned short NbColumns;
+# unsigned short pading;
+# struct {
+#     char Name[16];
+#     char DType[4];
+#     unsigned int pading;
+# } Columns[NbColumns];
+# } ResultTableHeaderStruct;
+# followed by the columns one after the other, each one padded to 8 bytes
+
+RESULT_TABLE_FORMAT = "RESULT_TABLE"
+RESULT_TABLE_VERSION = 1
+RESULT_TABLE_PACK_STR = "<IHHIHH"
+RESULT_TABLE_COLUMN_PACK_STR = "<16s4s4x"
+RESULT_TABLE_MAGIC = struct.unpack(">I", b"RTBL")[0]  # 0x5254424c
+RESULT_TABLE_HEADER_LEN = struct.calcsize(RESULT_TABLE_PACK_STR)
+RESULT_TABLE_COLUMN_LEN = struct.calcsize(RESULT_TABLE_COLUMN_PACK_STR)
+
+
+def _padded(size):
+    return (size + 7) & ~7
+
+
+def result_columns(results, attrs):
+    """Returns the double arrays of the attributes attrs (at least 2) of a
+    list of result objects, one array per attribute"""
+    nb_results = len(results)
+    values = itertools.chain.from_iterable(map(operator.attrgetter(*attrs), results))
+    values = numpy.fromiter(values, numpy.double, nb_results * len(attrs))
+    return values.reshape(nb_results, len(attrs)).T
+
+
+def encode_result_table(columns):
+    """Returns the RESULT_TABLE bytes of a [(name, 1-D array), ...] list
+
+    The columns must have the same length. They are stored with their own
+    type, in little-endian byte order.
+    """
+    columns = [(name, numpy.asarray(column)) for name, column in columns]
+    nb_rows = len(columns[0][1]) if columns else 0
+    header_len = RESULT_TABLE_HEADER_LEN + RESULT_TABLE_COLUMN_LEN * len(columns)
+    dtypes = []
+    size = header_len
+    for name, column in columns:
+        if len(name.encode()) > 16:
+            raise ValueError("Column name %s: should be at most 16 bytes" % name)
+        if column.shape != (nb_rows,):
+            raise ValueError("Column %s: should be 1-D with %d rows" % (name, nb_rows))
+        dtype = column.dtype.newbyteorder("<")
+        dtypes.append(dtype)
+        size += _padded(nb_rows * dtype.itemsize)
+    buffer = bytearray(size)
+    struct.pack_into(
+        RESULT_TABLE_PACK_STR,
+        buffer,
+        0,
+        RESULT_TABLE_MAGIC,
+        RESULT_TABLE_VERSION,
+        header_len,
+        nb_rows,
+        len(columns),
+        0,
+    )
+    offset = header_len
+    for i, ((name, column), dtype) in enumerate(zip(columns, dtypes)):
+        struct.pack_into(
+            RESULT_TABLE_COLUMN_PACK_STR,
+            buffer,
+            RESULT_TABLE_HEADER_LEN + i * RESULT_TABLE_COLUMN_LEN,
+            name.encode(),
+            dtype.str.encode(),
+        )
+        numpy.frombuffer(buffer, dtype, nb_rows, offset)[:] = column
+        offset += _padded(nb_rows * dtype.itemsize)
+    return buffer
+
+
+def decode_result_table(data):
+    """Returns the columns of a RESULT_TABLE as a {name: array} dict
+
+    The arrays are views of data, in the column order.
+    """
+    magic, version, header_len, nb_rows, nb_columns, _ = struct.unpack_from(
+        RESULT_TABLE_PACK_STR, data
+    )
+    if magic != RESULT_TABLE_MAGIC:
+        raise ValueError("Not a RESULT_TABLE: bad magic 0x%08x" % magic)
+    if version > RESULT_TABLE_VERSION:
+        raise ValueError("Unsupported RESULT_TABLE version %d" % version)
+    columns = {}
+    offset = header_len
+    for i in range(nb_columns):
+        name, dtype = struct.unpack_from(
+            RESULT_TABLE_COLUMN_PACK_STR,
+            data,
+            RESULT_TABLE_HEADER_LEN + i * RESULT_TABLE_COLUMN_LEN,
+        )
+        dtype = numpy.dtype(dtype.rstrip(b"\0").decode())
+        columns[name.rstrip(b"\0").decode()] = numpy.frombuffer(
+            data, dtype, nb_rows, offset
+        )
+        offset += _padded(nb_rows * dtype.itemsize)
+    return columns
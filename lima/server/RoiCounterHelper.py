@@ -0,0 +1,585 @@
+############################################################################
+# This file is part of LImA, a Library for Image Acquisition
+#
+# Copyright (C) : 2009-2026
+# European Synchrotron Radiation Facility
+# CS40220 38043 Grenoble Cedex 9
+# FRANCE
+# Contact: lima@esrf.fr
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# ============================================================================
+#                              HELPERS
+# ============================================================================
+#
+# Parsing of the roi definitions, packing, incremental reading and change
+# events of the results returned by the RoiCounterTaskMgr, sharding of the
+# rois over several managers and evaluation of the sparse (pixel list) rois,
+# used by the RoiCounter plugin.
+# This module does not depend on the LIMA core so it can be used (and tested)
+# on its own.
+
+import collections
+import itertools
+import operator
+import threading
+import time
+import numpy
+
+from lima.server import EventHelper
+
+# the RoiCounterResult attributes returned by readCounters, after the roi id
+RESULT_FIELDS = ("frameNumber", "sum", "average", "std", "minValue", "maxValue")
+_result_values = operator.attrgetter(*RESULT_FIELDS)
+
+
+def _pack_results(roi_results, roi_ids, nb_results):
+    """Returns the flat array of the nb_results[i] first results of each roi
+
+    The results of the rois without an id (e.g. just removed) are skipped.
+    """
+    known = [
+        (roi_ids[name], results, nb)
+        for (name, results), nb in zip(roi_results, nb_results)
+        if name in roi_ids
+    ]
+    packed = numpy.empty((sum(nb for _, _, nb in known), 7), dtype=numpy.double)
+    start = 0
+    for roi_id, results, nb in known:
+        counters = packed[start : start + nb]
+        start += nb
+        counters[:, 0] = roi_id
+        # one C call per result instead of 6 attribute lookups in Python
+        values = itertools.chain.from_iterable(map(_result_values, results[:nb]))
+        counters[:, 1:] = numpy.fromiter(values, numpy.double, nb * 6).reshape(nb, 6)
+    return packed.reshape(-1)
+
+
+def pack_counters(roi_results, roi_ids):
+    """Returns the readCounters array from the RoiCounterTaskMgr results
+
+    roi_results is the [(roi name, [RoiCounterResult, ...]), ...] list of the
+    manager, roi_ids maps the roi names to their ids.
+    The array is flat, 7 values per roi and frame:
+    roi_id, frame number, sum, average, std, min, max
+    for the frames available for all the rois, roi by roi. The rois
+    without an id are skipped.
+    """
+    roi_results = [(name, results) for name, results in roi_results if name in roi_ids]
+    if not roi_results:
+        return numpy.array([], dtype=numpy.double)
+    nb_frames = min(len(results) for name, results in roi_results)
+    return _pack_results(roi_results, roi_ids, [nb_frames] * len(roi_results))
+
+
+def parse_rois(names, geometry):
+    """Returns the (N, 4) array of the x, y, width, height of N named rois
+
+    geometry is the flat [x0, y0, width0, height0, x1, ...] vector.
+    Raises ValueError if the geometry does not match the names, if a name is
+    repeated or if a roi is empty or has a negative position.
+    """
+    geometry = numpy.asarray(geometry, dtype=numpy.int64)
+    if geometry.size != 4 * len(names):
+        raise ValueError(
+            "should be %d names and a vector as follow [x0,y0,width0,height0,...]"
+            % (geometry.size // 4)
+        )
+    if len(set(names)) != len(names):
+        raise ValueError("Roi names should be unique")
+    geometry = geometry.reshape(-1, 4)
+    invalid = (geometry[:, :2] < 0).any(axis=1) | (geometry[:, 2:] <= 0).any(axis=1)
+    if invalid.any():
+        index = numpy.flatnonzero(invalid)[0]
+        raise ValueError(
+            "Roi %s: invalid geometry %s" % (names[index], geometry[index].tolist())
+        )
+    return geometry
+
+
+def counters_table(packed):
+    """Returns the RESULT_TABLE columns of the packed counters, see
+    pack_counters"""
+    counters = packed.reshape(-1, 7)
+    columns = [
+        ("roi_id", counters[:, 0].astype(numpy.int32)),
+        ("frame_number", counters[:, 1].astype(numpy.int32)),
+    ]
+    for i, name in enumerate(("sum", "average", "std", "min", "max")):
+        columns.append((name, counters[:, i + 2]))
+    return columns
+
+
+class CounterCursor(object):
+    """Incremental reader of the RoiCounterTaskMgr results.
+
+    Each read returns the results of each roi since the previous read,
+    without waiting for the slowest roi. The frames dropped from the
+    manager buffer (BufferSize) before being read are counted as lost.
+    """
+
+    def __init__(self):
+        # roi name -> next frame number to read
+        self.next_frames = {}
+
+    def read(self, read_counters, counter_status, roi_ids):
+        """Returns the (number of lost frames, packed results) since the
+        previous read
+
+        read_counters(from_frame) returns the manager results from a frame,
+        counter_status is the last frame processed by the manager and
+        roi_ids maps the roi names to their ids.
+        The results are packed roi by roi as by pack_counters.
+        """
+        next_frames = self.next_frames
+        if next_frames and counter_status < max(next_frames.values()) - 1:
+            # a new acquisition has started
+            next_frames = {}
+        from_frame = min(next_frames.values(), default=0)
+        roi_results = read_counters(from_frame)
+        lost = 0
+        new_results = []
+        self.next_frames = {}
+        for name, results in roi_results:
+            next_frame = next_frames.get(name, 0)
+            first = 0
+            while first < len(results) and results[first].frameNumber < next_frame:
+                first += 1
+            results = results[first:]
+            if results:
+                if name in next_frames:
+                    lost = max(lost, results[0].frameNumber - next_frame)
+                next_frame = results[-1].frameNumber + 1
+            self.next_frames[name] = next_frame
+            new_results.append((name, results))
+        nb_results = [len(results) for name, results in new_results]
+        return lost, _pack_results(new_results, roi_ids, nb_results)
+
+
+def _roi_name(name):
+    return name.decode() if isinstance(name, bytes) else name
+
+
+class ShardedRoiCounterMgr(object):
+    """Spread the rois over several RoiCounterTaskMgr.
+
+    The managers (one roi counter task each, at the same run level) are
+    processed in parallel by the processing threads, a roi being evaluated
+    by the manager with the fewest rois when it is first defined. The
+    methods used by the RoiCounter plugin are forwarded to the managers of
+    the rois and the lists they return are merged in the roi definition
+    order, whatever the number of managers.
+    """
+
+    def __init__(self, managers):
+        self.managers = list(managers)
+        # roi name -> (definition rank, manager index)
+        self._shards = {}
+        self._loads = [0] * len(self.managers)
+        self._ranks = itertools.count()
+
+    def _shard(self, name):
+        name = _roi_name(name)
+        shard = self._shards.get(name)
+        if shard is None:
+            index = self._loads.index(min(self._loads))
+            self._loads[index] += 1
+            shard = self._shards[name] = (next(self._ranks), index)
+        return shard[1]
+
+    def _split(self, items, name):
+        """Returns the items of each manager, name(item) being the roi name"""
+        split = [[] for mgr in self.managers]
+        for item in items:
+            split[self._shard(name(item))].append(item)
+        return split
+
+    def _merge(self, method, name, *args):
+        """Returns the merged lists returned by a method of the managers"""
+        items = []
+        for mgr in self.managers:
+            items.extend(getattr(mgr, method)(*args))
+        # the rois unknown to the shards, if any, go first
+        unknown = (-1, 0)
+        items.sort(key=lambda item: self._shards.get(_roi_name(name(item)), unknown))
+        return items
+
+    def _forward(self, method, *args):
+        for mgr in self.managers:
+            getattr(mgr, method)(*args)
+
+    def setBufferSize(self, size):
+        self._forward("setBufferSize", size)
+
+    def setMask(self, mask):
+        self._forward("setMask", mask)
+
+    def setOverflowThreshold(self, threshold):
+        self._forward("setOverflowThreshold", threshold)
+
+    def clearCounterStatus(self):
+        self._forward("clearCounterStatus")
+
+    def getCounterStatus(self):
+        """Returns the last frame processed by all the managers"""
+        return min(mgr.getCounterStatus() for mgr in self.managers)
+
+    def clearAllRois(self):
+        self._forward("clearAllRois")
+        self._shards = {}
+        self._loads = [0] * len(self.managers)
+
+    def updateRois(self, rois):
+        for mgr, mgr_rois in zip(self.managers, self._split(rois, _first)):
+            if mgr_rois:
+                mgr.updateRois(mgr_rois)
+
+    def updateArcRois(self, rois):
+        for mgr, mgr_rois in zip(self.managers, self._split(rois, _first)):
+            if mgr_rois:
+                mgr.updateArcRois(mgr_rois)
+
+    def setLut(self, name, origin, data):
+        self.managers[self._shard(name)].setLut(name, origin, data)
+
+    def setLutMask(self, name, origin, data):
+        self.managers[self._shard(name)].setLutMask(name, origin, data)
+
+    def removeRois(self, names):
+        split = [[] for mgr in self.managers]
+        for name in names:
+            shard = self._shards.pop(_roi_name(name), None)
+            if shard is not None:
+                rank, index = shard
+                self._loads[index] -= 1
+                split[index].append(name)
+        for mgr, mgr_names in zip(self.managers, split):
+            if mgr_names:
+                mgr.removeRois(mgr_names)
+
+    def getNames(self):
+        return self._merge("getNames", _roi_name)
+
+    def getTypes(self):
+        return self._merge("getTypes", _first)
+
+    def getRois(self):
+        return self._merge("getRois", _first)
+
+    def getArcRois(self):
+        return self._merge("getArcRois", _first)
+
+    def getTasks(self):
+        return self._merge("getTasks", _first)
+
+    def readCounters(self, from_frame):
+        return self._merge("readCounters", _first, from_frame)
+
+
+_first = operator.itemgetter(0)
+
+
+class CounterCursors(object):
+    """The CounterCursor opened by the clients, by id.
+
+    A client may disappear without closing its cursors: at most
+    max_cursors are kept, the least recently used being closed first, and
+    the cursors not used for idle_timeout seconds are closed.
+    """
+
+    def __init__(self, max_cursors, idle_timeout):
+        self.max_cursors = max_cursors
+        self.idle_timeout = idle_timeout
+        # id -> (cursor, last use time), least recently used first
+        self._cursors = collections.OrderedDict()
+        self._ids = itertools.count()
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def _expire(self, now):
+        while self._cursors:
+            cursor_id, (cursor, last_use) = next(iter(self._cursors.items()))
+            if len(self._cursors) < self.max_cursors and (
+                now - last_use < self.idle_timeout
+            ):
+                break
+            del self._cursors[cursor_id]
+
+    def open(self):
+        """Returns the id of a new cursor"""
+        now = time.monotonic()
+        self._expire(now)
+        cursor_id = next(self._ids)
+        self._cursors[cursor_id] = CounterCursor(), now
+        return cursor_id
+
+    def get(self, cursor_id):
+        """Returns a cursor, raises ValueError if it is not opened"""
+        now = time.monotonic()
+        entry = self._cursors.pop(cursor_id, None)
+        if entry is None or now - entry[1] >= self.idle_timeout:
+            raise ValueError("Cursor %d not opened" % cursor_id)
+        self._cursors[cursor_id] = entry[0], now
+        return entry[0]
+
+    def close(self, cursor_id):
+        if self._cursors.pop(cursor_id, None) is None:
+            raise ValueError("Cursor %d not opened" % cursor_id)
+
+    def clear(self):
+        self._cursors.clear()
+
+
+class ResultEventPusher(object):
+    """Push the new RoiCounter results as change events.
+
+    notify() is called for each processed frame, from the processing
+    threads. A worker thread reads all the results since the previous event
+    with read() and pushes them in one batch with push(results), at most
+    max_rate times per second (no limit if max_rate <= 0). After each event,
+    a last read is scheduled for the results held back by the rate limit or
+    still being computed.
+    """
+
+    def __init__(self, read, push, max_rate):
+        self._read = read
+        self._push = push
+        self._interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self._last_time = None
+        self._lock = threading.Lock()
+        self._worker = EventHelper.LatestWinsWorker(
+            self._process, name="RoiCounterResultEvent"
+        )
+        self._flush = EventHelper.TrailingFlush(
+            self._process, name="RoiCounterResultFlush"
+        )
+
+    def notify(self):
+        self._worker.submit(None)
+
+    def stop(self):
+        self._worker.stop()
+        self._flush.stop()
+
+    def _process(self, item=None):
+        with self._lock:
+            now = time.monotonic()
+            if self._last_time is not None:
+                delay = self._last_time + self._interval - now
+                if delay > 0:
+                    self._flush.schedule(delay)
+                    return
+            results = self._read()
+            if not len(results):
+                return
+            self._last_time = now
+            self._push(results)
+        self._flush.schedule(self._interval)
+
+
+class SparseRois(object):
+    """Rois given as a CSR sparse matrix of pixel weights.
+
+    The pixels of the roi i are the flat frame indexes
+    indices[indptr[i]:indptr[i + 1]], with the weights
+    weights[indptr[i]:indptr[i + 1]] (1 by default). All the rois are
+    evaluated at once by sparse matrix - vector products, instead of one
+    task per roi.
+    """
+
+    def __init__(self, indptr, indices, weights=None):
+        indptr = numpy.asarray(indptr, dtype=numpy.int64)
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        if (
+            indptr.ndim != 1
+            or len(indptr) < 1
+            or indptr[0] != 0
+            or indptr[-1] != len(indices)
+            or (numpy.diff(indptr) < 0).any()
+        ):
+            raise ValueError("Sparse rois: invalid indptr")
+        if len(indices) and indices.min() < 0:
+            raise ValueError("Sparse rois: negative pixel index")
+        if weights is None:
+            weights = numpy.ones(len(indices))
+        weights = numpy.asarray(weights, dtype=numpy.double)
+        if weights.shape != indices.shape:
+            raise ValueError("Sparse rois: should be one weight per pixel index")
+        self.nb_rois = len(indptr) - 1
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.max_index = indices.max() if len(indices) else -1
+        sizes = numpy.diff(indptr)
+        # roi of each pixel index
+        self._rois = numpy.repeat(numpy.arange(self.nb_rois), sizes)
+        self._weight_sums = numpy.bincount(self._rois, weights, self.nb_rois)
+        self._non_empty = numpy.flatnonzero(sizes)
+        self._starts = indptr[:-1][self._non_empty]
+
+    def select(self, rois):
+        """Returns the SparseRois of the given roi indexes"""
+        indptr = self.indptr
+        sizes = numpy.diff(indptr)[rois]
+        pixels = [numpy.arange(indptr[i], indptr[i + 1]) for i in rois]
+        pixels = numpy.concatenate(pixels) if pixels else numpy.array([], numpy.int64)
+        return SparseRois(
+            numpy.concatenate(([0], numpy.cumsum(sizes))),
+            self.indices[pixels],
+            self.weights[pixels],
+        )
+
+    def evaluate(self, frame):
+        """Returns the (nb_rois, 5) sum, average, std, min, max of the rois,
+        0 for the empty rois"""
+        frame = numpy.ravel(frame)
+        if self.max_index >= frame.size:
+            raise ValueError("Sparse rois: pixel index out of the frame")
+        values = frame[self.indices].astype(numpy.double)
+        weighted = self.weights * values
+        result = numpy.zeros((self.nb_rois, 5))
+        sums = numpy.bincount(self._rois, weighted, self.nb_rois)
+        squares = numpy.bincount(self._rois, weighted * values, self.nb_rois)
+        weight_sums = self._weight_sums
+        valid = weight_sums != 0
+        average = sums[valid] / weight_sums[valid]
+        variance = squares[valid] / weight_sums[valid] - average**2
+        result[:, 0] = sums
+        result[valid, 1] = average
+        result[valid, 2] = numpy.sqrt(numpy.maximum(variance, 0))
+        if len(self._starts):
+            result[self._non_empty, 3] = numpy.minimum.reduceat(values, self._starts)
+            result[self._non_empty, 4] = numpy.maximum.reduceat(values, self._starts)
+        return result
+
+
+def parse_sparse_rois(names, values):
+    """Returns the SparseRois of N named rois
+
+    values is the flat [indptr (N + 1 values), indices, weights] vector,
+    without the weights for unit weights.
+    """
+    values = numpy.asarray(values, dtype=numpy.double)
+    nb_rois = len(names)
+    if len(set(names)) != nb_rois:
+        raise ValueError("Roi names should be unique")
+    if len(values) < nb_rois + 1:
+        raise ValueError(
+            "should be a vector as follow [indptr0,...,indptrN,indices...,weights...]"
+        )
+    indptr = values[: nb_rois + 1]
+    nb_indices = int(indptr[-1])
+    indices = values[nb_rois + 1 : nb_rois + 1 + nb_indices]
+    weights = values[nb_rois + 1 + nb_indices :]
+    if len(indices) != nb_indices or len(weights) not in (0, nb_indices):
+        raise ValueError("Sparse rois: vector size does not match indptr")
+    integers = numpy.concatenate((indptr, indices))
+    if (integers != numpy.rint(integers)).any():
+        raise ValueError("Sparse rois: indptr and indices should be integers")
+    return SparseRois(indptr, indices, weights if len(weights) else None)
+
+
+class SparseRoiSet(object):
+    """The named SparseRois of a RoiCounter device
+
+    The sparse rois take their ids from the names of the device, as the
+    other rois, but a name can not be used by a sparse roi and by another
+    roi at the same time.
+    """
+
+    def __init__(self):
+        self.rois = None
+        self.names = []
+        self.ids = []
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def check_names(self, names, roi_names):
+        """Raises ValueError if one of the names is used by another roi
+
+        roi_names are the names of all the rois of the device.
+        """
+        used = [name for name in names if name in roi_names and name not in self]
+        if used:
+            raise ValueError("Roi names already used: %s" % ", ".join(used))
+
+    def set(self, names, ids, rois):
+        """Replace the sparse rois, returns the names no longer used"""
+        dropped = [name for name in self.names if name not in names]
+        self.names = list(names)
+        self.ids = list(ids)
+        self.rois = rois
+        return dropped
+
+    def remove(self, names):
+        """Remove the named sparse rois, returns the names removed"""
+        removed = [name for name in self.names if name in names]
+        if removed:
+            keep = [i for i, name in enumerate(self.names) if name not in removed]
+            self.names = [self.names[i] for i in keep]
+            self.ids = [self.ids[i] for i in keep]
+            self.rois = self.rois.select(keep) if keep else None
+        return removed
+
+    def clear(self):
+        self.set([], [], None)
+
+
+class SparseRoiResults(object):
+    """Buffer of the SparseRois results of the last buffer_size frames"""
+
+    def __init__(self, buffer_size):
+        self._lock = threading.Lock()
+        self.resize(buffer_size)
+
+    def resize(self, buffer_size):
+        with self._lock:
+            self._frames = [None] * max(buffer_size, 1)
+            self._results = [None] * len(self._frames)
+
+    def clear(self):
+        self.resize(len(self._frames))
+
+    def store(self, frame_number, result):
+        with self._lock:
+            slot = frame_number % len(self._frames)
+            self._frames[slot] = frame_number
+            self._results[slot] = result
+
+    def read(self, from_frame, roi_ids):
+        """Returns the results from a frame, packed as by pack_counters
+
+        roi_ids are the ids of the sparse rois, the results of a previous
+        set of rois are skipped.
+        """
+        with self._lock:
+            entries = sorted(
+                (frame, result)
+                for frame, result in zip(self._frames, self._results)
+                if frame is not None and frame >= from_frame
+            )
+        entries = [(f, r) for f, r in entries if len(r) == len(roi_ids)]
+        if not entries:
+            return numpy.array([], dtype=numpy.double)
+        frames = numpy.array([frame for frame, result in entries])
+        results = numpy.stack([result for frame, result in entries])
+        packed = numpy.empty((len(roi_ids), len(frames), 7), dtype=numpy.double)
+        packed[:, :, 0] = numpy.asarray(roi_ids)[:, numpy.newaxis]
+        packed[:, :, 1] = frames
+        packed[:, :, 2:] = results.transpose(1, 0, 2)
+        return packed.reshape(-1)
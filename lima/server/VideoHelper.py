@@ -0,0 +1,234 @@
+############################################################################
+# This file is part of LImA, a Library for Image Acquisition
+#
+# Copyright (C) : 2009-2026
+# European Synchrotron Radiation Facility
+# CS40220 38043 Grenoble Cedex 9
+# FRANCE
+# Contact: lima@esrf.fr
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# ============================================================================
+#                              HELPERS
+# ============================================================================
+#
+# VIDEO_IMAGE DevEncoded encoding, used by the LimaCCDs video_last_image
+# attribute/event, and JPEG/WebP preview of the video frames (video_preview).
+# This module does not depend on the LIMA core so it can be used (and tested)
+# on its own.
+
+import io
+import struct
+import sys
+import numpy
+
+try:
+    import PIL.Image
+    import PIL.features
+
+    PILLOW = True
+except ImportError:
+    PILLOW = False
+
+# The VIDEO_IMAGE header, network (big-endian) byte order
+VIDEO_HEADER_FORMAT = "!IHHqiiHHHH"
+VIDEO_HEADER_LEN = struct.calcsize(VIDEO_HEADER_FORMAT)
+VIDEO_MAGIC = 0x5644454F
+VIDEO_HEADER_VERSION = 1
+# byte order of the image data: 0-little-endian, 1-big-endian
+VIDEO_ENDIANNESS = int(sys.byteorder == "big")
+# offset of the frame number in the header
+_FRAME_NUMBER_OFFSET = struct.calcsize("!IHH")
+
+
+class VideoImageEncoder(object):
+    """Encode video frames in VIDEO_IMAGE format into a reused buffer.
+
+    The header is only packed when the mode or the image size changes,
+    otherwise only the frame number is patched in the header and the frame
+    is copied once after it.
+    The returned buffer is overwritten by the next call, so each consumer
+    (attribute, event) must use its own encoder.
+    """
+
+    def __init__(self):
+        self.__slab = None
+        self.__key = None
+
+    def release(self):
+        self.__slab = None
+        self.__key = None
+
+    def encode(self, mode, frame_number, width, height, data):
+        """Returns a bytearray with the VIDEO_IMAGE header followed by data"""
+        data = memoryview(data or b"").cast("B")
+        size = VIDEO_HEADER_LEN + len(data)
+        key = (mode, width, height, size)
+        if key != self.__key:
+            self.__slab = bytearray(size)
+            struct.pack_into(
+                VIDEO_HEADER_FORMAT,
+                self.__slab,
+                0,
+                VIDEO_MAGIC,
+                VIDEO_HEADER_VERSION,
+                mode,
+                frame_number,
+                width,
+                height,
+                VIDEO_ENDIANNESS,
+                VIDEO_HEADER_LEN,
+                0,  # padding
+                0,  # padding
+            )
+            self.__key = key
+        else:
+            struct.pack_into("!q", self.__slab, _FRAME_NUMBER_OFFSET, frame_number)
+        memoryview(self.__slab)[VIDEO_HEADER_LEN:] = data
+        return self.__slab
+
+
+# Video preview codecs, name: Pillow format, depending on the installed modules
+VIDEO_PREVIEW_CODEC_NONE = "NONE"
+VIDEO_PREVIEW_CODECS = {VIDEO_PREVIEW_CODEC_NONE: None}
+if PILLOW:
+    VIDEO_PREVIEW_CODECS["JPEG"] = "JPEG"
+    if PIL.features.check("webp"):
+        VIDEO_PREVIEW_CODECS["WEBP"] = "WEBP"
+
+VIDEO_PREVIEW_MAX_SIZE = 1024
+VIDEO_PREVIEW_QUALITY = 75
+
+# video modes which can be previewed, the I420 preview is its Y plane
+# and the BAYER one the sum of the 2x2 cells
+_PREVIEW_GREY_MODES = {
+    "Y8": numpy.uint8,
+    "Y16": numpy.uint16,
+    "Y32": numpy.uint32,
+    "Y64": numpy.uint64,
+    "I420": numpy.uint8,
+}
+_PREVIEW_BAYER_MODES = {
+    "BAYER_RG8": numpy.uint8,
+    "BAYER_RG16": numpy.uint16,
+    "BAYER_BG8": numpy.uint8,
+    "BAYER_BG16": numpy.uint16,
+}
+# bytes per pixel and RGB channels
+_PREVIEW_COLOR_MODES = {
+    "RGB24": (3, slice(0, 3)),
+    "BGR24": (3, slice(2, None, -1)),
+    "RGB32": (4, slice(0, 3)),
+    "BGR32": (4, slice(2, None, -1)),
+}
+
+
+def is_preview_supported(mode):
+    return (
+        mode in _PREVIEW_GREY_MODES
+        or mode in _PREVIEW_BAYER_MODES
+        or mode in _PREVIEW_COLOR_MODES
+    )
+
+
+def video_frame_2_array(mode, width, height, data):
+    """Returns a (height, width) or (height, width, 3) array from a video frame"""
+    if mode in _PREVIEW_GREY_MODES:
+        dtype = _PREVIEW_GREY_MODES[mode]
+        return numpy.frombuffer(data, dtype, width * height).reshape(height, width)
+    elif mode in _PREVIEW_BAYER_MODES:
+        dtype = _PREVIEW_BAYER_MODES[mode]
+        array = numpy.frombuffer(data, dtype, width * height).reshape(height, width)
+        return _bin(array, 2, numpy.uint32 if dtype is numpy.uint8 else numpy.uint64)
+    elif mode in _PREVIEW_COLOR_MODES:
+        depth, channels = _PREVIEW_COLOR_MODES[mode]
+        array = numpy.frombuffer(data, numpy.uint8, width * height * depth)
+        return array.reshape(height, width, depth)[..., channels]
+    raise ValueError("Video mode %s cannot be previewed" % mode)
+
+
+def _bin(array, factor, dtype):
+    """Sum of the factor x factor cells, the incomplete edge cells are dropped"""
+    height = array.shape[0] // factor
+    width = array.shape[1] // factor
+    array = array[: height * factor, : width * factor]
+    array = array.reshape((height, factor, width, factor) + array.shape[2:])
+    return array.sum(axis=(1, 3), dtype=dtype)
+
+
+def _to_uint8(array, scale):
+    """Scale the array to 0-255, between its min and max if scale is True"""
+    if not scale:
+        return array.astype(numpy.uint8, copy=False)
+    array = array.astype(numpy.float32, copy=False)
+    low, high = array.min(), array.max()
+    if high > low:
+        array = (array - low) * (255.0 / (high - low))
+    else:
+        array = numpy.zeros_like(array)
+    return array.astype(numpy.uint8)
+
+
+class VideoPreviewEncoder(object):
+    """Encode video frames as 8-bit JPEG or WebP previews.
+
+    The frames are binned so that the preview side is at most max_size
+    pixels. The 8-bit frames are binned as the mean of the cells, the other
+    ones are scaled between their min and max.
+    The settings are not changed once created so the encoder can be shared
+    between threads.
+    """
+
+    def __init__(
+        self,
+        codec=VIDEO_PREVIEW_CODEC_NONE,
+        max_size=VIDEO_PREVIEW_MAX_SIZE,
+        quality=VIDEO_PREVIEW_QUALITY,
+    ):
+        if codec not in VIDEO_PREVIEW_CODECS:
+            raise ValueError("Video preview codec %s is not available" % codec)
+        if max_size < 1:
+            raise ValueError("Video preview max. size must be > 0")
+        if not 1 <= quality <= 100:
+            raise ValueError("Video preview quality must be in [1, 100]")
+        self.codec = codec
+        self.max_size = max_size
+        self.quality = quality
+
+    @property
+    def enabled(self):
+        return self.codec != VIDEO_PREVIEW_CODEC_NONE
+
+    def encode(self, mode, width, height, data):
+        """Returns the (format, data) DevEncoded preview of a video frame
+
+        format is <codec>_GRAY8 or <codec>_RGB, e.g. JPEG_GRAY8.
+        """
+        if not self.enabled:
+            raise ValueError("Video preview is disabled")
+        array = video_frame_2_array(mode, width, height, data)
+        scale = array.dtype != numpy.uint8
+        factor = -(-max(array.shape[:2]) // self.max_size)
+        if factor > 1:
+            array = _bin(array, factor, numpy.float32)
+            if not scale:
+                array /= factor * factor
+        array = _to_uint8(array, scale)
+        out = io.BytesIO()
+        image = PIL.Image.fromarray(array, "L" if array.ndim == 2 else "RGB")
+        image.save(out, VIDEO_PREVIEW_CODECS[self.codec], quality=self.quality)
+        kind = "GRAY8" if array.ndim == 2 else "RGB"
+        return "%s_%s" % (self.codec, kind), out.getvalue()
@@ -219,6 +219,9 @@ class BackgroundSubstractionDeviceServerClass(PyTango.DeviceClass):
     # 	 Attribute definitions
     attr_list = {
         "RunLevel": [[PyTango.DevLong, PyTango.SCALAR, PyTango.READ_WRITE]],
+        "ImageCacheStats": [
+            [PyTango.DevLong64, PyTango.SPECTRUM, PyTango.READ, 4]
+        ],
         "delete_dark_after_read": [
             [PyTango.DevBoolean, PyTango.SCALAR, PyTango.READ_WRITE]
         ],
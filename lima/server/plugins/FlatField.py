@@ -157,6 +157,9 @@ class FlatfieldDeviceServerClass(PyTango.DeviceClass):
     # 	 Attribute definitions
     attr_list = {
         "RunLevel": [[PyTango.DevLong, PyTango.SCALAR, PyTango.READ_WRITE]],
+        "ImageCacheStats": [
+            [PyTango.DevLong64, PyTango.SPECTRUM, PyTango.READ, 4]
+        ],
         "normalize": [[PyTango.DevBoolean, PyTango.SCALAR, PyTango.READ_WRITE]],
         "FlatFieldFile": [[PyTango.DevString, PyTango.SCALAR, PyTango.READ_WRITE]],
     }
@@ -160,6 +160,9 @@ class MaskDeviceServerClass(PyTango.DeviceClass):
     # 	 Attribute definitions
     attr_list = {
         "RunLevel": [[PyTango.DevLong, PyTango.SCALAR, PyTango.READ_WRITE]],
+        "ImageCacheStats": [
+            [PyTango.DevLong64, PyTango.SPECTRUM, PyTango.READ, 4]
+        ],
         "type": [[PyTango.DevString, PyTango.SCALAR, PyTango.READ_WRITE]],
         "MaskFile": [[PyTango.DevString, PyTango.SCALAR, PyTango.READ_WRITE]],
     }
@@ -26,6 +26,11 @@ import numpy
 from lima import core
 from lima.server.plugins.Utils import getDataFromFile, BasePostProcess
 from lima.server import AttrHelper
+from lima.server.ResultTableHelper import (
+    RESULT_TABLE_FORMAT,
+    encode_result_table,
+    result_columns,
+)
 
 computing_modes_list = ["MAXIMUM", "CM"]
 
@@ -144,6 +149,19 @@ class PeakFinderDeviceServer(BasePostProcess):
                 return returnArray
         return numpy.array([], dtype=numpy.double)
 
+    @core.DEB_MEMBER_FUNCT
+    def readPeaksTable(self):
+        peakResultCounterList = self.__peakFinderMgr.readPeaks()
+        frameNumber, x, y = result_columns(
+            peakResultCounterList, ("frameNumber", "x_peak", "y_peak")
+        )
+        columns = [
+            ("frame_number", frameNumber.astype(numpy.int32)),
+            ("x", x),
+            ("y", y),
+        ]
+        return RESULT_TABLE_FORMAT, encode_result_table(columns)
+
 
 # ==================================================================
 #
@@ -168,6 +186,10 @@ class PeakFinderDeviceServerClass(PyTango.DeviceClass):
             [PyTango.DevVoid, ""],
             [PyTango.DevVarDoubleArray, "frame number,x,y"],
         ],
+        "readPeaksTable": [
+            [PyTango.DevVoid, ""],
+            [PyTango.DevEncoded, "RESULT_TABLE: frame_number,x,y"],
+        ],
         "Start": [[PyTango.DevVoid, ""], [PyTango.DevVoid, ""]],
         "Stop": [[PyTango.DevVoid, ""], [PyTango.DevVoid, ""]],
     }
@@ -28,6 +28,19 @@ import PyTango
 import numpy
 from lima import core
 from lima.server.plugins.Utils import getMaskFromFile, BasePostProcess
+from lima.server.ResultTableHelper import RESULT_TABLE_FORMAT, encode_result_table
+from lima.server.RoiCounterHelper import (
+    pack_counters,
+    counters_table,
+    parse_rois,
+    parse_sparse_rois,
+    SparseRoiSet,
+    SparseRoiResults,
+    CounterCursor,
+    CounterCursors,
+    ResultEventPusher,
+    ShardedRoiCounterMgr,
+)
 
 
 def grouper(n, iterable, padvalue=None):
@@ -47,6 +60,11 @@ class RoiCounterDeviceServer(BasePostProcess):
     core.DEB_CLASS(core.DebModule.DebModApplication, "RoiCounterDeviceServer")
     # --------- Add you global variables here --------------------------
     ROI_COUNTER_TASK_NAME = "RoiCounterTask"
+    RESULT_EVENT_TASK_NAME = "RoiCounterResultEventTask"
+    SPARSE_ROI_TASK_NAME = "RoiCounterSparseRoiTask"
+    # the cursors of the clients which did not close them are dropped
+    MAX_COUNTER_CURSORS = 64
+    COUNTER_CURSOR_IDLE_TIMEOUT = 3600.0
 
     # ------------------------------------------------------------------
     #    Device constructor
@@ -59,8 +77,19 @@ class RoiCounterDeviceServer(BasePostProcess):
         self.__maskFile = None
         self.__maskData = None
         self.__overflowThl = 0
+        self.__cursors = CounterCursors(
+            self.MAX_COUNTER_CURSORS, self.COUNTER_CURSOR_IDLE_TIMEOUT
+        )
+        self.__resultPusher = None
+        self.__resultCursor = None
+        self.__resultEventTask = None
+        self.__lastResults = numpy.zeros((0, 7), dtype=numpy.double)
+        self.__sparseRois = SparseRoiSet()
+        self.__sparseRoiTask = None
+        self.__roiShards = 0
         BasePostProcess.__init__(self, cl, name)
         RoiCounterDeviceServer.init_device(self)
+        self.__sparseResults = SparseRoiResults(int(self.BufferSize))
         self.setMaskFile(self.MaskFile)
 
         try:
@@ -85,29 +114,110 @@ class RoiCounterDeviceServer(BasePostProcess):
         except AttributeError:
             pass
 
+    @core.DEB_MEMBER_FUNCT
+    def init_device(self):
+        BasePostProcess.init_device(self)
+        if self.ResultEvents:
+            self.set_change_event("Results", True, False)
+
     def set_state(self, state):
         if state == PyTango.DevState.OFF:
+            self.__cursors.clear()
             if self.__roiCounterMgr:
                 self.__roiCounterMgr = None
                 ctControl = _control_ref()
                 extOpt = ctControl.externalOperation()
-                extOpt.delOp(self.ROI_COUNTER_TASK_NAME)
+                if self.__resultPusher is not None:
+                    extOpt.delOp(self.RESULT_EVENT_TASK_NAME)
+                    self.__resultPusher.stop()
+                    self.__resultPusher = None
+                    self.__resultEventTask = None
+                if self.__sparseRoiTask is not None:
+                    extOpt.delOp(self.SPARSE_ROI_TASK_NAME)
+                    self.__sparseRoiTask = None
+                for shard in range(self.__roiShards):
+                    extOpt.delOp(self.__roiCounterTaskName(shard))
+                self.__roiShards = 0
         elif state == PyTango.DevState.ON:
             if not self.__roiCounterMgr:
                 ctControl = _control_ref()
                 extOpt = ctControl.externalOperation()
-                self.__roiCounterMgr = extOpt.addOp(
-                    core.SoftOpId.ROICOUNTERS, self.ROI_COUNTER_TASK_NAME, self._runLevel
-                )
+                self.__roiShards = self.__getRoiShards()
+                managers = [
+                    extOpt.addOp(
+                        core.SoftOpId.ROICOUNTERS,
+                        self.__roiCounterTaskName(shard),
+                        self._runLevel,
+                    )
+                    for shard in range(self.__roiShards)
+                ]
+                if len(managers) == 1:
+                    self.__roiCounterMgr = managers[0]
+                else:
+                    # the rois are evaluated in parallel by several tasks
+                    self.__roiCounterMgr = ShardedRoiCounterMgr(managers)
                 self.__roiCounterMgr.setBufferSize(int(self.BufferSize))
                 if self.__maskData is not None:
                     self.__roiCounterMgr.setMask(self.__maskData)
                 self.__roiCounterMgr.setOverflowThreshold(self.__overflowThl)
+                if self.__sparseRois.rois is not None:
+                    self.__addSparseRoiTask()
+                if self.ResultEvents:
+                    # the results are pushed once the frames are processed
+                    self.__resultCursor = CounterCursor()
+                    self.__resultPusher = ResultEventPusher(
+                        self.__readNewResults,
+                        self.__pushResults,
+                        self.MaxResultEventRate,
+                    )
+                    handler = extOpt.addOp(
+                        core.SoftOpId.USER_SINK_TASK,
+                        self.RESULT_EVENT_TASK_NAME,
+                        self._runLevel + 1,
+                    )
+                    self.__resultEventTask = _ResultEventTask(self.__resultPusher)
+                    handler.setSinkTask(self.__resultEventTask)
 
             self.__roiCounterMgr.clearCounterStatus()
+            self.__sparseResults.clear()
 
         PyTango.LatestDeviceImpl.set_state(self, state)
 
+    def __roiCounterTaskName(self, shard):
+        if not shard:
+            return self.ROI_COUNTER_TASK_NAME
+        return "%s%d" % (self.ROI_COUNTER_TASK_NAME, shard)
+
+    def __getRoiShards(self):
+        nbShards = int(self.RoiShards)
+        if nbShards <= 0:
+            # one roi counter task per processing thread
+            try:
+                nbShards = core.Processlib.PoolThreadMgr.get().getNumberOfThread()
+            except AttributeError:
+                nbShards = 1
+        return max(nbShards, 1)
+
+    # ------------------------------------------------------------------
+    #    Read RoiShards attribute
+    # ------------------------------------------------------------------
+    @core.DEB_MEMBER_FUNCT
+    def read_RoiShards(self, attr):
+        attr.set_value(int(self.RoiShards))
+
+    # ------------------------------------------------------------------
+    #    Write RoiShards attribute
+    # ------------------------------------------------------------------
+    @core.DEB_MEMBER_FUNCT
+    def write_RoiShards(self, attr):
+        self.RoiShards = int(attr.get_write_value())
+
+    def is_RoiShards_allowed(self, mode):
+        if PyTango.AttReqType.READ_REQ == mode:
+            return True
+        else:
+            return self.get_state() == PyTango.DevState.OFF
+
     # ------------------------------------------------------------------
     #    Read BufferSize attribute
     # ------------------------------------------------------------------
@@ -124,6 +234,7 @@ class RoiCounterDeviceServer(BasePostProcess):
         self.BufferSize = int(data)
         if self.__roiCounterMgr is not None:
             self.__roiCounterMgr.setBufferSize(self.BufferSize)
+        self.__sparseResults.resize(self.BufferSize)
 
     def is_BufferSize_allowed(self, mode):
         return True
@@ -157,6 +268,31 @@ class RoiCounterDeviceServer(BasePostProcess):
         value_read = self.__roiCounterMgr.getCounterStatus()
         attr.set_value(value_read)
 
+    # ------------------------------------------------------------------
+    #    Read Results attribute
+    # ------------------------------------------------------------------
+    @core.DEB_MEMBER_FUNCT
+    def read_Results(self, attr):
+        attr.set_value(self.__lastResults)
+
+    def is_Results_allowed(self, mode):
+        return True
+
+    def __readNewResults(self):
+        roiCounterMgr = self.__roiCounterMgr
+        if roiCounterMgr is None:
+            return self.__lastResults[:0]
+        lost, counters = self.__resultCursor.read(
+            roiCounterMgr.readCounters,
+            roiCounterMgr.getCounterStatus(),
+            self.__roiName2ID,
+        )
+        return counters.reshape(-1, 7)
+
+    def __pushResults(self, results):
+        self.__lastResults = results
+        self.push_change_event("Results", results)
+
     # ------------------------------------------------------------------
     #    Read OverflowThreshold attribute
     # ------------------------------------------------------------------
@@ -185,6 +321,12 @@ class RoiCounterDeviceServer(BasePostProcess):
     # ==================================================================
     @core.DEB_MEMBER_FUNCT
     def addNames(self, argin):
+        for roi_name in argin:
+            if roi_name in self.__sparseRois:
+                raise ValueError("Roi name %s is used by a sparse roi" % roi_name)
+        return self.__addNames(argin)
+
+    def __addNames(self, argin):
         roi_id = []
         for roi_name in argin:
             if not roi_name in self.__roiName2ID:
@@ -198,11 +340,18 @@ class RoiCounterDeviceServer(BasePostProcess):
 
     @core.DEB_MEMBER_FUNCT
     def removeRois(self, argin):
+        sparseNames = self.__sparseRois.remove(argin)
+        if sparseNames:
+            self.__sparseResults.clear()
+            if self.__sparseRoiTask is not None:
+                self.__sparseRoiTask.rois = self.__sparseRois.rois
         if self.__roiCounterMgr:
-            self.__roiCounterMgr.removeRois(argin)
+            names = [roi_name for roi_name in argin if roi_name not in sparseNames]
+            self.__roiCounterMgr.removeRois(names)
         for roi_name in argin:
             roi_id = self.__roiName2ID.pop(roi_name, None)
             self.__roiID2Name.pop(roi_id, None)
+        # the sparse rois are in the name map too
         if not len(self.__roiName2ID):
             self.Stop()
 
@@ -213,7 +362,7 @@ class RoiCounterDeviceServer(BasePostProcess):
 
         if not len(argin) % 5:
             roi_list = []
-            for roi_id, x, y, width, height in grouper(5, argin):
+            for roi_id, x, y, width, height in numpy.reshape(argin, (-1, 5)).tolist():
                 roi_name = self.__roiID2Name.get(roi_id, None)
                 if roi_name is None:
                     raise RuntimeError("should call add method before setRoi")
@@ -224,6 +373,54 @@ class RoiCounterDeviceServer(BasePostProcess):
                 "should be a vector as follow [roi_id0,x0,y0,width0,height0,..."
             )
 
+    @core.DEB_MEMBER_FUNCT
+    def setNamedRois(self, argin):
+        if self.__roiCounterMgr is None:
+            raise RuntimeError("should start the device first")
+
+        geometry, names = argin
+        geometry = parse_rois(names, geometry)
+        roi_id = self.addNames(names)
+        roi_list = [
+            (name.encode(), core.Roi(x, y, width, height))
+            for name, (x, y, width, height) in zip(names, geometry.tolist())
+        ]
+        self.__roiCounterMgr.updateRois(roi_list)
+        return roi_id
+
+    @core.DEB_MEMBER_FUNCT
+    def setSparseRois(self, argin):
+        if self.__roiCounterMgr is None:
+            raise RuntimeError("should start the device first")
+
+        values, names = argin
+        sparseRois = parse_sparse_rois(names, values)
+        self.__sparseRois.check_names(names, self.__roiName2ID)
+        roi_id = self.__addNames(names)
+        for roi_name in self.__sparseRois.set(names, roi_id, sparseRois):
+            self.__roiID2Name.pop(self.__roiName2ID.pop(roi_name), None)
+        self.__sparseResults.clear()
+        self.__addSparseRoiTask()
+        return roi_id
+
+    def __addSparseRoiTask(self):
+        if self.__sparseRoiTask is None:
+            extOpt = _control_ref().externalOperation()
+            handler = extOpt.addOp(
+                core.SoftOpId.USER_SINK_TASK, self.SPARSE_ROI_TASK_NAME, self._runLevel
+            )
+            self.__sparseRoiTask = _SparseRoiTask(self.__sparseResults)
+            handler.setSinkTask(self.__sparseRoiTask)
+        self.__sparseRoiTask.rois = self.__sparseRois.rois
+
+    @core.DEB_MEMBER_FUNCT
+    def getSparseRoiNames(self):
+        return list(self.__sparseRois.names)
+
+    @core.DEB_MEMBER_FUNCT
+    def readSparseCounters(self, argin):
+        return self.__sparseResults.read(argin, self.__sparseRois.ids)
+
     @core.DEB_MEMBER_FUNCT
     def setArcRois(self, argin):
         if self.__roiCounterMgr is None:
@@ -412,6 +609,9 @@ class RoiCounterDeviceServer(BasePostProcess):
 
     @core.DEB_MEMBER_FUNCT
     def clearAllRois(self):
+        self.__sparseRois.clear()
+        if self.__sparseRoiTask is not None:
+            self.__sparseRoiTask.rois = None
         if self.__roiCounterMgr:
             self.__roiCounterMgr.clearAllRois()
             self.Stop()
@@ -439,33 +639,64 @@ class RoiCounterDeviceServer(BasePostProcess):
     @core.DEB_MEMBER_FUNCT
     def readCounters(self, argin):
         roiResultCounterList = self.__roiCounterMgr.readCounters(argin)
-        if roiResultCounterList:
-            minListSize = len(roiResultCounterList[0][1])
-            for roiName, resultList in roiResultCounterList:
-                if minListSize > len(resultList):
-                    minListSize = len(resultList)
-
-            if minListSize:
-                returnArray = numpy.zeros(
-                    minListSize * len(roiResultCounterList) * 7, dtype=numpy.double
-                )
-                returnArray[0] = float(minListSize)
-                indexArray = 0
-                for roiName, resultList in roiResultCounterList:
-                    roi_id = self.__roiName2ID.get(roiName)
-                    for result in resultList[:minListSize]:
-                        returnArray[indexArray : indexArray + 7] = (
-                            float(roi_id),
-                            float(result.frameNumber),
-                            result.sum,
-                            result.average,
-                            result.std,
-                            result.minValue,
-                            result.maxValue,
-                        )
-                        indexArray += 7
-                return returnArray
-        return numpy.array([], dtype=numpy.double)
+        return pack_counters(roiResultCounterList, self.__roiName2ID)
+
+    @core.DEB_MEMBER_FUNCT
+    def readCountersTable(self, argin):
+        roiResultCounterList = self.__roiCounterMgr.readCounters(argin)
+        packed = pack_counters(roiResultCounterList, self.__roiName2ID)
+        return RESULT_TABLE_FORMAT, encode_result_table(counters_table(packed))
+
+    @core.DEB_MEMBER_FUNCT
+    def openCounterCursor(self):
+        return self.__cursors.open()
+
+    @core.DEB_MEMBER_FUNCT
+    def readCounterCursor(self, argin):
+        if self.__roiCounterMgr is None:
+            raise RuntimeError("should start the device first")
+        cursor = self.__cursors.get(argin)
+        lost, counters = cursor.read(
+            self.__roiCounterMgr.readCounters,
+            self.__roiCounterMgr.getCounterStatus(),
+            self.__roiName2ID,
+        )
+        return numpy.concatenate(([float(lost)], counters))
+
+    @core.DEB_MEMBER_FUNCT
+    def closeCounterCursor(self, argin):
+        self.__cursors.close(argin)
+
+
+class _ResultEventTask(core.Processlib.SinkTaskBase):
+    """Notify the ResultEventPusher of each processed frame"""
+
+    def __init__(self, pusher):
+        core.Processlib.SinkTaskBase.__init__(self)
+        self.__pusher = pusher
+
+    def process(self, data):
+        self.__pusher.notify()
+
+
+class _SparseRoiTask(core.Processlib.SinkTaskBase):
+    """Evaluate the sparse rois on each frame"""
+
+    def __init__(self, results):
+        core.Processlib.SinkTaskBase.__init__(self)
+        self.__results = results
+        self.rois = None
+
+    def process(self, data):
+        rois = self.rois
+        if rois is None:
+            return
+        try:
+            self.__results.store(data.frameNumber, rois.evaluate(data.buffer))
+        except:
+            import traceback
+
+            traceback.print_exc()
 
 
 # ==================================================================
@@ -482,6 +713,21 @@ class RoiCounterDeviceServerClass(PyTango.DeviceClass):
     device_property_list = {
         "BufferSize": [PyTango.DevShort, "Rois buffer size", [256]],
         "MaskFile": [PyTango.DevString, "Mask file", ""],
+        "ResultEvents": [
+            PyTango.DevBoolean,
+            "Enable or disable the push event on Results attribute",
+            False,
+        ],
+        "MaxResultEventRate": [
+            PyTango.DevDouble,
+            "Max. rate of the Results events (Hz), 0 for no limit",
+            10.0,
+        ],
+        "RoiShards": [
+            PyTango.DevShort,
+            "Nb of parallel roi counter tasks, 0 for one per processing thread",
+            1,
+        ],
     }
 
     # 	 Command definitions
@@ -501,6 +747,31 @@ class RoiCounterDeviceServerClass(PyTango.DeviceClass):
             ],
             [PyTango.DevVoid, ""],
         ],
+        "setNamedRois": [
+            [
+                PyTango.DevVarLongStringArray,
+                "roi vector [x0,y0,width0,height0,x1,y1,width1,height1,...], rois alias",
+            ],
+            [PyTango.DevVarLongArray, "rois' id"],
+        ],
+        "setSparseRois": [
+            [
+                PyTango.DevVarDoubleStringArray,
+                "sparse rois [indptr0,...,indptrN,indices...,weights...], rois alias",
+            ],
+            [PyTango.DevVarLongArray, "rois' id"],
+        ],
+        "getSparseRoiNames": [
+            [PyTango.DevVoid, ""],
+            [PyTango.DevVarStringArray, "sparse rois alias"],
+        ],
+        "readSparseCounters": [
+            [PyTango.DevLong, "from which frame"],
+            [
+                PyTango.DevVarDoubleArray,
+                "roi_id,frame number,sum,average,std,min,max,...",
+            ],
+        ],
         "setArcRois": [
             [
                 PyTango.DevVarDoubleArray,
@@ -539,6 +810,28 @@ class RoiCounterDeviceServerClass(PyTango.DeviceClass):
                 "roi_id,frame number,sum,average,std,min,max,...",
             ],
         ],
+        "readCountersTable": [
+            [PyTango.DevLong, "from which frame"],
+            [
+                PyTango.DevEncoded,
+                "RESULT_TABLE: roi_id,frame_number,sum,average,std,min,max",
+            ],
+        ],
+        "openCounterCursor": [
+            [PyTango.DevVoid, ""],
+            [PyTango.DevLong, "cursor id"],
+        ],
+        "readCounterCursor": [
+            [PyTango.DevLong, "cursor id"],
+            [
+                PyTango.DevVarDoubleArray,
+                "lost frames,roi_id,frame number,sum,average,std,min,max,...",
+            ],
+        ],
+        "closeCounterCursor": [
+            [PyTango.DevLong, "cursor id"],
+            [PyTango.DevVoid, ""],
+        ],
         "Start": [[PyTango.DevVoid, ""], [PyTango.DevVoid, ""]],
         "Stop": [[PyTango.DevVoid, ""], [PyTango.DevVoid, ""]],
     }
@@ -549,7 +842,12 @@ class RoiCounterDeviceServerClass(PyTango.DeviceClass):
         "MaskFile": [[PyTango.DevString, PyTango.SCALAR, PyTango.READ_WRITE]],
         "OverflowThreshold": [[PyTango.DevLong, PyTango.SCALAR, PyTango.READ_WRITE]],
         "CounterStatus": [[PyTango.DevLong, PyTango.SCALAR, PyTango.READ]],
+        "Results": [[PyTango.DevDouble, PyTango.IMAGE, PyTango.READ, 7, 1000000]],
         "RunLevel": [[PyTango.DevLong, PyTango.SCALAR, PyTango.READ_WRITE]],
+        "RoiShards": [[PyTango.DevLong, PyTango.SCALAR, PyTango.READ_WRITE]],
+        "ImageCacheStats": [
+            [PyTango.DevLong64, PyTango.SPECTRUM, PyTango.READ, 4]
+        ],
     }
 
     # ------------------------------------------------------------------
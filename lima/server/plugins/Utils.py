@@ -21,16 +21,79 @@
 # along with this program; if not, see <http://www.gnu.org/licenses/>.
 ############################################################################
 import PyTango
+import numpy
 
 
 from lima import core
-from lima.server import EdfFile
+from lima.server import CacheHelper
+from lima.server import ImageFileHelper
+
+# the reference images (mask, flat-field, background...) read by the plugins
+# are shared by all the devices of the server
+REFERENCE_IMAGE_CACHE_MAX_BYTES = 1 << 30
+_referenceImageCache = CacheHelper.FileCache(REFERENCE_IMAGE_CACHE_MAX_BYTES)
+
+
+def _dataBytes(entry):
+    header, buffer = entry
+    return buffer.nbytes
+
+
+def _readOnlyBuffer(buffer):
+    """Returns buffer, owned (copied if needed) and read-only: it is shared
+    by all the plugins through the cache"""
+    if not buffer.flags.owndata:
+        buffer = numpy.array(buffer, copy=True)
+    buffer.setflags(write=False)
+    return buffer
+
+
+def _newData(entry):
+    """Returns a Data object of its own for a cached (header, buffer) entry
+
+    The Data buffer is a view of the cached buffer: as the latter is
+    read-only, the view can't be made writable (a caller which needs to
+    modify the image must copy it) and the cached image can't be modified
+    through the Data object.
+    """
+    header, buffer = entry
+    data = core.Processlib.Data()
+    data.buffer = buffer.view()
+    try:
+        data.header.update(header)
+    except TypeError:
+        import traceback
+
+        traceback.print_exc()
+    return data
+
+
+def _loadDataFromFile(filepath, index=0):
+    # raises an exception when the frame can't be read so it is not cached
+    headers, stack = getDataStackFromFile(filepath, index, index + 1)
+    return headers[0], _readOnlyBuffer(stack[0])
+
+
+def getReferenceImageCacheStats():
+    """Returns [hits, misses, number of entries, size in bytes]"""
+    return _referenceImageCache.stats
 
 
 def getDataFromFile(filepath, index=0):
+    """Returns a data object from filename.
+
+    The image is cached and shared with the other callers: the data
+    buffer is a read-only view of it, see _newData.
+    """
     try:
-        datas = getDatasFromFile(filepath, index, index + 1)
-        return datas[0]
+        filename, dataPath = ImageFileHelper.split_data_path(filepath)
+        entry = _referenceImageCache.get(
+            filename,
+            ("data", dataPath, index),
+            lambda path: _loadDataFromFile(filepath, index),
+            _dataBytes,
+        )
+        return _newData(entry)
     except:
         import traceback
 
@@ -38,33 +101,47 @@ def getDataFromFile(filepath, index=0):
         return core.Processlib.Data()  # empty
 
 
+def getDataStackFromFile(filepath, fromIndex=0, toIndex=-1):
+    """Returns the headers and the data of the frames fromIndex to toIndex
+    (excluded, -1 up to the last frame) of a file.
+
+    The data is a single numpy array, the first axis being the frame index.
+    EDF (also .gz and .bz2), NPY, TIFF and HDF5 files are supported, a
+    dataset of an HDF5 file being selected with file.h5::/path/to/dataset.
+    Only the requested frames are read, see ImageFileHelper.
+
+    Arguments:
+        filepath: File name
+        fromIndex: index of the first frame
+        toIndex: index after the last frame
+
+    Returns:
+        A (list of header dictionaries, numpy array) tuple
+
+    Raises:
+        IOError or ValueError if the frames can't be read
+    """
+    return ImageFileHelper.read_stack(filepath, fromIndex, toIndex)
+
+
 ##@brief the function read all known data file
 #
-# @todo add more file format
+# Each frame is copied from the stack read by getDataStackFromFile, the
+# Data buffers never refer to the file
 def getDatasFromFile(filepath, fromIndex=0, toIndex=-1):
+    headers, stack = getDataStackFromFile(filepath, fromIndex, toIndex)
     returnDatas = []
-    try:
-        f = EdfFile.EdfFile(filepath)
-        if toIndex < 0:
-            toIndex = f.GetNumImages()
-        for i in range(fromIndex, toIndex):
-            a = f.GetData(i)
-            header = f.GetHeader(i)
-            rData = core.Processlib.Data()
-            rData.buffer = a
-            try:
-                rData.header.update(header)
-            except TypeError as e:
-                import traceback
-
-                traceback.print_exc()
-            returnDatas.append(rData)
-    except:
-        import traceback
+    for header, a in zip(headers, stack):
+        rData = core.Processlib.Data()
+        rData.buffer = numpy.array(a, copy=True)
+        try:
+            rData.header.update(header)
+        except TypeError as e:
+            import traceback
 
-        traceback.print_exc()
-    finally:
-        return returnDatas
+            traceback.print_exc()
+        returnDatas.append(rData)
+    return returnDatas
 
 
 def getMaskFromFile(filepath):
@@ -80,15 +157,36 @@ def getMaskFromFile(filepath):
     - `nonzero`: Mask the data when the mask value is something else than 0
                  (default silx convention)
 
+    The mask is cached and shared with the other callers: the data
+    buffer is a read-only view of it, see _newData.
+
     Arguments:
         filename: File name
 
     Returns:
         A core.Processlib.Data object
     """
-    maskImage = getDataFromFile(filepath)
+    try:
+        filename, dataPath = ImageFileHelper.split_data_path(filepath)
+        entry = _referenceImageCache.get(
+            filename,
+            ("mask", dataPath),
+            lambda path: _loadMaskFromFile(filepath),
+            _dataBytes,
+        )
+        return _newData(entry)
+    except:
+        import traceback
+
+        traceback.print_exc()
+        return core.Processlib.Data()  # empty
+
+
+def _loadMaskFromFile(filepath):
+    # not read through the cache: the normalized mask is cached apart
+    header, buffer = _loadDataFromFile(filepath)
     # Check masking convention
-    masked_value = maskImage.header.get("masked_value")
+    masked_value = header.get("masked_value")
     if masked_value not in [None, "zero", "nonzero"]:
         # Sanitize
         msg = "Header 'masked_value=%s' from file %s is unknown. Header skipped."
@@ -98,9 +196,9 @@ def getMaskFromFile(filepath):
     # Normalize the mask if needed
     if masked_value == "nonzero":
         # nexus and silx convention: mask != 0 means the data is masked (set to 0)
-        maskImage.buffer = (maskImage.buffer == 0).astype("uint8")
+        buffer = _readOnlyBuffer((buffer == 0).astype("uint8"))
 
-    return maskImage
+    return header, buffer
 
 
 class BasePostProcess(PyTango.LatestDeviceImpl):
@@ -126,6 +224,9 @@ class BasePostProcess(PyTango.LatestDeviceImpl):
     def is_set_state_allowed(self):
         return True
 
+    def is_ImageCacheStats_allowed(self, mode):
+        return True
+
     def init_device(self):
         self.set_state(PyTango.DevState.OFF)
         self.get_device_properties(self.get_device_class())
@@ -148,3 +249,9 @@ class BasePostProcess(PyTango.LatestDeviceImpl):
     def write_RunLevel(self, attr):
         data = attr.get_write_value()
         self._runLevel = data
+
+    # ------------------------------------------------------------------
+    #    Read ImageCacheStats attribute
+    # ------------------------------------------------------------------
+    def read_ImageCacheStats(self, attr):
+        attr.set_value(getReferenceImageCacheStats())
@@ -0,0 +1,41 @@
+import numpy
+import pytest
+
+from lima.server import EdfFile
+
+
+EDF_TYPES = {
+    numpy.uint8: "UnsignedByte",
+    numpy.uint16: "UnsignedShort",
+    numpy.int32: "SignedInteger",
+    numpy.float32: "FloatValue",
+}
+
+
+def write_edf(filename, frames, header=None, byteorder="LowByteFirst"):
+    """Write frames the way LIMA does, without going through EdfFile"""
+    with open(filename, "wb") as f:
+        for nb, frame in enumerate(frames):
+            lines = [
+                "{",
+                "HeaderID = EH:%06d:000000:000000 ;" % (nb + 1),
+                "Image = %d ;" % (nb + 1),
+                "ByteOrder = %s ;" % byteorder,
+                "DataType = %s ;" % EDF_TYPES[frame.dtype.type],
+            ]
+            for i, dim in enumerate(reversed(frame.shape)):
+                lines.append("Dim_%d = %d ;" % (i + 1, dim))
+            lines.append("Size = %d ;" % frame.nbytes)
+            for key, value in (header or {}).items():
+                lines.append("%s = %s ;" % (key, value))
+            text = "\n".join(lines) + "\n"
+            text = text.ljust(EdfFile.HEADER_BLOCK_SIZE - 2) + "}\n"
+            f.write(text.encode())
+            if byteorder == "HighByteFirst":
+                frame = frame.astype(frame.dtype.newbyteorder(">"))
+            f.write(frame.tobytes())
+
+
+@pytest.fixture
+def frames():
+    return numpy.arange(3 * 4 * 5, dtype=numpy.uint16).reshape(3, 4, 5)
@@ -0,0 +1,77 @@
+import os
+
+from lima.server import CacheHelper
+
+
+def make_file(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def load_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_hit_and_miss(tmp_path):
+    path = make_file(tmp_path, "a", b"1234")
+    cache = CacheHelper.FileCache(100)
+    first = cache.get(path, "data", load_bytes, len)
+    second = cache.get(path, "data", load_bytes, len)
+    assert first == b"1234"
+    assert second is first
+    # another key is another entry
+    cache.get(path, "mask", load_bytes, len)
+    assert cache.stats == [1, 2, 2, 8]
+
+
+def test_modified_file_is_loaded_again(tmp_path):
+    path = make_file(tmp_path, "a", b"1234")
+    cache = CacheHelper.FileCache(100)
+    assert cache.get(path, None, load_bytes, len) == b"1234"
+    with open(path, "wb") as f:
+        f.write(b"123456")
+    assert cache.get(path, None, load_bytes, len) == b"123456"
+    # the out of date entry is dropped
+    assert cache.stats == [0, 2, 1, 6]
+
+
+def test_lru_eviction(tmp_path):
+    paths = [make_file(tmp_path, name, b"x" * 40) for name in "abc"]
+    cache = CacheHelper.FileCache(100)
+    cache.get(paths[0], None, load_bytes, len)
+    cache.get(paths[1], None, load_bytes, len)
+    cache.get(paths[0], None, load_bytes, len)  # b is now the oldest
+    cache.get(paths[2], None, load_bytes, len)
+    assert cache.stats == [1, 3, 2, 80]
+    cache.get(paths[0], None, load_bytes, len)
+    cache.get(paths[1], None, load_bytes, len)
+    assert cache.stats == [2, 4, 2, 80]
+
+
+def test_errors_are_not_cached(tmp_path):
+    path = make_file(tmp_path, "a", b"1234")
+    cache = CacheHelper.FileCache(100)
+
+    def fail(path):
+        raise IOError("cannot read")
+
+    for load in (fail, load_bytes):
+        try:
+            cache.get(path, None, load, len)
+        except IOError:
+            pass
+    assert cache.stats == [0, 2, 1, 4]
+    try:
+        cache.get(os.path.join(str(tmp_path), "missing"), None, load_bytes, len)
+    except OSError:
+        pass
+    assert cache.stats == [0, 2, 1, 4]
+
+
+def test_too_big(tmp_path):
+    path = make_file(tmp_path, "a", b"x" * 200)
+    cache = CacheHelper.FileCache(100)
+    assert len(cache.get(path, None, load_bytes, len)) == 200
+    assert cache.stats == [0, 1, 0, 0]
@@ -0,0 +1,203 @@
+import struct
+import pytest
+import numpy
+
+from lima.server import DataArrayHelper
+from lima.server.DataArrayHelper import DataArrayCategory
+
+
+def unpack_header(buffer):
+    header_len = DataArrayHelper.DATA_ARRAY_HEADER_LEN
+    fields = struct.unpack(
+        DataArrayHelper.DATA_ARRAY_PACK_STR, bytes(buffer[:header_len])
+    )
+    return fields
+
+
+def test_encode_image():
+    data = numpy.arange(12, dtype=numpy.uint16).reshape(3, 4)
+    encoder = DataArrayHelper.DataArrayEncoder()
+    buffer = encoder.encode(data, DataArrayCategory.Image, 1, 2, 5, 7)
+    fields = unpack_header(buffer)
+    assert fields[0] == DataArrayHelper.DATA_ARRAY_MAGIC
+    assert fields[1] == DataArrayHelper.DATA_ARRAY_VERSION
+    assert fields[2] == DataArrayHelper.DATA_ARRAY_HEADER_LEN
+    assert fields[3:7] == (DataArrayCategory.Image, 1, 0, 2)
+    assert fields[7:13] == (4, 3, 0, 0, 0, 0)
+    assert fields[13:19] == (2, 8, 0, 0, 0, 0)
+    assert fields[19:21] == (5, 7)
+    payload = numpy.frombuffer(
+        buffer, numpy.uint16, offset=DataArrayHelper.DATA_ARRAY_HEADER_LEN
+    )
+    numpy.testing.assert_array_equal(payload.reshape(3, 4), data)
+
+
+def test_encode_image_stack_promotion():
+    data = numpy.ones((3, 4), dtype=numpy.int32)
+    encoder = DataArrayHelper.DataArrayEncoder()
+    buffer = encoder.encode(data, DataArrayCategory.ImageStack, 6, 4, 0, 0)
+    fields = unpack_header(buffer)
+    assert fields[6] == 3
+    assert fields[7:10] == (4, 3, 1)
+    assert fields[13:16] == (4, 16, 48)
+
+
+def test_encoder_reuses_buffer():
+    encoder = DataArrayHelper.DataArrayEncoder()
+    first = encoder.encode(
+        numpy.zeros((4, 4), numpy.uint8), DataArrayCategory.Image, 0, 1, 0, 0
+    )
+    second = encoder.encode(
+        numpy.ones((4, 4), numpy.uint8), DataArrayCategory.Image, 0, 1, 1, 0
+    )
+    assert first is second
+    third = encoder.encode(
+        numpy.ones((8, 4), numpy.uint8), DataArrayCategory.Image, 0, 1, 2, 0
+    )
+    assert third is not second
+
+
+def test_encode_non_contiguous():
+    data = numpy.arange(64, dtype=numpy.uint32).reshape(8, 8)[::2, 1::3]
+    encoder = DataArrayHelper.DataArrayEncoder()
+    buffer = encoder.encode(data, DataArrayCategory.Image, 2, 4, 0, 0)
+    payload = numpy.frombuffer(
+        buffer, numpy.uint32, offset=DataArrayHelper.DATA_ARRAY_HEADER_LEN
+    )
+    numpy.testing.assert_array_equal(payload.reshape(data.shape), data)
+
+
+def test_encode_strided_stack():
+    frames = [numpy.full((2, 3), i, dtype=numpy.uint16) for i in range(0, 10, 3)]
+    encoder = DataArrayHelper.DataArrayEncoder()
+    buffer = encoder.encode_stack(
+        iter(frames), len(frames), DataArrayCategory.ImageStack, 1, 2, 0, 0
+    )
+    fields = unpack_header(buffer)
+    assert fields[6] == 3
+    assert fields[7:10] == (3, 2, 4)
+    assert fields[13:16] == (2, 6, 12)
+    assert fields[19] == 0
+    payload = numpy.frombuffer(
+        buffer, numpy.uint16, offset=DataArrayHelper.DATA_ARRAY_HEADER_LEN
+    )
+    numpy.testing.assert_array_equal(payload.reshape(4, 2, 3), numpy.array(frames))
+
+
+def test_image_seq_frames_negative_end():
+    frames = DataArrayHelper.image_seq_frames(0, -1, 2, 9)
+    assert list(frames) == [0, 2, 4, 6, 8]
+    frames = DataArrayHelper.image_seq_frames(1, -2, 3, 9)
+    assert list(frames) == [1, 4, 7]
+    assert list(DataArrayHelper.image_seq_frames(2, 5, 2, 9)) == [2, 4]
+
+
+@pytest.mark.parametrize("codec_name", sorted(DataArrayHelper.DATA_ARRAY_CODECS))
+def test_codec_round_trip(codec_name):
+    codec = DataArrayHelper.DATA_ARRAY_CODECS[codec_name]
+    data = numpy.zeros((2, 300, 200), numpy.uint16)
+    data[:, ::7, ::5] = 3
+    encoder = DataArrayHelper.DataArrayEncoder()
+    raw = encoder.encode(data, DataArrayCategory.ImageStack, 1, 2, 4, 9)
+    compressor = DataArrayHelper.DataArrayCompressor(codec, block_size=10000)
+    buffer = compressor.compress(raw)
+    fields = unpack_header(buffer)
+    assert fields[21] == codec
+    if codec != DataArrayHelper.DATA_ARRAY_CODEC_NONE:
+        assert fields[22] == 10000
+        assert len(buffer) < len(raw)
+    header, decoded = DataArrayHelper.decode_data_array(buffer)
+    assert header["image_number"] == 4
+    assert header["acq_tag"] == 9
+    assert decoded.dtype == numpy.uint16
+    numpy.testing.assert_array_equal(decoded, data)
+
+
+def split_blocks(buffer):
+    """Returns the compressed blocks of a DATA_ARRAY, as documented"""
+    fields = unpack_header(buffer)
+    header_len, block_size = fields[2], fields[22]
+    nb_dim = fields[6]
+    size = fields[7 + nb_dim - 1] * fields[13 + nb_dim - 1]
+    nb_blocks = -(-size // block_size)
+    sizes = struct.unpack_from("<%dQ" % nb_blocks, buffer, header_len)
+    offset = header_len + 8 * nb_blocks
+    blocks = []
+    for i, compressed_size in enumerate(sizes):
+        block = buffer[offset : offset + compressed_size]
+        blocks.append((block, min(block_size, size - i * block_size)))
+        offset += compressed_size
+    assert offset == len(buffer)
+    return blocks
+
+
+def test_lz4_raw_blocks():
+    lz4_block = pytest.importorskip("lz4.block")
+    data = numpy.arange(2 * 300 * 200, dtype=numpy.uint16).reshape(2, 300, 200)
+    raw = DataArrayHelper.DataArrayEncoder().encode(
+        data, DataArrayCategory.ImageStack, 1, 2, 0, 0
+    )
+    codec = DataArrayHelper.DATA_ARRAY_CODECS["LZ4"]
+    buffer = DataArrayHelper.DataArrayCompressor(codec, block_size=10000).compress(raw)
+    # no size prefix: a raw lz4 block decoder with the block size
+    payload = b"".join(
+        lz4_block.decompress(block, uncompressed_size=size)
+        for block, size in split_blocks(buffer)
+    )
+    decoded = numpy.frombuffer(payload, numpy.uint16)
+    numpy.testing.assert_array_equal(decoded, data.ravel())
+
+
+def test_bslz4_blocks():
+    bitshuffle = pytest.importorskip("bitshuffle")
+    lz4_block = pytest.importorskip("lz4.block")
+    data = numpy.arange(2 * 300 * 200, dtype=numpy.uint16).reshape(2, 300, 200)
+    raw = DataArrayHelper.DataArrayEncoder().encode(
+        data, DataArrayCategory.ImageStack, 1, 2, 0, 0
+    )
+    codec = DataArrayHelper.DATA_ARRAY_CODECS["BSLZ4"]
+    buffer = DataArrayHelper.DataArrayCompressor(codec, block_size=10000).compress(raw)
+    frames = []
+    for block, size in split_blocks(buffer):
+        # no 12 bytes header: a big-endian compressed size + lz4 block
+        (compressed_size,) = struct.unpack_from(">I", block)
+        lz4_block.decompress(block[4 : 4 + compressed_size], uncompressed_size=8192)
+        block = numpy.frombuffer(block, numpy.uint8)
+        dtype = numpy.dtype(numpy.uint16)
+        frames.append(bitshuffle.decompress_lz4(block, (size // 2,), dtype))
+    numpy.testing.assert_array_equal(numpy.concatenate(frames), data.ravel())
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        DataArrayHelper.DataArrayCompressor(42)
+
+
+def test_compress_small_block_size():
+    codec = DataArrayHelper.DATA_ARRAY_CODECS["ZLIB"]
+    data = numpy.arange(10, dtype=numpy.float64)
+    raw = DataArrayHelper.DataArrayEncoder().encode(
+        data, DataArrayCategory.Image, 9, 8, 0, 0
+    )
+    # clamped to one element per block
+    buffer = DataArrayHelper.DataArrayCompressor(codec, block_size=3).compress(raw)
+    assert unpack_header(buffer)[22] == 8
+    numpy.testing.assert_array_equal(
+        DataArrayHelper.decode_data_array(buffer)[1], data
+    )
+    with pytest.raises(ValueError):
+        DataArrayHelper.DataArrayCompressor(codec, block_size=0)
+
+
+def test_unsupported_data_type():
+    data = numpy.zeros((2, 3), numpy.uint16)
+    encoder = DataArrayHelper.DataArrayEncoder()
+    with pytest.raises(ValueError):
+        encoder.encode(data, DataArrayCategory.Image, -1, 2, 0, 0)
+    raw = encoder.encode(data, DataArrayCategory.Image, 1, 2, 0, 0)
+    struct.pack_into("<I", raw, 12, 42)  # data type
+    codec = DataArrayHelper.DATA_ARRAY_CODECS["ZLIB"]
+    with pytest.raises(ValueError):
+        DataArrayHelper.DataArrayCompressor(codec).compress(raw)
+    with pytest.raises(ValueError):
+        DataArrayHelper.decode_data_array(raw)
@@ -0,0 +1,306 @@
+import os
+import bz2
+import gzip
+import json
+import tracemalloc
+import numpy
+import pytest
+
+from lima.server import EdfFile
+from conftest import write_edf
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_get_data(tmp_path, frames, mmap):
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, frames, {"masked_value": "zero"})
+    edf = EdfFile.EdfFile(filename, "r", mmap=mmap)
+    assert edf.GetNumImages() == 3
+    for i, frame in enumerate(frames):
+        numpy.testing.assert_array_equal(edf.GetData(i), frame)
+        assert edf.GetHeader(i) == {"masked_value": "zero"}
+    region = edf.GetData(1, Pos=(1, 1), Size=(2, 2))
+    numpy.testing.assert_array_equal(region, frames[1][1:3, 1:3])
+    region = edf.GetData(2, Pos=(2, 1))
+    numpy.testing.assert_array_equal(region, frames[2][1:, 2:])
+
+
+def test_get_data_mmap_is_a_view(tmp_path, frames):
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, frames)
+    edf = EdfFile.EdfFile(filename, "r", mmap=True)
+    data = edf.GetData(1)
+    assert not data.flags.owndata
+    assert not data.flags.writeable
+
+
+def test_get_data_mmap_byteswap(tmp_path, frames):
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, frames, byteorder="HighByteFirst")
+    edf = EdfFile.EdfFile(filename, "r", mmap=True)
+    numpy.testing.assert_array_equal(edf.GetData(2), frames[2])
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_index_cache(tmp_path, frames, mmap):
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, frames, {"masked_value": "zero"})
+    edf = EdfFile.EdfFile(filename, "r", mmap=mmap, index_cache=True)
+    assert edf.GetNumImages() == 3
+    index_path = filename + EdfFile.INDEX_CACHE_SUFFIX
+    assert os.path.isfile(index_path)
+
+    # the headers are not parsed again
+    with open(index_path) as f:
+        index = json.load(f)
+    index["images"][1]["Header"]["masked_value"] = "cached"
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+    edf = EdfFile.EdfFile(filename, "r", mmap=mmap, index_cache=True)
+    assert edf.GetHeader(1) == {"masked_value": "cached"}
+    for i, frame in enumerate(frames):
+        numpy.testing.assert_array_equal(edf.GetData(i), frame)
+
+    # the index is out of date once the file is modified
+    write_edf(filename, frames[:2], {"masked_value": "nonzero"})
+    edf = EdfFile.EdfFile(filename, "r", mmap=mmap, index_cache=True)
+    assert edf.GetNumImages() == 2
+    assert edf.GetHeader(1) == {"masked_value": "nonzero"}
+
+
+def test_index_cache_read_only_dir(tmp_path, frames):
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, frames)
+    index_path = str(tmp_path / "missing" / "frames.idx")
+    edf = EdfFile.EdfFile(filename, "r", index_cache=index_path)
+    assert edf.GetNumImages() == 3
+    assert not os.path.exists(index_path)
+
+
+def test_write_image(tmp_path, frames):
+    filename = str(tmp_path / "frames.edf")
+    edf = EdfFile.EdfFile(filename)
+    for frame in frames:
+        edf.WriteImage({"masked_value": "zero"}, frame)
+    edf = EdfFile.EdfFile(filename, "r")
+    assert edf.GetNumImages() == 3
+    for i, frame in enumerate(frames):
+        numpy.testing.assert_array_equal(edf.GetData(i), frame)
+        assert edf.GetHeader(i) == {"masked_value": "zero"}
+        assert edf.GetStaticHeader(i)["Image"] == str(i + 1)
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 16])
+def test_stream_writer(tmp_path, frames, batch_size):
+    expected = str(tmp_path / "expected.edf")
+    edf = EdfFile.EdfFile(expected)
+    for i, frame in enumerate(frames):
+        edf.WriteImage({"frame": i}, frame, ByteOrder="HighByteFirst")
+
+    filename = str(tmp_path / "frames.edf")
+    edf = EdfFile.EdfFile(filename)
+    with edf.StreamWriter(batch_size) as writer:
+        for i, frame in enumerate(frames):
+            writer.write({"frame": i}, frame, ByteOrder="HighByteFirst")
+    with open(expected, "rb") as f1, open(filename, "rb") as f2:
+        assert f1.read() == f2.read()
+    for i, frame in enumerate(frames):
+        numpy.testing.assert_array_equal(edf.GetData(i), frame)
+
+
+def compress_edf(filename, frames, compress, members):
+    """Compress each group of frames as a separate gzip member / bz2 stream"""
+    plain = filename + ".plain"
+    with open(filename, "wb") as f:
+        for group in numpy.array_split(numpy.arange(len(frames)), members):
+            write_edf(plain, [frames[i] for i in group])
+            with open(plain, "rb") as p:
+                f.write(compress(p.read()))
+
+
+@pytest.fixture
+def many_frames():
+    rng = numpy.random.default_rng(0)
+    frames = [rng.integers(0, 100, (64, 48), dtype=numpy.uint16) for i in range(8)]
+    # stored (not compressed) gzip data with gzip magic bytes inside:
+    # false member starts
+    frames[3].reshape(-1).view(numpy.uint8)[:30] = list(b"\x1f\x8b\x08" * 10)
+    return frames
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+@pytest.mark.parametrize("members", [1, 3, 8])
+@pytest.mark.parametrize(
+    "suffix,compress",
+    [
+        (".edf.gz", lambda data: gzip.compress(data, 0)),
+        (".edf.gz", lambda data: gzip.compress(data, 6)),
+        (".edf.bz2", bz2.compress),
+    ],
+)
+def test_iter_images_compressed(
+    tmp_path, many_frames, threads, members, suffix, compress
+):
+    filename = str(tmp_path / ("frames" + suffix))
+    compress_edf(filename, many_frames, compress, members)
+    images = list(EdfFile.IterImages(filename, Threads=threads))
+    assert len(images) == len(many_frames)
+    for (header, data), frame in zip(images, many_frames):
+        assert header == {}
+        numpy.testing.assert_array_equal(data, frame)
+
+
+def test_iter_images_truncated(tmp_path, many_frames):
+    filename = str(tmp_path / "frames.edf.gz")
+    compress_edf(filename, many_frames, gzip.compress, 8)
+    with open(filename, "ab") as f:
+        f.write(bytes(100))  # padding
+    assert len(list(EdfFile.IterImages(filename, Threads=4))) == 8
+    with open(filename, "rb+") as f:
+        f.truncate(os.path.getsize(filename) - 300)
+    assert len(list(EdfFile.IterImages(filename, Threads=4))) == 7
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+@pytest.mark.parametrize(
+    "suffix,compress", [(".edf.gz", gzip.compress), (".edf.bz2", bz2.compress)]
+)
+def test_iter_images_bounded_memory(tmp_path, threads, suffix, compress):
+    # highly compressible single member: a few kB for 12 MB of frames
+    frames = [numpy.full((1024, 1024), i, dtype=numpy.int32) for i in range(3)]
+    filename = str(tmp_path / ("frames" + suffix))
+    compress_edf(filename, frames, compress, 1)
+    del frames
+    tracemalloc.start()
+    try:
+        nb = 0
+        for header, data in EdfFile.IterImages(filename, Threads=threads):
+            assert data[0, 0] == nb
+            nb += 1
+            del data
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert nb == 3
+    # one frame (4 MB) and a few decompressed chunks: the queue of the
+    # worker, the chunks being produced and read and the leftover
+    assert peak < (4 << 20) + 8 * EdfFile.DECOMPRESSION_CHUNK_SIZE
+
+
+def test_iter_images_plain(tmp_path, frames):
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, frames, {"masked_value": "zero"})
+    images = list(EdfFile.IterImages(filename, "FloatValue"))
+    assert len(images) == 3
+    for (header, data), frame in zip(images, frames):
+        assert header == {"masked_value": "zero"}
+        assert data.dtype == numpy.float32
+        numpy.testing.assert_array_equal(data, frame)
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+@pytest.mark.parametrize(
+    "pos,size",
+    [
+        ((0, 0, 0), (0, 0, 0)),
+        ((1, 2, 1), (3, 2, 2)),
+        ((4, 0, 2), (1, 0, 1)),
+        ((0, 3, 0), (5, 1, 0)),
+    ],
+)
+def test_get_data_region_3d(tmp_path, mmap, pos, size):
+    volume = numpy.arange(3 * 4 * 5, dtype=numpy.int32).reshape(3, 4, 5)
+    filename = str(tmp_path / "volume.edf")
+    write_edf(filename, [volume])
+    edf = EdfFile.EdfFile(filename, "r", mmap=mmap)
+    x, y, z = pos
+    sx, sy, sz = [s or d - p for s, d, p in zip(size, (5, 4, 3), pos)]
+    expected = volume[z : z + sz, y : y + sy, x : x + sx]
+    data = edf.GetData(0, Pos=pos, Size=size)
+    numpy.testing.assert_array_equal(data, expected)
+    if not mmap:
+        # an array of its own, as before the region reads
+        assert data.flags.c_contiguous and data.flags.writeable
+
+
+class CountingFile:
+    """A file opened for reading that counts its seek/read calls"""
+
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.file, name)
+        if name in ("seek", "read", "readinto"):
+            self.calls += 1
+        return attr
+
+
+@pytest.mark.parametrize("pos,size", [((1, 0, 0), (2, 4, 3)), ((1, 1, 1), (1, 2, 1))])
+def test_get_data_region_single_read(tmp_path, pos, size):
+    volume = numpy.arange(3 * 4 * 5, dtype=numpy.int32).reshape(3, 4, 5)
+    filename = str(tmp_path / "volume.edf")
+    write_edf(filename, [volume])
+    edf = EdfFile.EdfFile(filename, "r")
+    edf.File = CountingFile(filename)
+    x, y, z = pos
+    sx, sy, sz = size
+    data = edf.GetData(0, Pos=pos, Size=size)
+    numpy.testing.assert_array_equal(data, volume[z : z + sz, y : y + sy, x : x + sx])
+    # partial rows: one seek and one read of the span covering the region
+    assert edf.File.calls == 2
+
+
+def test_get_data_region_1d(tmp_path):
+    filename = str(tmp_path / "line.edf")
+    line = numpy.arange(10, dtype=numpy.float32)
+    write_edf(filename, [line], byteorder="HighByteFirst")
+    edf = EdfFile.EdfFile(filename, "r")
+    numpy.testing.assert_array_equal(edf.GetData(0, Pos=(3,), Size=(4,)), line[3:7])
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_get_data_stack(tmp_path, frames, mmap):
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, frames)
+    edf = EdfFile.EdfFile(filename, "r", mmap=mmap)
+    stack = edf.GetDataStack()
+    numpy.testing.assert_array_equal(stack, numpy.stack(frames))
+    assert not stack.flags.writeable
+    stack = edf.GetDataStack(1, 3, "FloatValue")
+    assert stack.dtype == numpy.float32
+    numpy.testing.assert_array_equal(stack, numpy.stack(frames[1:]))
+    with pytest.raises(ValueError):
+        edf.GetDataStack(2, 4)
+
+
+def test_get_data_stack_irregular_headers(tmp_path, frames):
+    # a longer header in the middle, the frames are gathered in a copy
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, frames[:1])
+    write_edf(str(tmp_path / "long.edf"), frames[1:2], {"comment": "x" * 2000})
+    write_edf(str(tmp_path / "last.edf"), frames[2:])
+    with open(filename, "ab") as f:
+        for name in ("long.edf", "last.edf"):
+            with open(str(tmp_path / name), "rb") as part:
+                f.write(part.read())
+    for mmap in (False, True):
+        edf = EdfFile.EdfFile(filename, "r", mmap=mmap)
+        numpy.testing.assert_array_equal(edf.GetDataStack(), numpy.stack(frames))
+
+
+def test_get_data_stack_errors(tmp_path, frames):
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, [frames[0], frames[1], frames[2][:2]])
+    edf = EdfFile.EdfFile(filename, "r", mmap=True)
+    numpy.testing.assert_array_equal(edf.GetDataStack(0, 2), numpy.stack(frames[:2]))
+    with pytest.raises(ValueError):
+        edf.GetDataStack()
+    filename = str(tmp_path / "truncated.edf")
+    write_edf(filename, frames)
+    with open(filename, "r+b") as f:
+        f.truncate(os.path.getsize(filename) - 2)
+    edf = EdfFile.EdfFile(filename, "r", mmap=False)
+    with pytest.raises(IOError):
+        edf.GetDataStack(0, 3)
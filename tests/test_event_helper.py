@@ -0,0 +1,123 @@
+import threading
+import time
+
+from lima.server import EventHelper
+
+
+def test_latest_wins_worker_processes_items():
+    processed = []
+    worker = EventHelper.LatestWinsWorker(processed.append)
+    try:
+        worker.submit(1)
+        assert worker.wait_idle(5)
+        worker.submit(2)
+        assert worker.wait_idle(5)
+    finally:
+        worker.stop()
+    assert processed == [1, 2]
+    assert worker.dropped == 0
+
+
+def test_latest_wins_worker_drops_stale_items():
+    processed = []
+    release = threading.Event()
+    started = threading.Event()
+
+    def process(item):
+        started.set()
+        release.wait(5)
+        processed.append(item)
+
+    worker = EventHelper.LatestWinsWorker(process)
+    try:
+        worker.submit(0)
+        assert started.wait(5)
+        # the worker is busy with 0: 1, 2 and 3 compete for the single slot
+        assert worker.submit(1)
+        assert not worker.submit(2)
+        assert not worker.submit(3)
+        release.set()
+        assert worker.wait_idle(5)
+    finally:
+        worker.stop()
+    assert processed == [0, 3]
+    assert worker.dropped == 2
+    worker.reset_dropped()
+    assert worker.dropped == 0
+
+
+def test_latest_wins_worker_survives_errors():
+    processed = []
+
+    def process(item):
+        if item is None:
+            raise RuntimeError("Failed")
+        processed.append(item)
+
+    worker = EventHelper.LatestWinsWorker(process)
+    try:
+        worker.submit(None)
+        assert worker.wait_idle(5)
+        worker.submit(1)
+        assert worker.wait_idle(5)
+    finally:
+        worker.stop()
+    assert processed == [1]
+
+
+def test_event_rate_controller_fixed():
+    rate = EventHelper.EventRateController(25)
+    rate.record_push(1.0)
+    assert rate.rate == 25
+    assert rate.next_time(10) == 10 + 1.0 / 25
+
+
+def test_event_rate_controller_adaptive():
+    rate = EventHelper.EventRateController(25, adaptive=True)
+    assert rate.rate == 25
+    # 10 ms per push: 10 Hz keeps the pushes within 10% of the time
+    rate.record_push(0.01)
+    assert abs(rate.rate - 10) < 1e-9
+    # very slow clients: never below 1 Hz
+    for i in range(50):
+        rate.record_push(10)
+    assert rate.rate == rate.MinRate
+    # fast clients: back to the max rate
+    for i in range(100):
+        rate.record_push(1e-5)
+    assert rate.rate == 25
+
+
+def test_event_rate_classes():
+    classes = EventHelper.EventRateClasses({"slow": 1, "fast": 8, "all": 0})
+    assert classes.names == ["slow", "fast", "all"]
+    pushed = {name: 0 for name in classes.names}
+    # 128 Hz source during 2 s
+    for i in range(256):
+        for name in classes.due(i / 128):
+            pushed[name] += 1
+    assert pushed == {"slow": 2, "fast": 16, "all": 256}
+
+
+def test_trailing_flush():
+    flushed = threading.Event()
+    calls = []
+
+    def flush():
+        calls.append(time.monotonic())
+        flushed.set()
+
+    trailing = EventHelper.TrailingFlush(flush)
+    try:
+        t0 = time.monotonic()
+        trailing.schedule(0.05)
+        trailing.schedule(0.5)  # the earliest deadline is kept
+        assert flushed.wait(5)
+        assert 0.04 <= calls[0] - t0 < 0.5
+        flushed.clear()
+        trailing.schedule(0.05)
+        trailing.cancel()
+        assert not flushed.wait(0.2)
+    finally:
+        trailing.stop()
+    assert len(calls) == 1
@@ -0,0 +1,88 @@
+import gzip
+import numpy
+import pytest
+
+from lima.server import ImageFileHelper
+from conftest import write_edf
+
+
+def test_split_data_path():
+    assert ImageFileHelper.split_data_path("/a/b.h5") == ("/a/b.h5", None)
+    assert ImageFileHelper.split_data_path("/a/b.h5::/entry/data") == (
+        "/a/b.h5",
+        "/entry/data",
+    )
+
+
+@pytest.mark.parametrize("name", ["frames.edf", "frames.edf.gz"])
+def test_read_edf(tmp_path, frames, name):
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, frames, {"masked_value": "nonzero"})
+    if name.endswith(".gz"):
+        with open(filename, "rb") as f:
+            data = f.read()
+        filename += ".gz"
+        with gzip.open(filename, "wb") as f:
+            f.write(data)
+    headers, stack = ImageFileHelper.read_stack(filename, 1)
+    numpy.testing.assert_array_equal(stack, frames[1:])
+    assert [h["masked_value"] for h in headers] == ["nonzero", "nonzero"]
+    with pytest.raises(ValueError):
+        ImageFileHelper.read_stack(filename, 3)
+
+
+def test_read_edf_rewritten(tmp_path, frames):
+    filename = str(tmp_path / "frames.edf")
+    write_edf(filename, frames)
+    headers, stack = ImageFileHelper.read_stack(filename)
+    # the frames read do not follow the file
+    write_edf(filename + ".new", frames + 1)
+    with open(filename + ".new", "rb") as new, open(filename, "r+b") as f:
+        f.write(new.read())
+    numpy.testing.assert_array_equal(stack, frames)
+
+
+def test_read_npy(tmp_path, frames):
+    filename = str(tmp_path / "frames.npy")
+    numpy.save(filename, frames)
+    headers, stack = ImageFileHelper.read_stack(filename, 1, 2)
+    # a copy of the requested frames, not a view of the mapped file
+    assert not isinstance(stack, numpy.memmap)
+    assert stack.flags.owndata
+    assert headers == [{}]
+    numpy.testing.assert_array_equal(stack, frames[1:2])
+    # a single image
+    numpy.save(filename, frames[0])
+    headers, stack = ImageFileHelper.read_stack(filename)
+    numpy.testing.assert_array_equal(stack, frames[:1])
+
+
+@pytest.mark.skipif(not ImageFileHelper.PILLOW, reason="Pillow is not installed")
+def test_read_tiff(tmp_path, frames):
+    import PIL.Image
+
+    filename = str(tmp_path / "frames.tiff")
+    images = [PIL.Image.fromarray(frame) for frame in frames]
+    images[0].save(filename, save_all=True, append_images=images[1:])
+    headers, stack = ImageFileHelper.read_stack(filename, 1)
+    assert stack.dtype == numpy.uint16
+    numpy.testing.assert_array_equal(stack, frames[1:])
+
+
+def test_read_hdf5(tmp_path, frames):
+    h5py = pytest.importorskip("h5py")
+
+    filename = str(tmp_path / "frames.h5")
+    with h5py.File(filename, "w") as f:
+        f["entry/title"] = "frames"
+        f["entry/data/stack"] = frames
+        f["entry/data/stack"].attrs["masked_value"] = "nonzero"
+        f["entry/mask"] = frames[0]
+    headers, stack = ImageFileHelper.read_stack(filename + "::/entry/data/stack", 2)
+    numpy.testing.assert_array_equal(stack, frames[2:])
+    assert headers == [{"masked_value": "nonzero"}]
+    headers, stack = ImageFileHelper.read_stack(filename + "::/entry/mask")
+    numpy.testing.assert_array_equal(stack, frames[:1])
+    # the first image dataset by default
+    headers, stack = ImageFileHelper.read_stack(filename)
+    numpy.testing.assert_array_equal(stack, frames)
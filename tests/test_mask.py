@@ -62,3 +62,20 @@ def test_silx_nonzero_flag(image_factory):
     filename = image_factory.edf_image(mask, header)
     internal_mask = Utils.getMaskFromFile(filename)
     numpy.testing.assert_almost_equal(extected_internal, internal_mask.buffer)
+
+
+def test_shared_mask_is_read_only(image_factory):
+    """
+    Test that a caller can't modify the mask shared through the cache
+    """
+    mask = numpy.ones((4,4), dtype=numpy.uint8)
+    filename = image_factory.edf_image(mask)
+    first = Utils.getMaskFromFile(filename)
+    second = Utils.getMaskFromFile(filename)
+    assert first is not second
+    buffer = first.buffer
+    with pytest.raises(ValueError):
+        buffer[0, 0] = 0
+    with pytest.raises(ValueError):
+        buffer.setflags(write=True)
+    numpy.testing.assert_almost_equal(mask, second.buffer)
@@ -0,0 +1,59 @@
+import numpy
+import pytest
+
+from lima.server import ResultTableHelper
+
+
+def test_encode_decode():
+    columns = [
+        ("frame_number", numpy.arange(5, dtype=numpy.int32)),
+        ("x", numpy.linspace(0, 1, 5)),
+        ("flag", numpy.array([1, 0, 1, 1, 0], dtype=numpy.uint8)),
+        ("big", numpy.arange(5, dtype=">u2")),
+    ]
+    data = ResultTableHelper.encode_result_table(columns)
+    # every column is 8 bytes aligned for zero-copy views
+    assert len(data) == 16 + 4 * 24 + 24 + 40 + 8 + 16
+    decoded = ResultTableHelper.decode_result_table(bytes(data))
+    assert list(decoded) == [name for name, column in columns]
+    for name, column in columns:
+        numpy.testing.assert_array_equal(decoded[name], column)
+        assert decoded[name].base is not None
+    assert decoded["big"].dtype == numpy.dtype("<u2")
+
+
+def test_empty():
+    data = ResultTableHelper.encode_result_table([("x", numpy.zeros(0))])
+    assert ResultTableHelper.decode_result_table(data)["x"].size == 0
+    assert ResultTableHelper.decode_result_table(
+        ResultTableHelper.encode_result_table([])
+    ) == {}
+
+
+def test_errors():
+    with pytest.raises(ValueError):
+        ResultTableHelper.encode_result_table(
+            [("a", numpy.zeros(2)), ("b", numpy.zeros(3))]
+        )
+    with pytest.raises(ValueError):
+        ResultTableHelper.encode_result_table([("a" * 17, numpy.zeros(2))])
+    with pytest.raises(ValueError):
+        ResultTableHelper.decode_result_table(bytes(64))
+
+
+def test_result_columns():
+    class Peak(object):
+        def __init__(self, frameNumber, x_peak, y_peak):
+            self.frameNumber = frameNumber
+            self.x_peak = x_peak
+            self.y_peak = y_peak
+
+    peaks = [Peak(i, i * 0.5, i * 2.0) for i in range(4)]
+    frame, x, y = ResultTableHelper.result_columns(
+        peaks, ("frameNumber", "x_peak", "y_peak")
+    )
+    assert frame.tolist() == [0, 1, 2, 3]
+    assert x.tolist() == [0, 0.5, 1, 1.5]
+    assert y.tolist() == [0, 2, 4, 6]
+    empty = ResultTableHelper.result_columns([], ("frameNumber", "x_peak"))
+    assert empty.shape == (2, 0)
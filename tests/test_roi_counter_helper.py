@@ -0,0 +1,435 @@
+import threading
+import time
+import numpy
+import pytest
+
+from lima.server import RoiCounterHelper
+
+
+class Result(object):
+    """Stands for core.Processlib.Tasks.RoiCounterResult"""
+
+    __slots__ = RoiCounterHelper.RESULT_FIELDS
+
+    def __init__(self, frameNumber, value):
+        self.frameNumber = frameNumber
+        self.sum = value * 100
+        self.average = value
+        self.std = value / 10
+        self.minValue = value - 1
+        self.maxValue = value + 1
+
+
+def legacy_pack(roi_results, roi_ids):
+    """The RoiCounter.readCounters loop before pack_counters"""
+    minListSize = min(len(results) for name, results in roi_results)
+    returnArray = numpy.zeros(minListSize * len(roi_results) * 7)
+    indexArray = 0
+    for roiName, resultList in roi_results:
+        roi_id = roi_ids.get(roiName)
+        for result in resultList[:minListSize]:
+            returnArray[indexArray : indexArray + 7] = (
+                float(roi_id),
+                float(result.frameNumber),
+                result.sum,
+                result.average,
+                result.std,
+                result.minValue,
+                result.maxValue,
+            )
+            indexArray += 7
+    return returnArray
+
+
+def make_results(nb_rois, nb_frames):
+    return [
+        ("roi%d" % i, [Result(f, i + f / 2.0) for f in range(nb_frames - i)])
+        for i in range(nb_rois)
+    ]
+
+
+def test_pack_counters():
+    roi_results = make_results(3, 5)
+    roi_ids = {"roi0": 4, "roi1": 7, "roi2": 1}
+    packed = RoiCounterHelper.pack_counters(roi_results, roi_ids)
+    assert packed.dtype == numpy.double
+    assert packed.shape == (3 * 3 * 7,)
+    numpy.testing.assert_array_equal(packed, legacy_pack(roi_results, roi_ids))
+
+
+def test_pack_counters_empty():
+    assert RoiCounterHelper.pack_counters([], {}).size == 0
+    roi_results = [("roi0", [Result(0, 1.0)]), ("roi1", [])]
+    packed = RoiCounterHelper.pack_counters(roi_results, {"roi0": 0, "roi1": 1})
+    assert packed.size == 0
+
+
+def test_pack_counters_unknown_roi():
+    # e.g. a roi removed while its results are read
+    roi_results = make_results(3, 5)
+    roi_ids = {"roi0": 4, "roi2": 1}
+    packed = RoiCounterHelper.pack_counters(roi_results, roi_ids)
+    expected = legacy_pack([roi_results[0], roi_results[2]], roi_ids)
+    numpy.testing.assert_array_equal(packed, expected)
+    assert RoiCounterHelper.pack_counters(roi_results, {}).size == 0
+    cursor = RoiCounterHelper.CounterCursor()
+    lost, packed = cursor.read(lambda from_frame: roi_results, 4, roi_ids)
+    assert set(packed.reshape(-1, 7)[:, 0]) == {4, 1}
+
+
+class RingManager(object):
+    """Stands for the RoiCounterTaskMgr results buffer"""
+
+    def __init__(self, names, buffer_size):
+        self.results = {name: [] for name in names}
+        self.buffer_size = buffer_size
+        self.counter_status = -1
+
+    def process(self, frame, names=None):
+        for name in names or self.results:
+            results = self.results[name]
+            results.append(Result(frame, float(frame)))
+            del results[: -self.buffer_size]
+        self.counter_status = frame
+
+    def read_counters(self, from_frame):
+        return [
+            (name, [r for r in results if r.frameNumber >= from_frame])
+            for name, results in self.results.items()
+        ]
+
+
+def frames_of(packed):
+    counters = packed.reshape(-1, 7)
+    return [(int(roi_id), int(frame)) for roi_id, frame in counters[:, :2]]
+
+
+def test_counter_cursor():
+    roi_ids = {"a": 0, "b": 1}
+    mgr = RingManager(roi_ids, 4)
+    cursor = RoiCounterHelper.CounterCursor()
+
+    def read():
+        return cursor.read(mgr.read_counters, mgr.counter_status, roi_ids)
+
+    lost, packed = read()
+    assert lost == 0 and packed.size == 0
+    mgr.process(0)
+    mgr.process(1)
+    # "b" lags, "a" is not held back
+    mgr.process(2, ["a"])
+    lost, packed = read()
+    assert lost == 0
+    assert frames_of(packed) == [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1)]
+    lost, packed = read()
+    assert lost == 0 and packed.size == 0
+    mgr.process(2, ["b"])
+    lost, packed = read()
+    assert frames_of(packed) == [(1, 2)]
+    # the ring buffer wrapped
+    for frame in range(3, 10):
+        mgr.process(frame)
+    lost, packed = read()
+    assert lost == 3
+    assert frames_of(packed) == [(i, f) for i in range(2) for f in range(6, 10)]
+
+
+def test_counter_cursor_new_acquisition():
+    roi_ids = {"a": 0}
+    mgr = RingManager(roi_ids, 4)
+    cursor = RoiCounterHelper.CounterCursor()
+    for frame in range(3):
+        mgr.process(frame)
+    cursor.read(mgr.read_counters, mgr.counter_status, roi_ids)
+    mgr = RingManager(roi_ids, 4)
+    mgr.process(0)
+    lost, packed = cursor.read(mgr.read_counters, mgr.counter_status, roi_ids)
+    assert lost == 0
+    assert frames_of(packed) == [(0, 0)]
+
+
+def test_counter_cursors(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(RoiCounterHelper.time, "monotonic", lambda: now[0])
+    cursors = RoiCounterHelper.CounterCursors(3, 60)
+    ids = [cursors.open() for i in range(3)]
+    assert len(set(ids)) == 3
+    cursors.get(ids[0])
+    # the least recently used one is dropped
+    ids.append(cursors.open())
+    assert len(cursors) == 3
+    with pytest.raises(ValueError):
+        cursors.get(ids[1])
+    cursors.close(ids[2])
+    with pytest.raises(ValueError):
+        cursors.close(ids[2])
+    # idle cursors are dropped
+    now[0] += 30
+    cursors.get(ids[3])
+    now[0] += 40
+    with pytest.raises(ValueError):
+        cursors.get(ids[0])
+    assert cursors.get(ids[3]) is not None
+    new = cursors.open()
+    assert len(cursors) == 2
+    cursors.clear()
+    with pytest.raises(ValueError):
+        cursors.get(new)
+
+
+def test_parse_rois():
+    geometry = RoiCounterHelper.parse_rois(["a", "b"], [0, 1, 2, 3, 4, 5, 6, 7])
+    assert geometry.tolist() == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    for names, geometry in [
+        (["a"], [0, 1, 2, 3, 4]),
+        (["a", "b"], [0, 1, 2, 3]),
+        (["a", "a"], [0, 1, 2, 3, 4, 5, 6, 7]),
+        (["a", "b"], [0, 1, 2, 3, 4, 5, 0, 7]),
+        (["a", "b"], [0, 1, 2, 3, -4, 5, 6, 7]),
+    ]:
+        with pytest.raises(ValueError):
+            RoiCounterHelper.parse_rois(names, geometry)
+
+
+def test_result_event_pusher():
+    roi_ids = {"a": 0}
+    mgr = RingManager(roi_ids, 100)
+    cursor = RoiCounterHelper.CounterCursor()
+    events = []
+    done = threading.Event()
+
+    def read():
+        lost, counters = cursor.read(mgr.read_counters, mgr.counter_status, roi_ids)
+        return counters.reshape(-1, 7)
+
+    def push(results):
+        events.append(results)
+        if results[-1, 1] == 19:
+            done.set()
+
+    pusher = RoiCounterHelper.ResultEventPusher(read, push, 20)
+    try:
+        for frame in range(20):
+            mgr.process(frame)
+            pusher.notify()
+            time.sleep(0.005)
+        assert done.wait(2)
+    finally:
+        pusher.stop()
+    # the frames are batched by the rate limit, none is lost or repeated
+    assert 1 < len(events) < 20
+    frames = numpy.concatenate(events)[:, 1]
+    assert frames.tolist() == list(range(20))
+
+
+def test_result_event_pusher_late_results():
+    # the results computed after the notification are pushed by the flush
+    events = []
+    pending = [numpy.zeros((1, 7))]
+    pushed = threading.Event()
+
+    def read():
+        return pending.pop() if pending else numpy.zeros((0, 7))
+
+    def push(results):
+        events.append(results)
+        pushed.set()
+
+    pusher = RoiCounterHelper.ResultEventPusher(read, push, 50)
+    try:
+        pusher.notify()
+        assert pushed.wait(2)
+        pushed.clear()
+        pending.append(numpy.ones((2, 7)))
+        assert pushed.wait(2)
+    finally:
+        pusher.stop()
+    assert [len(results) for results in events] == [1, 2]
+
+
+def test_counters_table():
+    from lima.server import ResultTableHelper
+
+    roi_results = make_results(2, 3)
+    packed = RoiCounterHelper.pack_counters(roi_results, {"roi0": 3, "roi1": 5})
+    data = ResultTableHelper.encode_result_table(
+        RoiCounterHelper.counters_table(packed)
+    )
+    table = ResultTableHelper.decode_result_table(data)
+    assert list(table) == [
+        "roi_id",
+        "frame_number",
+        "sum",
+        "average",
+        "std",
+        "min",
+        "max",
+    ]
+    assert table["roi_id"].tolist() == [3, 3, 5, 5]
+    assert table["frame_number"].dtype == numpy.int32
+    numpy.testing.assert_array_equal(table["max"], packed.reshape(-1, 7)[:, 6])
+
+
+def dense_stats(frame, pixels, weights):
+    values = frame.ravel()[pixels].astype(float)
+    if not len(values):
+        return [0, 0, 0, 0, 0]
+    average = numpy.average(values, weights=weights)
+    std = numpy.sqrt(numpy.average((values - average) ** 2, weights=weights))
+    return [(values * weights).sum(), average, std, values.min(), values.max()]
+
+
+def test_sparse_rois():
+    frame = numpy.random.RandomState(0).randint(0, 1000, (32, 48)).astype(numpy.uint16)
+    pixels = [[5, 6, 7, 53], [], [1535], [100, 3, 100]]
+    weights = [[1, 0.5, 2, 1], [], [3], [1, 1, 0.25]]
+    indptr = numpy.cumsum([0] + [len(p) for p in pixels])
+    rois = RoiCounterHelper.SparseRois(
+        indptr, sum(pixels, []), numpy.concatenate(weights)
+    )
+    result = rois.evaluate(frame)
+    assert result.shape == (4, 5)
+    for i in range(4):
+        expected = dense_stats(frame, pixels[i], weights[i])
+        numpy.testing.assert_allclose(result[i], expected)
+
+    unit = RoiCounterHelper.SparseRois(indptr, sum(pixels, []))
+    numpy.testing.assert_allclose(
+        unit.evaluate(frame)[0], dense_stats(frame, pixels[0], [1, 1, 1, 1])
+    )
+    with pytest.raises(ValueError):
+        unit.evaluate(frame[:1])
+
+
+def test_parse_sparse_rois():
+    rois = RoiCounterHelper.parse_sparse_rois(["a", "b"], [0, 2, 3, 4, 5, 9])
+    assert rois.nb_rois == 2
+    assert rois.indices.tolist() == [4, 5, 9]
+    assert rois.weights.tolist() == [1, 1, 1]
+    rois = RoiCounterHelper.parse_sparse_rois(["a"], [0, 2, 4, 5, 0.5, 2])
+    assert rois.weights.tolist() == [0.5, 2]
+    for names, values in [
+        (["a", "a"], [0, 1, 2, 4, 5]),
+        (["a", "b"], [0, 1]),
+        (["a"], [0, 2, 4]),
+        (["a"], [0, 2, 4, 5, 1]),
+        (["a"], [0, 1, 4.5]),
+        (["a"], [0, 1, -1]),
+        (["a", "b"], [0, 2, 1, 4, 5]),
+    ]:
+        with pytest.raises(ValueError):
+            RoiCounterHelper.parse_sparse_rois(names, values)
+
+
+def test_sparse_roi_set():
+    frame = numpy.arange(16, dtype=numpy.uint16)
+    rois = RoiCounterHelper.parse_sparse_rois(
+        ["a", "b", "c"], [0, 2, 3, 5, 1, 2, 7, 8, 9]
+    )
+    sparse = RoiCounterHelper.SparseRoiSet()
+    roi_names = {"rect": 0}
+    # a name of another roi can not be reused by a sparse roi
+    with pytest.raises(ValueError):
+        sparse.check_names(["a", "rect"], roi_names)
+    sparse.check_names(["a", "b", "c"], roi_names)
+    assert sparse.set(["a", "b", "c"], [1, 2, 3], rois) == []
+    assert "b" in sparse and "rect" not in sparse
+    # nor the other way round, the sparse rois can be redefined
+    roi_names.update(a=1, b=2, c=3)
+    sparse.check_names(["b", "d"], roi_names)
+
+    assert sparse.remove(["b", "rect"]) == ["b"]
+    assert sparse.names == ["a", "c"] and sparse.ids == [1, 3]
+    expected = rois.evaluate(frame)[[0, 2]]
+    numpy.testing.assert_array_equal(sparse.rois.evaluate(frame), expected)
+    assert sparse.remove(["a", "c"]) == ["a", "c"]
+    assert sparse.rois is None and sparse.ids == []
+
+    sparse.set(["a", "b"], [1, 2], rois.select([0, 1]))
+    assert sparse.set(["b"], [2], rois.select([1])) == ["a"]
+    sparse.clear()
+    assert sparse.names == [] and sparse.rois is None
+
+
+def test_sparse_roi_results():
+    results = RoiCounterHelper.SparseRoiResults(4)
+    for frame in range(6):
+        results.store(frame, numpy.full((2, 5), float(frame)))
+    packed = results.read(3, [7, 8]).reshape(-1, 7)
+    assert packed[:, :2].tolist() == [[7, 3], [7, 4], [7, 5], [8, 3], [8, 4], [8, 5]]
+    assert packed[:, 2].tolist() == [3, 4, 5, 3, 4, 5]
+    # results of a previous set of rois
+    results.store(6, numpy.zeros((3, 5)))
+    assert len(results.read(0, [7, 8])) == 3 * 2 * 7
+    results.clear()
+    assert len(results.read(0, [7, 8])) == 0
+
+
+class FakeMgr(object):
+    """Stands for core.Processlib.Tasks.RoiCounterTaskMgr"""
+
+    def __init__(self):
+        self.rois = {}
+        self.status = -1
+        self.buffer_size = None
+
+    def setBufferSize(self, size):
+        self.buffer_size = size
+
+    def updateRois(self, rois):
+        for name, roi in rois:
+            self.rois[name.decode()] = roi
+
+    def removeRois(self, names):
+        for name in names:
+            del self.rois[name]
+
+    def clearAllRois(self):
+        self.rois = {}
+
+    def getCounterStatus(self):
+        return self.status
+
+    def getRois(self):
+        return sorted(self.rois.items())
+
+    def getNames(self):
+        return sorted(self.rois)
+
+    def readCounters(self, from_frame):
+        return [
+            (name, [Result(frame, roi) for frame in range(from_frame, self.status + 1)])
+            for name, roi in sorted(self.rois.items())
+        ]
+
+
+def test_sharded_roi_counter_mgr():
+    managers = [FakeMgr() for i in range(3)]
+    mgr = RoiCounterHelper.ShardedRoiCounterMgr(managers)
+    names = ["z", "b", "y", "a", "x", "c", "w"]
+    mgr.updateRois([(name.encode(), i) for i, name in enumerate(names)])
+    assert [len(m.rois) for m in managers] == [3, 2, 2]
+    assert mgr.getNames() == names
+    assert mgr.getRois() == list(zip(names, range(7)))
+    mgr.setBufferSize(16)
+    assert [m.buffer_size for m in managers] == [16, 16, 16]
+
+    # redefined rois stay on their manager, new ones go to the least loaded
+    mgr.removeRois(["b", "y", "unknown"])
+    mgr.updateRois([(b"a", 10), (b"v", 11)])
+    assert [sorted(m.rois) for m in managers] == [["a", "w", "z"], ["v", "x"], ["c"]]
+    assert mgr.getNames() == ["z", "a", "x", "c", "w", "v"]
+
+    for m, status in zip(managers, (5, 3, 4)):
+        m.status = status
+    assert mgr.getCounterStatus() == 3
+    roi_ids = {name: i for i, name in enumerate(mgr.getNames())}
+    packed = RoiCounterHelper.pack_counters(mgr.readCounters(2), roi_ids)
+    counters = packed.reshape(-1, 7)
+    assert counters[:, 0].tolist() == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5]
+    assert counters[:, 1].tolist() == [2, 3] * 6
+
+    mgr.clearAllRois()
+    assert mgr.getNames() == []
+    mgr.updateRois([(b"a", 0)])
+    assert [len(m.rois) for m in managers] == [1, 0, 0]
@@ -0,0 +1,96 @@
+import io
+import struct
+import pytest
+import numpy
+
+from lima.server import VideoHelper
+
+if VideoHelper.PILLOW:
+    import PIL.Image
+
+
+def legacy_encode(mode, frame_number, width, height, data):
+    header = struct.pack(
+        VideoHelper.VIDEO_HEADER_FORMAT,
+        VideoHelper.VIDEO_MAGIC,
+        VideoHelper.VIDEO_HEADER_VERSION,
+        mode,
+        frame_number,
+        width,
+        height,
+        ord(struct.pack("=H", 1).decode()[-1]),
+        struct.calcsize(VideoHelper.VIDEO_HEADER_FORMAT),
+        0,
+        0,
+    )
+    return header + data
+
+
+def test_encode_matches_legacy_format():
+    data = bytes(range(12))
+    encoder = VideoHelper.VideoImageEncoder()
+    buffer = encoder.encode(1, 5, 4, 3, data)
+    assert bytes(buffer) == legacy_encode(1, 5, 4, 3, data)
+
+
+def test_encode_patches_frame_number_and_reuses_buffer():
+    encoder = VideoHelper.VideoImageEncoder()
+    first = encoder.encode(1, 5, 4, 3, bytes(12))
+    data = bytes(range(12))
+    second = encoder.encode(1, 6, 4, 3, data)
+    assert second is first
+    assert bytes(second) == legacy_encode(1, 6, 4, 3, data)
+
+
+def test_encode_new_geometry():
+    encoder = VideoHelper.VideoImageEncoder()
+    first = encoder.encode(1, 5, 4, 3, bytes(12))
+    data = bytes(range(24))
+    second = encoder.encode(2, 6, 4, 3, data)
+    assert second is not first
+    assert bytes(second) == legacy_encode(2, 6, 4, 3, data)
+
+
+def test_encode_empty_image():
+    encoder = VideoHelper.VideoImageEncoder()
+    buffer = encoder.encode(0, -1, 0, 0, None)
+    assert bytes(buffer) == legacy_encode(0, -1, 0, 0, b"")
+
+
+@pytest.mark.skipif(not VideoHelper.PILLOW, reason="Pillow is not installed")
+def test_preview_grey16_is_bounded_and_decodable():
+    data = numpy.arange(2000 * 3000, dtype=numpy.uint16).reshape(2000, 3000)
+    encoder = VideoHelper.VideoPreviewEncoder("JPEG", max_size=1024)
+    fmt, preview = encoder.encode("Y16", 3000, 2000, data.tobytes())
+    assert fmt == "JPEG_GRAY8"
+    image = PIL.Image.open(io.BytesIO(preview))
+    assert image.format == "JPEG"
+    assert image.mode == "L"
+    assert image.size == (1000, 666)
+
+
+@pytest.mark.skipif(not VideoHelper.PILLOW, reason="Pillow is not installed")
+def test_preview_bgr24():
+    data = numpy.zeros((4, 6, 3), dtype=numpy.uint8)
+    data[..., 0] = 255  # blue
+    encoder = VideoHelper.VideoPreviewEncoder("JPEG", quality=100)
+    fmt, preview = encoder.encode("BGR24", 6, 4, data.tobytes())
+    assert fmt == "JPEG_RGB"
+    pixels = numpy.asarray(PIL.Image.open(io.BytesIO(preview)))
+    assert pixels.shape == (4, 6, 3)
+    assert pixels[..., 2].min() > 200
+    assert pixels[..., 0].max() < 50
+
+
+def test_preview_bayer_is_binned():
+    data = numpy.ones((4, 6), dtype=numpy.uint16)
+    array = VideoHelper.video_frame_2_array("BAYER_RG16", 6, 4, data.tobytes())
+    numpy.testing.assert_array_equal(array, numpy.full((2, 3), 4))
+
+
+def test_preview_unsupported():
+    assert not VideoHelper.is_preview_supported("YUV422")
+    with pytest.raises(ValueError):
+        VideoHelper.VideoPreviewEncoder("NONE").encode("Y8", 1, 1, b"\0")
+    with pytest.raises(ValueError):
+        VideoHelper.VideoPreviewEncoder("GIF")